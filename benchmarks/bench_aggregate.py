@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Time and peak memory of aggregate() with several aggregates per group.
+
+Run from the repository root with `python -m benchmarks.bench_aggregate [rows]`.
+"""
+
+import random
+import sys
+import timeit
+import tracemalloc
+
+from pyrql import Query
+
+EXPRESSIONS = [
+    "sum(value)",
+    "mean(value)",
+    "aggregate(group,sum(value))",
+    "aggregate(group,count(),min(value),max(value),mean(value))",
+    "aggregate(small,sum(value),mean(value))",
+    "aggregate(small,median(value),stddev(value))",
+    "percentile(value,90)",
+    "approx_percentile(value,90)",
+    "approx_count_distinct(value)",
+    "aggregate(small,approx_percentile(value,50))",
+    "aggregate(small,approx_count_distinct(group))",
+]
+
+
+def make_data(rows):
+    random.seed(0)
+    return [
+        {
+            "group": random.randint(0, 999),
+            "small": random.randint(0, 9),
+            "value": random.randint(0, 1000),
+        }
+        for _ in range(rows)
+    ]
+
+
+def bench(func, number=3):
+    return min(timeit.repeat(func, number=1, repeat=number)) * 1000
+
+
+def peak(func):
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2**20
+
+
+def main(rows=1_000_000):
+    data = make_data(rows)
+
+    print(f"{rows} rows")
+    print(f"{'expression':<64}{'ms':>10}{'peak MiB':>10}")
+    for expr in EXPRESSIONS:
+        query = Query(data, isolate=False).query(expr)
+        print(f"{expr:<64}{bench(query.all):>10.2f}{peak(query.all):>10.2f}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Time of the same queries on rows and on columns with the NumPy backend.
+
+Run from the repository root with `python -m benchmarks.bench_columnar [rows]`.
+"""
+
+import random
+import sys
+import timeit
+
+from pyrql import Query
+from pyrql.columnar import ColumnarQuery
+
+EXPRESSIONS = [
+    "lt(value,100)",
+    "and(gt(value,500),in(state,(CA,NY)))&count()",
+    "sort(-state,+value)&limit(10)",
+    "sum(value)",
+    "aggregate(group,count(),sum(value),mean(value))",
+    "aggregate((state,group),max(value))",
+]
+
+
+def make_data(rows):
+    random.seed(0)
+    return [
+        {
+            "group": random.randint(0, 999),
+            "state": random.choice(["CA", "NY", "TX", "WA"]),
+            "value": random.randint(0, 1000),
+        }
+        for _ in range(rows)
+    ]
+
+
+def bench(func, number=3):
+    return min(timeit.repeat(func, number=1, repeat=number)) * 1000
+
+
+def main(rows=1_000_000):
+    data = make_data(rows)
+    convert = bench(lambda: ColumnarQuery(data), number=1)
+    columnar = ColumnarQuery(data)
+
+    print(f"{rows} rows, {convert:.2f} ms to convert")
+    print(f"{'expression':<52}{'rows':>10}{'columns':>10}  (ms)")
+    for expr in EXPRESSIONS:
+        before = bench(Query(data, isolate=False).query(expr).all)
+        after = bench(columnar.query(expr).all)
+        print(f"{expr:<52}{before:>10.2f}{after:>10.2f}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Query time with and without indexes on the filtered and sorted keys.
+
+Run from the repository root with `python -m benchmarks.bench_index [rows]`.
+"""
+
+import random
+import sys
+import timeit
+
+from pyrql import Query
+
+EXPRESSIONS = [
+    "eq(status,open)",
+    "eq(owner.id,42)",
+    "in(owner.id,(1,2,3,4,5,6,7,8,9,10))",
+    "eq(status,open)&eq(owner.id,42)",
+    "eq(owner.id,42)&gt(score,500)&sort(-score)",
+    "ge(created,1000)&lt(created,2000)",
+    "ge(created,1000)&lt(created,2000)&sort(-created)",
+    "sort(created)",
+    "sort(-created)&limit(10)",
+    "eq(status,open)&sort(created)",
+]
+
+
+def make_data(rows):
+    random.seed(0)
+    return [
+        {
+            "status": random.choice(["open", "closed", "pending", "review"]),
+            "owner": {"id": random.randint(0, 999)},
+            "score": random.randint(0, 1000),
+            "created": random.randint(0, 100_000),
+        }
+        for _ in range(rows)
+    ]
+
+
+def bench(func, number=5):
+    return min(timeit.repeat(func, number=1, repeat=number)) * 1000
+
+
+def main(rows=100_000):
+    data = make_data(rows)
+    plain = Query(data, isolate=False)
+    indexed = Query(
+        data, isolate=False, indexes=["status", "owner.id"], sorted_indexes=["created"]
+    )
+
+    print(f"{rows} rows")
+    print(f"{'expression':<48}{'scan':>10}{'index':>10}  (ms)")
+    for expr in EXPRESSIONS:
+        before = bench(plain.query(expr).all)
+        after = bench(indexed.query(expr).all)
+        print(f"{expr:<48}{before:>10.3f}{after:>10.3f}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Per row time of each filter node, with flat and nested keys.
+
+Run from the repository root with `python -m benchmarks.bench_nodes [rows]`.
+"""
+
+import random
+import sys
+import timeit
+
+import pyrql
+
+EXPRESSIONS = [
+    "eq(a,5)",
+    "ne(a,5)",
+    "lt(a,5)",
+    "eq(a,key(b))",
+    "in(a,(1,2,3,4,5))",
+    "out(a,(1,2,3,4,5))",
+    "contains(tags,x)",
+    "excludes(tags,x)",
+    "or(eq(a,1),eq(b,2))",
+    "and(gt(a,1),lt(b,8))",
+    "eq(n.a,5)",
+    "in(n.a,(1,2,3,4,5))",
+    "contains(n.tags,x)",
+]
+
+
+def make_data(rows):
+    random.seed(0)
+    data = []
+    for _ in range(rows):
+        row = {
+            "a": random.randint(0, 9),
+            "b": random.randint(0, 9),
+            "tags": random.sample("xyzw", 2),
+        }
+        row["n"] = dict(row)
+        data.append(row)
+
+    return data
+
+
+def bench(func, number=5):
+    return min(timeit.repeat(func, number=1, repeat=number))
+
+
+def main(rows=100_000):
+    data = make_data(rows)
+
+    print(f"{rows} rows")
+    print(f"{'expression':<28}{'ns/row':>10}")
+    for expr in EXPRESSIONS:
+        compiled = pyrql.compile(expr, isolate=False)
+        seconds = bench(lambda: compiled.run(data))
+        print(f"{expr:<28}{seconds / rows * 1e9:>10.1f}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
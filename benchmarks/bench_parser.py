@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Parse time for deeply nested and/or groups, with and without packrat.
+
+Run from the repository root with `python -m benchmarks.bench_parser [max_depth]`.
+"""
+
+import sys
+import timeit
+
+from pyrql import Parser
+from pyrql import RQLSyntaxError
+from pyrql import disable_packrat
+from pyrql import enable_packrat
+
+
+def nested_or(depth):
+    # ((((a=1|b0=2)|b1=2)|b2=2)...)
+    return "(" * depth + "a=1" + "".join(f"|b{i}=2)" for i in range(depth))
+
+
+def nested_calls(depth):
+    # and(or(and(or(eq(a,1),...
+    expr = "eq(a,1)"
+    for i in range(depth):
+        op = "and" if i % 2 else "or"
+        expr = f"{op}({expr},eq(b{i},{i}))"
+    return expr
+
+
+def nested_invalid(depth):
+    # groups only accept '|', so this backtracks through every level
+    return "(" * depth + "a=1&b=2" + ")" * depth
+
+
+CASES = [
+    ("nested or groups", nested_or),
+    ("nested and/or calls", nested_calls),
+    ("nested invalid groups", nested_invalid),
+]
+
+
+def bench(parser, expr, number=3):
+    def run():
+        try:
+            parser.parse(expr)
+        except RQLSyntaxError:
+            pass
+
+    return min(timeit.repeat(run, number=1, repeat=number)) * 1000
+
+
+def main(max_depth=6):
+    depths = range(1, max_depth + 1)
+    default = Parser()
+    fast = Parser(engine="fast")
+
+    print(f"{'case':<24}{'depth':>6}{'default':>12}{'packrat':>12}{'fast':>12}  (ms)")
+    for name, build in CASES:
+        for depth in depths:
+            expr = build(depth)
+
+            disable_packrat()
+            before = bench(default, expr)
+
+            enable_packrat()
+            after = bench(default, expr)
+            disable_packrat()
+
+            fast_time = bench(fast, expr)
+
+            print(f"{name:<24}{depth:>6}{before:>12.2f}{after:>12.2f}{fast_time:>12.2f}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
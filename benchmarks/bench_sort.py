@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Sort time for 1 to 5 keys with mixed directions, comparing one stable sort
+per key, as the sort node does, with a single sort on a composite key.
+
+Run from the repository root with `python -m benchmarks.bench_sort [rows]`.
+"""
+
+import datetime
+import operator
+import random
+import sys
+import timeit
+from itertools import count
+
+from pyrql import Query
+from pyrql.query import _sort_columns
+
+KEYS = ["+group", "-score", "+name", "-date", "+nested.value"]
+
+
+def make_data(rows):
+    random.seed(0)
+    start = datetime.date(2000, 1, 1)
+    return [
+        {
+            "group": random.randint(0, 9),
+            "score": random.randint(0, 1000),
+            "name": random.choice("abcdefghijklmnopqrstuvwxyz") * 3,
+            "date": start + datetime.timedelta(days=random.randint(0, 365)),
+            "nested": {"value": random.random()},
+        }
+        for _ in range(rows)
+    ]
+
+
+def composite(data, keys):
+    # a single sort on tuples of the key values, with descending values
+    # negated or wrapped
+    data = list(data)
+    desc = [prefix == "-" for prefix, key in keys]
+    columns = _sort_columns([key for prefix, key in keys], desc, data)
+    return [row[-1] for row in sorted(zip(*columns, count(), data))]
+
+
+def composite_key(data, keys):
+    # a single sort with a key function building the tuples
+    getters = [(operator.itemgetter(key), prefix == "-") for prefix, key in keys]
+    return sorted(data, key=lambda row: tuple(-g(row) if d else g(row) for g, d in getters))
+
+
+def bench(func, number=3):
+    return min(timeit.repeat(func, number=1, repeat=number)) * 1000
+
+
+def main(rows=1_000_000):
+    data = make_data(rows)
+    numbers = [{k: v for k, v in row.items() if k in ("group", "score")} for row in data]
+
+    print(f"{rows} rows")
+    print(f"{'keys':<44}{'per key':>12}{'composite':>12}  (ms)")
+    for n in range(1, len(KEYS) + 1):
+        keys = KEYS[:n]
+        query = Query(data, isolate=False).query(f"sort({','.join(keys)})")
+        before = bench(query.all)
+        after = bench(lambda: composite(data, [(k[0], k[1:]) for k in keys]))
+
+        print(f"{','.join(keys):<44}{before:>12.2f}{after:>12.2f}")
+
+    # numbers only, where descending keys can be negated in the key function
+    keys = [("+", "group"), ("-", "score")]
+    query = Query(numbers, isolate=False).query("sort(+group,-score)")
+    before = bench(query.all)
+    after = bench(lambda: composite_key(numbers, keys))
+    print(f"{'+group,-score (key function)':<44}{before:>12.2f}{after:>12.2f}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -1,9 +1,16 @@
 # -*- coding: utf-8 -*-
 
+from pyrql.cache import ResultCache
 from pyrql.exceptions import RQLError
 from pyrql.exceptions import RQLQueryError
 from pyrql.exceptions import RQLSyntaxError
+from pyrql.instrument import instrument
+from pyrql.normalize import ast_hash
+from pyrql.normalize import normalize
 from pyrql.parser import Parser
+from pyrql.parser import disable_packrat
+from pyrql.parser import enable_packrat
+from pyrql.query import CompiledQuery
 from pyrql.query import Query
 from pyrql.unparser import Unparser
 
@@ -17,4 +24,21 @@ parse = Parser().parse
 
 unparse = Unparser().unparse
 
-__all__ = ["parse", "unparse", "Query", "RQLError", "RQLQueryError", "RQLSyntaxError"]
+compile = CompiledQuery
+
+__all__ = [
+    "parse",
+    "unparse",
+    "compile",
+    "enable_packrat",
+    "disable_packrat",
+    "instrument",
+    "normalize",
+    "ast_hash",
+    "CompiledQuery",
+    "Query",
+    "ResultCache",
+    "RQLError",
+    "RQLQueryError",
+    "RQLSyntaxError",
+]
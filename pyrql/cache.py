@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from collections import OrderedDict
+from collections import namedtuple
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "evictions", "maxsize", "currsize"])
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize=128):
+        if maxsize is None or maxsize < 1:
+            raise ValueError("maxsize must be a positive integer")
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self._data))
+
+
+ResultCacheInfo = namedtuple(
+    "ResultCacheInfo",
+    ["hits", "misses", "evictions", "maxsize", "currsize", "rows", "max_rows"],
+)
+
+
+def _rows(value):
+    # results are lists of rows, or a single value from count(), first(), etc
+    return len(value) if isinstance(value, list) else 1
+
+
+class ResultCache:
+    # query results by key, evicting the least recently used when there are
+    # more than maxsize results or max_rows rows in total, and expiring them
+    # ttl seconds after they're stored
+
+    def __init__(self, maxsize=128, ttl=None, max_rows=None, timer=time.monotonic):
+        if maxsize is None or maxsize < 1:
+            raise ValueError("maxsize must be a positive integer")
+
+        if ttl is not None and ttl <= 0:
+            raise ValueError("ttl must be a positive number")
+
+        if max_rows is not None and max_rows < 1:
+            raise ValueError("max_rows must be a positive integer")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rows = 0
+
+        # key -> (value, rows, expiration time)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[2] is not None and entry[2] <= self.timer():
+                self._pop(key)
+                entry = _MISSING
+
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        rows = _rows(value)
+        if self.max_rows is not None and rows > self.max_rows:
+            # it would evict everything else and still not fit
+            return
+
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+
+            expires = self.timer() + self.ttl if self.ttl is not None else None
+            self._data[key] = (value, rows, expires)
+            self.rows += rows
+
+            while len(self._data) > self.maxsize or (
+                self.max_rows is not None and self.rows > self.max_rows
+            ):
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = self.rows = 0
+
+    def info(self):
+        return ResultCacheInfo(
+            self.hits,
+            self.misses,
+            self.evictions,
+            self.maxsize,
+            len(self._data),
+            self.rows,
+            self.max_rows,
+        )
+
+    def _pop(self, key):
+        value, rows, expires = self._data.pop(key)
+        self.rows -= rows
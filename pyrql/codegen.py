@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+from .query import And
+from .query import Contains
+from .query import Excludes
+from .query import In
+from .query import Key
+from .query import Or
+from .query import Out
+from .query import RowNode
+from .query import _Filter
+from .query import _members
+from .query import _node_name
+
+# Compiles a tree of row nodes into a single Python function evaluating one
+# flat boolean expression, instead of a chain of nested predicate calls.
+#
+# Only generated names and operators are written into the source. Keys,
+# values and anything else coming from the query are bound as arguments of
+# a factory function, so they're closure variables of the predicate.
+
+OPERATORS = {
+    "eq": "==",
+    "ne": "!=",
+    "lt": "<",
+    "le": "<=",
+    "gt": ">",
+    "ge": ">=",
+}
+
+
+class _Source:
+    def __init__(self):
+        self.constants = []
+
+    def constant(self, value):
+        self.constants.append(value)
+        return f"_c{len(self.constants) - 1}"
+
+    def key(self, key):
+        expr = "row"
+        for name in key.args:
+            expr += f".get({self.constant(name)})"
+        return expr
+
+    def call(self, node):
+        # anything we can't inline is called through its own predicate
+        return f"{self.constant(getattr(node, 'predicate', node))}(row)"
+
+    def expr(self, node):
+        if isinstance(node, _Filter):
+            key = self.key(node.key)
+            if isinstance(node.value, Key):
+                value = self.key(node.value)
+            else:
+                value = self.constant(node.value)
+            return f"({key} {OPERATORS[node.name]} {value})"
+
+        if isinstance(node, (In, Out)):
+            if _members(node.value) is not None:
+                # set lookups need a fallback for unhashable values
+                return self.call(node)
+
+            op = "in" if isinstance(node, In) else "not in"
+            return f"({self.key(node.key)} {op} {self.constant(node.value)})"
+
+        if isinstance(node, (Contains, Excludes)):
+            op = "in" if isinstance(node, Contains) else "not in"
+            return f"({self.constant(node.value)} {op} {self.key(node.key)})"
+
+        if isinstance(node, (And, Or)):
+            args = [self.expr(arg) for arg in node.args if arg is not None]
+            if not args:
+                return "True" if isinstance(node, And) else "False"
+
+            op = " and " if isinstance(node, And) else " or "
+            return f"({op.join(args)})"
+
+        return self.call(node)
+
+
+def compile_predicate(node):
+    source = _Source()
+    expr = source.expr(node)
+    names = ", ".join(f"_c{i}" for i in range(len(source.constants)))
+
+    code = (
+        f"def _factory({names}):\n"
+        f"    def predicate(row):\n"
+        f"        return {expr}\n"
+        f"    return predicate\n"
+    )
+
+    namespace = {}
+    exec(compile(code, "<rql predicate>", "exec"), namespace)
+
+    predicate = namespace["_factory"](*source.constants)
+    predicate.source = code
+    return predicate
+
+
+class _GeneratedFilter(RowNode):
+    def __init__(self, node):
+        self.args = (node,)
+        self.node = node
+        self.predicate = compile_predicate(node)
+
+    @property
+    def name(self):
+        return _node_name(self.node)
+
+    def __str__(self):
+        return str(self.node)
+
+    def explain(self):
+        return {**self.node.explain(), "fast_path": "codegen"}
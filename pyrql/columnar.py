@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+
+import math
+from collections.abc import Iterator
+from collections.abc import Mapping
+from copy import deepcopy
+from fractions import Fraction
+from functools import reduce
+
+from .query import Aggregate
+from .query import And
+from .query import CompiledQuery
+from .query import Count
+from .query import In
+from .query import Key
+from .query import Limit
+from .query import Max
+from .query import Mean
+from .query import Min
+from .query import Or
+from .query import Out
+from .query import Query
+from .query import RowNode
+from .query import Select
+from .query import Slice
+from .query import Sort
+from .query import Sum
+from .query import Values
+from .query import _Filter
+from .query import _fsum_partials
+from .query import _node_error
+from .query import _TopK
+
+try:
+    import numpy as np
+except ImportError as exc:  # pragma: no cover
+    raise ImportError("pyrql.columnar requires numpy") from exc
+
+# Runs queries on a table stored as one NumPy array per key, instead of a
+# list of dicts. Filters become boolean masks, sort a single lexsort, and
+# the common aggregates are reductions over the arrays, all giving the same
+# results as the row engine.
+#
+# Anything else, like nested keys, values of other types or nodes without a
+# vectorized version, converts the table to rows at that point, and the rest
+# of the pipeline runs on the row engine as usual.
+
+# numbers, including bools, and strings
+KINDS = "biufU"
+
+_TYPES = {int, float, bool, str}
+
+
+def _array(values):
+    if isinstance(values, np.ndarray):
+        return values
+
+    values = list(values)
+    # numpy would convert mixed types to a common one, so only a single
+    # type of scalar gets an array of that type, and anything else is kept
+    # as is in an array of objects
+    types = set(map(type, values))
+    if len(types) == 1 and types <= _TYPES:
+        try:
+            return np.array(values)
+        except OverflowError:
+            pass
+
+    return np.fromiter(values, dtype=object, count=len(values))
+
+
+class Columns:
+    # a table as arrays of the same length, one for each key
+
+    def __init__(self, data, length=None):
+        if isinstance(data, Columns):
+            data, length = data.arrays, data.length
+        elif not isinstance(data, Mapping):
+            # rows must all have the same keys, since there's no way to tell
+            # a missing value in a column from a None
+            data = list(data)
+            names = list(data[0]) if data else []
+            if any(row.keys() != data[0].keys() for row in data):
+                raise ValueError("All rows must have the same keys")
+
+            data, length = {name: [row[name] for row in data] for name in names}, len(data)
+
+        self.arrays = {str(name): _array(values) for name, values in data.items()}
+        if any(array.ndim != 1 for array in self.arrays.values()):
+            raise ValueError("Columns must be one dimensional")
+
+        lengths = {len(array) for array in self.arrays.values()}
+        if len(lengths) > 1:
+            raise ValueError("All columns must have the same length")
+
+        self.length = lengths.pop() if lengths else length or 0
+
+    def __len__(self):
+        return self.length
+
+    def column(self, key):
+        # the array for a key, or None if it can't be computed on
+        if len(key.args) != 1:
+            return None
+
+        array = self.arrays.get(key.args[0])
+        if array is None or array.dtype.kind not in KINDS:
+            return None
+
+        return array
+
+    def take(self, index):
+        # a slice, a boolean mask or an array of positions
+        if isinstance(index, slice):
+            length = len(range(self.length)[index])
+        else:
+            length = int(np.count_nonzero(index)) if index.dtype.kind == "b" else len(index)
+
+        return Columns({name: array[index] for name, array in self.arrays.items()}, length)
+
+    def rows(self, copy=False):
+        # values of numpy types are converted to new Python objects anyway,
+        # so only arrays of objects have to be copied
+        names = list(self.arrays)
+        columns = [
+            deepcopy(array.tolist()) if copy and array.dtype.kind == "O" else array.tolist()
+            for array in self.arrays.values()
+        ]
+        if not names:
+            return [{} for _ in range(self.length)]
+
+        return [dict(zip(names, values)) for values in zip(*columns)]
+
+
+def _kind(value):
+    # arrays and values that can be compared with each other have the same
+    # kind, numbers or strings
+    if isinstance(value, np.ndarray):
+        return "U" if value.dtype.kind == "U" else "n"
+
+    if type(value) in _TYPES:
+        return "U" if isinstance(value, str) else "n"
+
+    return None
+
+
+def _exact(a, b):
+    # numpy compares integers with floats as float64, where integers from
+    # 2 ** 53 up can't all be told apart, unlike Python
+    kinds = [
+        x.dtype.kind if isinstance(x, np.ndarray) else "f" if isinstance(x, float) else "i"
+        for x in (a, b)
+    ]
+    if not ("f" in kinds and ("i" in kinds or "u" in kinds)):
+        return True
+
+    floats = a if kinds[0] == "f" else b
+    return not np.any(np.abs(floats) >= 2**53)
+
+
+def _mask(node, table):
+    # a boolean array selecting the rows where a filter is true, or None
+    if isinstance(node, (And, Or)):
+        masks = [_mask(arg, table) for arg in node.args if arg is not None]
+        if any(mask is None for mask in masks):
+            return None
+
+        if not masks:
+            return np.full(len(table), isinstance(node, And))
+
+        return reduce(np.logical_and if isinstance(node, And) else np.logical_or, masks)
+
+    if isinstance(node, _Filter):
+        array = table.column(node.key)
+        value = table.column(node.value) if isinstance(node.value, Key) else node.value
+        if array is None or value is None or _kind(array) != _kind(value):
+            return None
+
+        if not _exact(array, value):
+            return None
+
+        return node.op(array, value)
+
+    if isinstance(node, (In, Out)):
+        array = table.column(node.key)
+        # in() on a string is a substring test, so only arrays are vectorized
+        if array is None or not isinstance(node.value, tuple):
+            return None
+
+        if any(_kind(value) != _kind(array) or not _exact(array, value) for value in node.value):
+            return None
+
+        mask = np.isin(array, list(node.value))
+        return mask if isinstance(node, In) else ~mask
+
+    return None
+
+
+def _order(table, sort):
+    # the positions of the rows in sort order, or None
+    if not sort.keys:
+        return None
+
+    columns = []
+    for key, desc in zip(sort.keys, sort.desc):
+        array = table.column(Key(key)) if isinstance(key, str) and "." not in key else None
+        # numpy puts NaN last, but Python's sort leaves it where it is
+        if array is None or _has_nan(array):
+            return None
+
+        if desc or array.dtype.kind not in "if":
+            # the rank of each value is an integer, for any type, and it
+            # can be negated for a descending sort
+            array = np.unique(array, return_inverse=True)[1].reshape(-1)
+
+        columns.append(-array if desc else array)
+
+    # lexsort is stable and takes the most significant key last
+    return np.lexsort(columns[::-1])
+
+
+def _has_nan(array):
+    return array.dtype.kind == "f" and bool(np.isnan(array).any())
+
+
+def _groups(table, keys):
+    # the group of each row, numbered in order of first appearance like the
+    # dicts of the row engine, and the position of the first row of each
+    codes = np.zeros(len(table), dtype=np.intp)
+    for key in keys:
+        array = table.column(key)
+        # NaN is never equal to itself, so each one is a group of its own
+        if array is None or _has_nan(array):
+            return None
+
+        values, inverse = np.unique(array, return_inverse=True)
+        codes = np.unique(codes * len(values) + inverse.reshape(-1), return_inverse=True)[1]
+
+    _, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[inverse.reshape(-1)], first[order]
+
+
+def _exact_sum(array):
+    # like Sum and Mean, floats are added exactly
+    finite = np.isfinite(array)
+    if not finite.all():
+        return float(array[~finite].sum())
+
+    return sum(map(Fraction, _fsum_partials(array.tolist())), Fraction(0))
+
+
+def _reduce(aggr, table, groups, size):
+    # the value of an aggregate for each group, as a list, or None
+    if type(aggr) is Count:
+        return np.bincount(groups, minlength=size).tolist()
+
+    if type(aggr) not in (Sum, Mean, Min, Max):
+        return None
+
+    array = table.column(aggr.key)
+    if array is None or array.dtype.kind not in "biuf":
+        return None
+
+    if type(aggr) in (Min, Max):
+        # the result of min() and max() with NaN depends on the order
+        if _has_nan(array):
+            return None
+
+        order = np.argsort(groups, kind="stable")
+        starts = np.searchsorted(groups[order], np.arange(size))
+        ufunc = np.minimum if type(aggr) is Min else np.maximum
+        return ufunc.reduceat(array[order], starts).tolist()
+
+    if array.dtype.kind == "f":
+        order = np.argsort(groups, kind="stable")
+        starts = np.searchsorted(groups[order], np.arange(size))
+        parts = np.split(array[order], starts[1:])
+        try:
+            sums = [_exact_sum(part) for part in parts]
+            if type(aggr) is Sum:
+                return [float(total) for total in sums]
+
+            return [float(total / len(part)) for total, part in zip(sums, parts)]
+        except OverflowError:
+            # a sum too large for a float, left to the row engine
+            return None
+
+    # integer sums are exact in Python, so they can't overflow here
+    bound = max(abs(int(array.min())), abs(int(array.max())))
+    if bound * len(array) >= 2**63:
+        return None
+
+    order = np.argsort(groups, kind="stable")
+    starts = np.searchsorted(groups[order], np.arange(size))
+    totals = np.add.reduceat(array[order].astype(np.int64), starts).tolist()
+
+    if type(aggr) is Sum:
+        return totals
+
+    # like Mean, the mean of integers is an integer if exact
+    counts = np.bincount(groups, minlength=size).tolist()
+    return [
+        total // count if isinstance(total, int) and not total % count else total / count
+        for total, count in zip(totals, counts)
+    ]
+
+
+def _filter(node, table):
+    mask = _mask(node, table)
+    return NotImplemented if mask is None else table.take(mask)
+
+
+def _sort(node, table):
+    order = _order(table, node)
+    return NotImplemented if order is None else table.take(order)
+
+
+def _top_k(node, table):
+    order = _order(table, node.sort)
+    if order is None:
+        return NotImplemented
+
+    return table.take(order[node.offset : node.offset + node.count])
+
+
+def _limit(node, table):
+    limit, offset = node.args
+    if offset:
+        table = table.take(slice(offset, None))
+
+    if limit and limit != float("inf"):
+        table = table.take(slice(None, limit))
+
+    return table
+
+
+def _slice(node, table):
+    if len(node.args) > 3:
+        return NotImplemented
+
+    return table.take(slice(*node.args))
+
+
+def _select(node, table):
+    arrays = {}
+    for key in node.keys:
+        if len(key.args) != 1 or key.args[0] not in table.arrays:
+            return NotImplemented
+
+        arrays[str(key)] = table.arrays[key.args[0]]
+
+    return Columns(arrays, len(table))
+
+
+def _values(node, table):
+    array = table.column(node.key)
+    return NotImplemented if array is None else array.tolist()
+
+
+def _count(node, table):
+    return len(table)
+
+
+def _aggregate_all(node, table):
+    # an aggregate of the whole table is a single group
+    if not len(table):
+        return NotImplemented
+
+    result = _reduce(node, table, np.zeros(len(table), dtype=np.intp), 1)
+    return NotImplemented if result is None else result[0]
+
+
+def _aggregate(node, table):
+    if not len(table):
+        return NotImplemented
+
+    groups = _groups(table, node.keys)
+    if groups is None:
+        return NotImplemented
+
+    groups, first = groups
+    results = [_reduce(aggr, table, groups, len(first)) for aggr in node.aggrs]
+    if any(result is None for result in results):
+        return NotImplemented
+
+    names = [str(key) for key in node.keys] + [str(aggr) for aggr in node.aggrs]
+    values = [table.column(key)[first].tolist() for key in node.keys] + results
+    return [dict(zip(names, row)) for row in zip(*values)]
+
+
+HANDLERS = {
+    Sort: _sort,
+    _TopK: _top_k,
+    Limit: _limit,
+    Slice: _slice,
+    Select: _select,
+    Values: _values,
+    Count: _count,
+    Sum: _aggregate_all,
+    Mean: _aggregate_all,
+    Min: _aggregate_all,
+    Max: _aggregate_all,
+    Aggregate: _aggregate,
+}
+
+
+class ColumnarCompiledQuery(CompiledQuery):
+    def run(self, data, indexes=None, isolate=None):
+        data = data if isinstance(data, Columns) else Columns(data)
+        return super().run(data, indexes, isolate)
+
+    def _run_node(self, node, data):
+        if isinstance(data, Columns):
+            handler = _filter if isinstance(node, RowNode) else HANDLERS.get(type(node))
+            if handler is not None:
+                try:
+                    result = handler(node, data)
+                except Exception as exc:
+                    raise _node_error(node, exc) from exc
+
+                if result is not NotImplemented:
+                    return result
+
+            # the rest of the pipeline runs on rows
+            data = data.rows(copy=self.isolate)
+
+        return super()._run_node(node, data)
+
+    def _count_rows(self, data):
+        return len(data) if isinstance(data, Columns) else super()._count_rows(data)
+
+    def _result(self, data):
+        # rows converted from the columns are already copies if needed
+        if isinstance(data, Columns):
+            return data.rows(copy=self.isolate)
+
+        if isinstance(data, Iterator):
+            data = list(data)
+
+        return data
+
+
+class ColumnarQuery(Query):
+    # a query on a dict of arrays, or on a list of dicts converted once to
+    # columns, with the same results as a Query on the rows
+    def __init__(
+        self,
+        data,
+        default_limit=None,
+        max_limit=None,
+        parser=None,
+        isolate=True,
+        cache=None,
+        version=None,
+    ):
+        super().__init__(Columns(data), cache=cache, version=version)
+        self.compiled = ColumnarCompiledQuery(
+            default_limit=default_limit,
+            max_limit=max_limit,
+            parser=parser,
+            isolate=isolate,
+        )
+
+    def create_index(self, key, sorted=False):
+        # masks over the arrays are already faster than index lookups on rows
+        raise TypeError("Columnar queries don't support indexes")
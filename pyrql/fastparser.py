@@ -0,0 +1,538 @@
+# -*- coding: utf-8 -*-
+
+import re
+from datetime import datetime
+from decimal import Decimal
+from urllib.parse import unquote
+from uuid import UUID
+
+from .exceptions import RQLSyntaxError
+
+# A hand-written recursive descent parser for the grammar defined with
+# pyparsing in grammar.py.
+#
+# RQL tokens are context dependent: strings may contain spaces and colons,
+# keywords are only recognized in some positions, and numbers and strings are
+# disambiguated by the longest match. Instead of a separate tokenizer pass,
+# each terminal is scanned with a single regular expression at the position
+# where the grammar expects it. Alternatives are tried in the same order as
+# the pyparsing grammar, and errors are reported with the same location and
+# message pyparsing would use, so both engines are interchangeable.
+#
+# Every rule returns a (value, end) tuple on success. On failure it returns
+# None and leaves the error pyparsing would raise in self.error.
+
+WHITESPACE = " \n\t\r"
+
+# pyparsing.Keyword.DEFAULT_KEYWORD_CHARS
+KEYWORD_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_$")
+
+# pyparsing_common.identifier
+NAME = re.compile(r"[A-Z_a-zªµºÀ-ÖØ-öø-ÿ][0-9A-Z_a-zªµ·ºÀ-ÖØ-öø-ÿ]*")
+
+# pyparsing_common.number is sci_real | real | signed_integer, but any real
+# number is also matched by sci_real
+REAL = re.compile(r"[+-]?(?:\d+(?:[eE][+-]?\d+)|(?:\d+\.\d*|\.\d+)(?:[eE][+-]?\d+)?)")
+INTEGER = re.compile(r"[+-]?\d+")
+
+# one or more unreserved, percent-encoded or reserved characters
+STRING = re.compile(r"(?:[\w\-:.~ @!*+$]|%[0-9A-Fa-f]{2})+")
+PCT_ENCODED = re.compile(r"%[0-9A-Fa-f]{2}")
+
+ISO8601_DATE = re.compile(r"(?P<year>\d{4})(?:-(?P<month>\d\d)(?:-(?P<day>\d\d))?)?")
+ISO8601_DATETIME = re.compile(
+    r"(?P<year>\d{4})-(?P<month>\d\d)-(?P<day>\d\d)[T ]"
+    r"(?P<hour>\d\d):(?P<minute>\d\d)(:(?P<second>\d\d(\.\d*)?)?)?"
+    r"(?P<tz>Z|[+-]\d\d:?\d\d)?"
+)
+
+TYPES = ("decimal", "uuid", "epoch", "datetime", "date", "number", "boolean", "string")
+CONSTANTS = {"true": True, "false": False, "null": None}
+
+# the messages pyparsing uses for terminals that aren't simple literals
+EXPECTED_STRING = "Expected ( -.0-:A-Z_a-z...)"
+EXPECTED_PCT_ENCODED = "Expected W:(0-9A-Fa-f){2}"
+EXPECTED_NUMBER = "Expected number"
+EXPECTED_NAME = "Expected identifier"
+
+
+def _unquote(match):
+    return unquote(match.group())
+
+
+def _dateparse(value):
+    # dateutil is slow to import and only needed for typed dates
+    from dateutil.parser import parse
+
+    return parse(value)
+
+
+def _first_error(errors):
+    # like pyparsing.MatchFirst, report the error from the alternative
+    # that got further, or the first one in case of a tie
+    best = errors[0]
+    for error in errors[1:]:
+        if error[0] > best[0]:
+            best = error
+    return best
+
+
+class _RecursiveDescent:
+    def __init__(self, expr):
+        # pyparsing expands tabs before parsing
+        self.s = expr.expandtabs()
+        self.n = len(self.s)
+        self.error = (0, "")
+
+    def parse(self):
+        r = self.query(0)
+        if r is None:
+            raise RQLSyntaxError(self.s, *self.error)
+
+        value, p = r
+        p = self.skip(p)
+        if p < self.n:
+            raise RQLSyntaxError(self.s, p, "Expected end of text")
+
+        return value
+
+    def fail(self, p, msg):
+        self.error = (p, msg)
+
+    # terminals
+
+    def skip(self, p):
+        s = self.s
+        n = self.n
+        while p < n and s[p] in WHITESPACE:
+            p += 1
+        return p
+
+    def literal(self, c, p):
+        p = self.skip(p)
+        if p < self.n and self.s[p] == c:
+            return p + 1
+
+        self.fail(p, f"Expected {c!r}")
+        return -1
+
+    def keyword(self, word, p):
+        p = self.skip(p)
+        s = self.s
+        end = p + len(word)
+        msg = f"Expected Keyword {word!r}"
+
+        if s.startswith(word, p):
+            if p > 0 and s[p - 1] in KEYWORD_CHARS:
+                self.fail(p - 1, msg + ", keyword was immediately preceded by keyword character")
+                return -1
+
+            if end < self.n and s[end] in KEYWORD_CHARS:
+                self.fail(end, msg + ", keyword was immediately followed by keyword character")
+                return -1
+
+            return end
+
+        self.fail(p, msg)
+        return -1
+
+    def name(self, p):
+        p = self.skip(p)
+        m = NAME.match(self.s, p)
+        if m is None:
+            self.fail(p, EXPECTED_NAME)
+            return None
+
+        return m.group(), m.end()
+
+    def number(self, p):
+        p = self.skip(p)
+        m = REAL.match(self.s, p)
+        if m is not None:
+            return float(m.group()), m.end()
+
+        m = INTEGER.match(self.s, p)
+        if m is not None:
+            return int(m.group()), m.end()
+
+        self.fail(p, EXPECTED_NUMBER)
+        return None
+
+    def string(self, p):
+        p = self.skip(p)
+        m = STRING.match(self.s, p)
+        text = "" if m is None else m.group()
+
+        if not text.isascii():
+            # \w also matches characters that are numeric, but neither
+            # digits nor alphabetic, which pyparsing doesn't accept
+            for i, c in enumerate(text):
+                if c.isnumeric() and not (c.isdigit() or c.isalpha()):
+                    text = text[:i]
+                    break
+
+        if not text:
+            if self.s.startswith("%", p):
+                self.fail(p + 1, EXPECTED_PCT_ENCODED)
+            else:
+                self.fail(p, EXPECTED_STRING)
+            return None
+
+        end = p + len(text)
+        if "%" in text:
+            text = PCT_ENCODED.sub(_unquote, text)
+
+        return text, end
+
+    # values
+
+    def value(self, p):
+        p = self.skip(p)
+        c = self.s[p] if p < self.n else ""
+        errors = []
+
+        r = self.typed_value(p)
+        if r is not None:
+            return r
+        errors.append(self.error)
+
+        if c == "(":
+            r = self.array(p)
+            if r is not None:
+                return r
+            errors.append(self.error)
+        else:
+            errors.append((p, "Expected '('"))
+
+        for word, constant in CONSTANTS.items():
+            q = self.keyword(word, p)
+            if q >= 0:
+                return constant, q
+            errors.append(self.error)
+
+        # longest match between a number and a string, with the number
+        # winning when both have the same length
+        n = self.number(p)
+        if n is None:
+            errors.append(self.error)
+
+        r = self.string(p)
+        if n is not None and (r is None or n[1] >= r[1]):
+            return n
+
+        if r is None:
+            if n is None:
+                errors.append(self.error)
+            self.error = _first_error(errors)
+
+        return r
+
+    def typed_value(self, p):
+        p = self.skip(p)
+        c = self.s[p] if p < self.n else ""
+        kind = None
+        errors = []
+
+        for word in TYPES:
+            if c == word[0] and self.keyword(word, p) >= 0:
+                kind = word
+                break
+            errors.append(self.error if c == word[0] else (p, f"Expected Keyword {word!r}"))
+
+        if kind is None:
+            self.error = _first_error(errors)
+            return None
+
+        p = self.literal(":", p + len(kind))
+        if p < 0:
+            errors.append(self.error)
+            self.error = _first_error(errors)
+            return None
+
+        r = self.typed_token(kind, p)
+        if r is None:
+            errors.append(self.error)
+            self.error = _first_error(errors)
+            return None
+
+        token, p = r
+        if kind == "decimal":
+            return Decimal(token), p
+        if kind == "uuid":
+            return UUID(hex=token), p
+        if kind == "epoch":
+            return datetime.utcfromtimestamp(token), p
+        if kind == "datetime":
+            return _dateparse(token), p
+        if kind == "date":
+            return _dateparse(token).date(), p
+        return token, p
+
+    def typed_token(self, kind, p):
+        if kind in ("decimal", "uuid", "string"):
+            return self.string(p)
+
+        if kind in ("epoch", "number"):
+            return self.number(p)
+
+        if kind == "boolean":
+            q = self.keyword("true", p)
+            if q >= 0:
+                return True, q
+            error = self.error
+            q = self.keyword("false", p)
+            if q >= 0:
+                return False, q
+            self.error = _first_error([error, self.error])
+            return None
+
+        p = self.skip(p)
+        if kind == "datetime":
+            m = ISO8601_DATETIME.match(self.s, p)
+            if m is None:
+                self.fail(p, "Expected ISO8601 datetime")
+                return None
+        else:
+            m = ISO8601_DATE.match(self.s, p)
+            if m is None:
+                self.fail(p, "Expected ISO8601 date")
+                return None
+
+        return m.group(), m.end()
+
+    def array(self, p):
+        p = self.literal("(", p)
+        if p < 0:
+            return None
+
+        r = self.value(p)
+        if r is None:
+            return None
+
+        value, p = r
+        values = [value]
+        while True:
+            q = self.literal(",", p)
+            if q < 0:
+                break
+            r = self.value(q)
+            if r is None:
+                break
+            value, p = r
+            values.append(value)
+
+        p = self.literal(")", p)
+        if p < 0:
+            return None
+
+        return tuple(values), p
+
+    # calls
+
+    def argument(self, p):
+        r = self.call_operator(p)
+        if r is not None:
+            return r
+
+        error = self.error
+        r = self.value(p)
+        if r is None:
+            self.error = _first_error([error, self.error])
+        return r
+
+    def call_operator(self, p):
+        r = self.sort_call(p)
+        if r is not None:
+            return r
+
+        error = self.error
+        r = self.func_call(p)
+        if r is None:
+            self.error = _first_error([error, self.error])
+        return r
+
+    def sort_arg(self, p):
+        p = self.skip(p)
+        if p >= self.n or self.s[p] not in "+-":
+            self.fail(p, "Expected '-'")
+            return None
+
+        r = self.value(p + 1)
+        if r is None:
+            return None
+
+        value, q = r
+        return (self.s[p], value), q
+
+    def sort_call(self, p):
+        p = self.keyword("sort", p)
+        if p < 0:
+            return None
+
+        p = self.literal("(", p)
+        if p < 0:
+            return None
+
+        r = self.sort_arg(p)
+        if r is None:
+            return None
+
+        arg, p = r
+        args = [arg]
+        while True:
+            q = self.literal(",", p)
+            if q < 0:
+                break
+            r = self.sort_arg(q)
+            if r is None:
+                break
+            arg, p = r
+            args.append(arg)
+
+        p = self.literal(")", p)
+        if p < 0:
+            return None
+
+        return {"name": "sort", "args": args}, p
+
+    def func_call(self, p):
+        r = self.name(p)
+        if r is None:
+            return None
+
+        name, p = r
+        p = self.literal("(", p)
+        if p < 0:
+            return None
+
+        args = []
+        r = self.argument(p)
+        if r is not None:
+            arg, p = r
+            args.append(arg)
+            while True:
+                q = self.literal(",", p)
+                if q < 0:
+                    break
+                r = self.argument(q)
+                if r is None:
+                    break
+                arg, p = r
+                args.append(arg)
+
+        p = self.literal(")", p)
+        if p < 0:
+            return None
+
+        return {"name": name, "args": args}, p
+
+    # operators
+
+    def comparison(self, p):
+        r = self.value(p)
+        if r is None:
+            return None
+
+        left, p = r
+        p = self.literal("=", p)
+        if p < 0:
+            return None
+
+        op = "eq"
+        r = self.name(p)
+        if r is not None:
+            q = self.literal("=", r[1])
+            if q >= 0:
+                op, p = r[0], q
+
+        r = self.value(p)
+        if r is None:
+            return None
+
+        right, p = r
+        return {"name": op, "args": [left, right]}, p
+
+    def group(self, p):
+        p = self.literal("(", p)
+        if p < 0:
+            return None
+
+        # the grammar tries an '|' list before an '&' list, but both start
+        # with the same operator and a single operator is a valid '|' list,
+        # so the '&' alternative can't match when the first one fails
+        r = self.operator_list("|", "or", p)
+        if r is None:
+            return None
+
+        value, p = r
+        p = self.literal(")", p)
+        if p < 0:
+            return None
+
+        return value, p
+
+    def operator(self, p):
+        r = self.group(p)
+        if r is not None:
+            return r
+        errors = [self.error]
+
+        r = self.comparison(p)
+        if r is not None:
+            return r
+        errors.append(self.error)
+
+        r = self.call_operator(p)
+        if r is None:
+            errors.append(self.error)
+            self.error = _first_error(errors)
+        return r
+
+    def operator_list(self, delim, name, p):
+        r = self.operator(p)
+        if r is None:
+            return None
+
+        op, p = r
+        ops = [op]
+        while True:
+            q = self.literal(delim, p)
+            if q < 0:
+                break
+            r = self.operator(q)
+            if r is None:
+                break
+            op, p = r
+            ops.append(op)
+
+        if len(ops) == 1:
+            return ops[0], p
+
+        return {"name": name, "args": ops}, p
+
+    def query(self, p):
+        r = self.operator_list("&", "and", p)
+        if r is None:
+            return None
+
+        op, p = r
+        ops = [op]
+        while True:
+            q = self.literal(",", p)
+            if q < 0:
+                break
+            r = self.operator_list("&", "and", q)
+            if r is None:
+                break
+            op, p = r
+            ops.append(op)
+
+        if len(ops) == 1:
+            return ops[0], p
+
+        return {"name": "and", "args": ops}, p
+
+
+class FastParser:
+    def parse(self, expr):
+        return _RecursiveDescent(expr).parse()
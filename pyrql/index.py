@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+from bisect import bisect_left
+from bisect import bisect_right
+from collections.abc import Sequence
+
+from .query import EqualTo
+from .query import GreaterOrEqual
+from .query import GreaterThan
+from .query import In
+from .query import Key
+from .query import LessOrEqual
+from .query import LessThan
+
+# Indexes map the values of a key to the positions of the rows having them,
+# so top level filters on that key can be answered without a scan. They are
+# built over a sequence of rows and are only valid while it doesn't change.
+# If rows are added or removed, the filters scan the data instead, but
+# changes to the rows themselves can't be detected.
+#
+# Rows an index can't place, like those with unhashable values or where the
+# key can't be read, are left out of its lookups, and checked with all the
+# filters of the query in their original order, so the results and errors
+# are the same as a scan.
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+
+    return True
+
+
+def _rows(data):
+    if not isinstance(data, Sequence):
+        raise TypeError("indexes can only be built over a sequence of rows")
+
+    return data
+
+
+class HashIndex:
+    def __init__(self, data, key):
+        self.data = _rows(data)
+        # rows added or removed later make the index stale
+        self.size = len(data)
+        self.key = Key(key)
+        self.positions = {}
+        self.others = []
+
+        get = self.key.get
+        for i, row in enumerate(data):
+            try:
+                self.positions.setdefault(get(row), []).append(i)
+            except Exception:
+                self.others.append(i)
+
+    def supports(self, node):
+        if isinstance(node, EqualTo):
+            return not isinstance(node.value, Key) and _hashable(node.value)
+
+        if isinstance(node, In):
+            return isinstance(node.value, tuple) and all(_hashable(v) for v in node.value)
+
+        return False
+
+    def can_sort(self):
+        return False
+
+    def lookup(self, nodes):
+        # positions of the placed rows matching all filters, in ascending
+        # order
+        found = None
+        for node in nodes:
+            positions = self._lookup(node)
+            found = positions if found is None else sorted(set(found).intersection(positions))
+
+        return found
+
+    def _lookup(self, node):
+        if isinstance(node, EqualTo):
+            found = self.positions.get(node.value, [])
+        else:
+            found = []
+            for value in set(node.value):
+                found.extend(self.positions.get(value, ()))
+
+        if not isinstance(node, EqualTo):
+            found.sort()
+
+        return found
+
+
+class SortedIndex:
+    def __init__(self, data, key):
+        self.data = _rows(data)
+        self.size = len(data)
+        self.key = Key(key)
+        # rows with None are left out, since it can't be compared
+        self.others = []
+
+        get = self.key.get
+        positions = []
+        values = []
+        for i, row in enumerate(data):
+            try:
+                value = get(row)
+            except Exception:
+                value = None
+
+            if value is None:
+                self.others.append(i)
+            else:
+                positions.append(i)
+                values.append(value)
+
+        # a stable sort, so rows with the same value keep their order
+        try:
+            order = sorted(range(len(values)), key=values.__getitem__)
+        except TypeError as exc:
+            raise TypeError(f"Can't build a sorted index on {self.key}: {exc}") from exc
+
+        self.values = [values[i] for i in order]
+        self.order = [positions[i] for i in order]
+        self._desc_order = None
+        self._ranks = {}
+
+    def supports(self, node):
+        if not isinstance(node, (EqualTo, LessThan, LessOrEqual, GreaterThan, GreaterOrEqual)):
+            return False
+
+        value = node.value
+        if value is None or isinstance(value, Key):
+            return False
+
+        if self.values:
+            # a scan would fail comparing with values of another type
+            try:
+                self.values[0] < value
+                value < self.values[0]
+            except TypeError:
+                return False
+
+        return True
+
+    def can_sort(self):
+        # sorting rows without the key fails, so that's left to the scan
+        return not self.others
+
+    def lookup(self, nodes, reverse=None):
+        # positions of the placed rows matching all filters, in ascending
+        # order, or sorted by the key if reverse isn't None
+        lo, hi = self._range(nodes)
+
+        if reverse is not None:
+            if not reverse:
+                return self.order[lo:hi]
+
+            size = len(self.values)
+            return self.desc_order()[size - hi : size - lo]
+
+        return sorted(self.order[lo:hi])
+
+    def desc_order(self):
+        # reverse sorting keeps ties in their original order, unlike
+        # reversing the ascending order
+        if self._desc_order is None:
+            values = self.values
+            indices = sorted(range(len(values)), key=values.__getitem__, reverse=True)
+            self._desc_order = [self.order[i] for i in indices]
+
+        return self._desc_order
+
+    def rank(self, reverse=False):
+        # the place of each row in the sorted order, by row position
+        if reverse not in self._ranks:
+            ranks = [0] * len(self.data)
+            for rank, i in enumerate(self.desc_order() if reverse else self.order):
+                ranks[i] = rank
+            self._ranks[reverse] = ranks
+
+        return self._ranks[reverse]
+
+    def _range(self, nodes):
+        values = self.values
+        lo, hi = 0, len(values)
+        for node in nodes:
+            value = node.value
+            if isinstance(node, (EqualTo, GreaterOrEqual)):
+                lo = max(lo, bisect_left(values, value))
+            elif isinstance(node, GreaterThan):
+                lo = max(lo, bisect_right(values, value))
+
+            if isinstance(node, (EqualTo, LessOrEqual)):
+                hi = min(hi, bisect_right(values, value))
+            elif isinstance(node, LessThan):
+                hi = min(hi, bisect_left(values, value))
+
+        return lo, max(lo, hi)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+
+# Hooks are module level lists, so checking whether any is installed is a
+# single truth test and costs nothing when instrumentation isn't used. They
+# are global to the process, not to the thread installing them.
+
+NODE_HOOKS = []
+PARSE_HOOKS = []
+
+
+@contextmanager
+def instrument(on_node=None, on_parse=None):
+    installed = [
+        (hooks, hook)
+        for hooks, hook in ((NODE_HOOKS, on_node), (PARSE_HOOKS, on_parse))
+        if hook is not None
+    ]
+
+    for hooks, hook in installed:
+        hooks.append(hook)
+
+    try:
+        yield
+    finally:
+        for hooks, hook in installed:
+            hooks.remove(hook)
+
+
+def notify(hooks, event):
+    for hook in hooks:
+        hook(event)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+from collections.abc import Mapping
+from hashlib import blake2b
+
+# Rewrites parsed expressions into a canonical form, so equivalent queries
+# written in different ways give the same expression and the same hash:
+#
+# - nested and() and or() are flattened, and those with a single argument
+#   are replaced by it
+# - consecutive filters inside and(), and all arguments of or(), are sorted,
+#   other nodes keep their place since the order of the pipeline matters
+# - eq() and in() on the same key inside or() are merged into one in(), the
+#   values of in() and out() are sorted without duplicates, and a single
+#   value is folded into eq() or ne()
+
+FILTERS = {"eq", "ne", "lt", "le", "gt", "ge", "in", "out", "contains", "excludes", "and", "or"}
+
+
+def _is_node(value):
+    return isinstance(value, Mapping) and "name" in value
+
+
+def _is_filter(value):
+    return _is_node(value) and value["name"] in FILTERS
+
+
+def _dump(value):
+    # a string representation with the type of every value, so that 1, 1.0
+    # and true are different, and the same in any process
+    if _is_node(value):
+        return f"{value['name']}({','.join(_dump(arg) for arg in value['args'])})"
+
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}({','.join(_dump(item) for item in value)})"
+
+    return f"{type(value).__name__}:{value!r}"
+
+
+def _unique(values):
+    # sorted and without duplicates, even if they're not comparable
+    found = {}
+    for value in values:
+        found.setdefault(_dump(value), value)
+
+    return tuple(found[key] for key in sorted(found))
+
+
+def _membership(name, key, values):
+    values = _unique(values)
+    if len(values) == 1:
+        return {"name": "eq" if name == "in" else "ne", "args": [key, values[0]]}
+
+    return {"name": name, "args": [key, values]}
+
+
+def _merge_or(args):
+    # or(eq(a,1),eq(a,2),in(a,(3,4))) is in(a,(1,2,3,4))
+    groups = {}
+    for i, arg in enumerate(args):
+        if arg["name"] not in ("eq", "in") or not isinstance(arg["args"][0], str):
+            continue
+
+        key, value = arg["args"]
+        if arg["name"] == "in" and not isinstance(value, tuple):
+            continue
+
+        if _is_node(value):
+            continue
+
+        groups.setdefault(key, []).append((i, (value,) if arg["name"] == "eq" else value))
+
+    merged = {}
+    removed = set()
+    for key, items in groups.items():
+        if len(items) > 1:
+            values = [value for i, group in items for value in group]
+            merged[items[0][0]] = _membership("in", key, values)
+            removed.update(i for i, group in items[1:])
+
+    return [merged.get(i, arg) for i, arg in enumerate(args) if i not in removed]
+
+
+def _sort_filters(args):
+    # only runs of consecutive filters can be reordered
+    result = []
+    run = []
+    for arg in args:
+        if _is_filter(arg):
+            run.append(arg)
+            continue
+
+        result.extend(sorted(run, key=_dump))
+        result.append(arg)
+        run = []
+
+    result.extend(sorted(run, key=_dump))
+    return result
+
+
+def normalize(ast):
+    if isinstance(ast, list):
+        return [normalize(item) for item in ast]
+
+    if isinstance(ast, tuple):
+        return tuple(normalize(item) for item in ast)
+
+    if not _is_node(ast):
+        return ast
+
+    name = ast["name"]
+    args = [normalize(arg) for arg in ast["args"]]
+
+    if name in ("in", "out") and len(args) == 2 and isinstance(args[1], tuple):
+        return _membership(name, *args)
+
+    if name not in ("and", "or"):
+        return {"name": name, "args": args}
+
+    flat = []
+    for arg in args:
+        # and(a,and(b,c)) is and(a,b,c), but only if the inner one is all
+        # filters, otherwise it isn't valid as a filter anyway
+        if (
+            _is_node(arg)
+            and arg["name"] == name
+            and all(_is_filter(inner) for inner in arg["args"])
+        ):
+            flat.extend(arg["args"])
+        else:
+            flat.append(arg)
+
+    if name == "or" and all(_is_filter(arg) for arg in flat):
+        flat = _merge_or(flat)
+
+    flat = _sort_filters(flat)
+
+    if len(flat) == 1:
+        return flat[0]
+
+    return {"name": name, "args": flat}
+
+
+def ast_hash(ast):
+    # a stable hash of the canonical form of a parsed expression, the same
+    # for any equivalent expression and in any process
+    return blake2b(_dump(normalize(ast)).encode(), digest_size=16).hexdigest()
@@ -1,190 +1,111 @@
 # -*- coding: utf-8 -*-
 
-from datetime import datetime
-from decimal import Decimal
-from uuid import UUID
-
-import pyparsing as pp
-from dateutil.parser import parse as dateparse
-from pyparsing import pyparsing_common as common
-from six.moves import urllib  # pyright: ignore
+import time
 
+from .cache import LRUCache
 from .exceptions import RQLSyntaxError
-
-# autoconvert:
-# numbers
-# booleans
-# null
-
-# converters:
-# number
-# epoch
-# date
-# datetime
-# boolean
-# string
-# uuid
-# decimal
-
-
-def _sort_call(expr, loc, toks):
-    return {"name": "sort", "args": toks.args.asList()}
-
-
-def _array(expr, loc, toks):
-    return tuple(toks)
-
-
-def _unquote(expr, loc, toks):
-    return urllib.parse.unquote(toks[0])
-
-
-def _call_operator(expr, loc, toks):
-    return toks.asDict()
-
-
-def _comparison(expr, loc, toks):
-    if len(toks) == 2:
-        return {"name": "eq", "args": toks.asList()}
-
-    op = toks.pop(1)
-    return {"name": op, "args": toks.asList()}
-
-
-def _or(expr, loc, toks):
-    return toks[0] if len(toks) == 1 else {"name": "or", "args": toks.asList()}
+from .fastparser import FastParser
+from .instrument import PARSE_HOOKS
+from .instrument import notify
 
 
-def _and(expr, loc, toks):
-    return toks[0] if len(toks) == 1 else {"name": "and", "args": toks.asList()}
+def __getattr__(name):
+    # the pyparsing grammar is expensive to build, so it's only imported on
+    # the first parse, but the elements are still available from here
+    if name.isupper():
+        from . import grammar
 
+        return getattr(grammar, name)
 
-def _group(expr, loc, toks):
-    return toks[0]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
-def _date(expr, loc, toks):
-    return dateparse(toks[0]).date()
+def _copy_ast(node):
+    # tuples and scalars in the AST are immutable, so only dicts and
+    # lists need to be copied
+    if isinstance(node, dict):
+        return {key: _copy_ast(value) for key, value in node.items()}
 
+    if isinstance(node, list):
+        return [_copy_ast(value) for value in node]
 
-def _datetime(expr, loc, toks):
-    return dateparse(toks[0])
+    return node
 
 
-def _epoch(expr, loc, toks):
-    return datetime.utcfromtimestamp(toks[0])
+ENGINES = ("pyparsing", "fast")
 
 
-def _decimal(expr, loc, toks):
-    return Decimal(toks[0])
+def enable_packrat(cache_size=128):
+    # packrat memoization is global to pyparsing, so this affects every
+    # grammar in the process, not only the RQL one. Disable it first so
+    # calling this again with a different size takes effect.
+    import pyparsing as pp
 
+    disable_packrat()
+    pp.ParserElement.enablePackrat(cache_size_limit=cache_size)
 
-def _uuid(expr, loc, toks):
-    return UUID(hex=toks[0])
 
+def disable_packrat():
+    import pyparsing as pp
 
-TRUE = pp.Keyword("true").setParseAction(pp.replaceWith(True))
-FALSE = pp.Keyword("false").setParseAction(pp.replaceWith(False))
-NULL = pp.Keyword("null").setParseAction(pp.replaceWith(None))
+    disable = getattr(pp.ParserElement, "disable_memoization", None)
+    if disable is not None:
+        disable()
+        return
 
-# let's treat sort as a keyword to better handle the +- prefix syntax
-SORT = pp.Keyword("sort").suppress()
+    # pyparsing 2.x
+    pp.ParserElement._packratEnabled = False
+    pp.ParserElement._parse = pp.ParserElement._parseNoCache
 
-# keywords for typed values
-K_NUMBER = pp.Keyword("number").suppress()
-K_STRING = pp.Keyword("string").suppress()
-K_DATE = pp.Keyword("date").suppress()
-K_DATETIME = pp.Keyword("datetime").suppress()
-K_BOOL = pp.Keyword("boolean").suppress()
-K_EPOCH = pp.Keyword("epoch").suppress()
-K_UUID = pp.Keyword("uuid").suppress()
-K_DECIMAL = pp.Keyword("decimal").suppress()
 
-# grammar
-PLUS = pp.Literal("+")
-MINUS = pp.Literal("-")
-EQUALS = pp.Literal("=").suppress()
-LPAR = pp.Literal("(").suppress()
-RPAR = pp.Literal(")").suppress()
-COLON = pp.Literal(":").suppress()
-
-# reserved characters that are not part of the RQL grammar
-RESERVED = pp.Word("@!*+$", exact=1)
-
-UNRESERVED = pp.Word(f"{pp.pyparsing_unicode.alphanums}-:._~ ", exact=1)
-PCT_ENCODED = pp.Combine(pp.Literal("%") + pp.Word(pp.hexnums, exact=2)).setParseAction(_unquote)
-NCHAR = UNRESERVED | PCT_ENCODED | RESERVED
-
-STRING = pp.Combine(pp.OneOrMore(NCHAR))
-
-NAME = common.identifier
-
-NUMBER = common.number
-
-TYPED_STRING = K_STRING + COLON + STRING
-TYPED_NUMBER = K_NUMBER + COLON + common.number
-TYPED_DATE = (K_DATE + COLON + common.iso8601_date).setParseAction(_date)
-TYPED_DATETIME = (K_DATETIME + COLON + common.iso8601_datetime).setParseAction(_datetime)
-TYPED_BOOL = K_BOOL + COLON + (TRUE | FALSE)
-TYPED_EPOCH = (K_EPOCH + COLON + common.number).setParseAction(_epoch)
-TYPED_UUID = (K_UUID + COLON + STRING).setParseAction(_uuid)
-TYPED_DECIMAL = (K_DECIMAL + COLON + STRING).setParseAction(_decimal)
-
-TYPED_VALUE = (
-    TYPED_DECIMAL
-    | TYPED_UUID
-    | TYPED_EPOCH
-    | TYPED_DATETIME
-    | TYPED_DATE
-    | TYPED_NUMBER
-    | TYPED_BOOL
-    | TYPED_STRING
-)
-
-ARRAY = pp.Forward()
-
-# using ^ instead of | between NUMBER and STRING to avoid ambiguity
-# when parsing strings starting with numbers
-VALUE = TYPED_VALUE | ARRAY | TRUE | FALSE | NULL | (NUMBER ^ STRING)
-
-PAR_ARRAY = (LPAR + pp.delimitedList(VALUE) + RPAR).setParseAction(_array)
-
-ARRAY <<= PAR_ARRAY
-
-CALL_OPERATOR = pp.Forward()
+class Parser:
+    def __init__(self, cache_size=None, engine="pyparsing"):
+        if engine not in ENGINES:
+            raise ValueError(f"Invalid parser engine: {engine!r}")
 
-ARGUMENT = CALL_OPERATOR | VALUE
+        self.engine = engine
+        self.cache = LRUCache(cache_size) if cache_size else None
 
-SORT_ARG = ((MINUS | PLUS) + VALUE).setParseAction(lambda e, l, t: tuple(t))
-SORT_ARGARRAY = pp.delimitedList(SORT_ARG).setResultsName("args")
-SORT_CALL = (SORT + LPAR + SORT_ARGARRAY + RPAR).setParseAction(_sort_call)
+    def parse(self, expr):
+        if PARSE_HOOKS:
+            start = time.perf_counter_ns()
+            result = self._cached_parse(expr)
+            elapsed = time.perf_counter_ns() - start
+            notify(PARSE_HOOKS, {"expr": expr, "engine": self.engine, "elapsed_ns": elapsed})
+            return result
 
-FUNC_CALL = (
-    NAME.setResultsName("name")
-    + LPAR
-    + pp.Group(pp.Optional(pp.delimitedList(ARGUMENT))).setResultsName("args")
-    + RPAR
-).setParseAction(_call_operator)
+        return self._cached_parse(expr)
 
-CALL_OPERATOR <<= SORT_CALL | FUNC_CALL
+    def _cached_parse(self, expr):
+        if self.cache is None:
+            return self._parse(expr)
 
-COMPARISON = (VALUE + EQUALS + pp.Optional(NAME + EQUALS) + VALUE).setParseAction(_comparison)
+        result = self.cache.get(expr)
+        if result is None:
+            result = self._parse(expr)
+            self.cache.set(expr, result)
 
-OPERATOR = pp.Forward()
+        # return a copy so callers can't change the cached value
+        return _copy_ast(result)
 
-OR = pp.delimitedList(OPERATOR, delim=pp.Literal("|")).setParseAction(_or)
-AND = pp.delimitedList(OPERATOR, delim=pp.Literal("&")).setParseAction(_and)
+    def cache_info(self):
+        if self.cache is None:
+            return None
 
+        return self.cache.info()
 
-GROUP = (LPAR + (OR | AND) + RPAR).setParseAction(_group)
+    def cache_clear(self):
+        if self.cache is not None:
+            self.cache.clear()
 
-OPERATOR <<= GROUP | COMPARISON | CALL_OPERATOR
+    def _parse(self, expr):
+        if self.engine == "fast":
+            return FastParser().parse(expr)
 
-QUERY = pp.delimitedList(AND).setParseAction(_and)
+        import pyparsing as pp
 
+        from .grammar import QUERY
 
-class Parser:
-    def parse(self, expr):
         try:
             result = QUERY.parseString(expr, parseAll=True)
         except pp.ParseException as exc:
@@ -1,16 +1,29 @@
 # -*- coding: utf-8 -*-
 
+import heapq
+import math
 import operator
-import statistics
+import time
 from collections import defaultdict
+from collections.abc import Iterator
 from collections.abc import Mapping
 from collections.abc import Sequence
 from copy import copy
 from copy import deepcopy
+from decimal import Decimal
+from fractions import Fraction
+from itertools import count
+from itertools import islice
 from urllib.parse import unquote
 
 from .exceptions import RQLQueryError
+from .instrument import NODE_HOOKS
+from .instrument import notify
+from .normalize import ast_hash
 from .parser import Parser
+from .parser import _copy_ast
+from .sketches import KLL
+from .sketches import HyperLogLog
 
 
 class NodeMeta(type):
@@ -23,6 +36,11 @@ class NodeMeta(type):
 
 
 class Node(metaclass=NodeMeta):
+    # for explain(), the time complexity and any faster than usual way the
+    # node is executed
+    cost = "O(n)"
+    fast_path = None
+
     def __init__(self, *args):
         self.args = args
 
@@ -33,10 +51,56 @@ class Node(metaclass=NodeMeta):
         except KeyError as e:
             raise RQLQueryError(f"Invalid query function: {name}") from e
 
+    def stream(self, data):
+        # nodes are blocking by default, so materialize the input
+        if isinstance(data, Iterator):
+            data = list(data)
+
+        return self.feed(data)
+
+    def explain(self):
+        return {
+            "node": _node_name(self),
+            "args": [_explain_arg(arg) for arg in self.args],
+            "cost": self.cost,
+            "fast_path": self.fast_path,
+        }
+
+
+def _node_name(node):
+    return getattr(node, "name", None) or type(node).__name__.lower()
+
+
+def _explain_arg(arg):
+    # a JSON serializable version of a node argument
+    if isinstance(arg, Node):
+        return arg.explain()
+
+    if isinstance(arg, (list, tuple)):
+        return [_explain_arg(value) for value in arg]
+
+    if arg == float("inf"):
+        return None
+
+    if arg is None or isinstance(arg, (str, int, float)):
+        return arg
+
+    return str(arg)
+
 
 class RowNode(Node):
+    # row nodes build a predicate function when created, so there's no
+    # per row overhead other than calling it
+
+    def __call__(self, row):
+        return self.predicate(row)
+
     def feed(self, data):
-        return [row for row in data if self(row)]
+        predicate = self.predicate
+        return [row for row in data if predicate(row)]
+
+    def stream(self, data):
+        return filter(self.predicate, data)
 
 
 class DataNode(Node):
@@ -44,18 +108,32 @@ class DataNode(Node):
         return self(data)
 
 
+def _key_getter(path):
+    if not path:
+        return lambda row: row
+
+    if len(path) == 1:
+        return operator.methodcaller("get", path[0])
+
+    def get(row):
+        for key in path:
+            row = row.get(key)
+
+        return row
+
+    return get
+
+
 class Key(Node):
     def __init__(self, *args):
         self.args = []
         for arg in args:
             self.args.extend(arg.split("."))
 
-    def __call__(self, row):
-        value = row
-        for key in self.args:
-            value = value.get(key)
+        self.get = _key_getter(tuple(self.args))
 
-        return value
+    def __call__(self, row):
+        return self.get(row)
 
     def __str__(self):
         return ".".join(self.args)
@@ -66,18 +144,28 @@ class Key(Node):
         else:
             return self(data)
 
+    def stream(self, data):
+        if isinstance(data, Iterator):
+            return map(self.feed, data)
+
+        return self.feed(data)
+
 
 class _Filter(RowNode):
     name = None
 
     def __init__(self, key, value):
+        self.args = (key, value)
         self.key = Key(key)
         self.value = value
         self.op = getattr(operator, self.name)
 
-    def __call__(self, row):
-        value = self.value(row) if isinstance(self.value, Key) else self.value
-        return self.op(self.key(row), value)
+        get, op = self.key.get, self.op
+        if isinstance(value, Key):
+            get_value = value.get
+            self.predicate = lambda row: op(get(row), get_value(row))
+        else:
+            self.predicate = lambda row: op(get(row), value)
 
 
 class EqualTo(_Filter):
@@ -104,74 +192,526 @@ class GreaterOrEqual(_Filter):
     name = "ge"
 
 
+def _predicates(nodes):
+    return [getattr(node, "predicate", node) for node in nodes if node is not None]
+
+
 class And(RowNode):
-    def __call__(self, row):
-        return all(f(row) for f in self.args if f is not None)
+    def __init__(self, *args):
+        self.args = args
+        predicates = _predicates(args)
+
+        # avoid the loop for the most common cases
+        if len(predicates) == 1:
+            self.predicate = predicates[0]
+        elif len(predicates) == 2:
+            a, b = predicates
+            self.predicate = lambda row: a(row) and b(row)
+        elif len(predicates) == 3:
+            a, b, c = predicates
+            self.predicate = lambda row: a(row) and b(row) and c(row)
+        else:
+
+            def predicate(row):
+                for p in predicates:
+                    if not p(row):
+                        return False
+                return True
+
+            self.predicate = predicate
 
 
 class Or(RowNode):
-    def __call__(self, row):
-        return any(f(row) for f in self.args if f is not None)
+    def __init__(self, *args):
+        self.args = args
+        predicates = _predicates(args)
+
+        if len(predicates) == 1:
+            self.predicate = predicates[0]
+        elif len(predicates) == 2:
+            a, b = predicates
+            self.predicate = lambda row: a(row) or b(row)
+        elif len(predicates) == 3:
+            a, b, c = predicates
+            self.predicate = lambda row: a(row) or b(row) or c(row)
+        else:
 
+            def predicate(row):
+                for p in predicates:
+                    if p(row):
+                        return True
+                return False
 
-class In(RowNode):
-    def __call__(self, row):
-        key, value = self.args
-        key = Key(key)
-        return operator.contains(value, key(row))
+            self.predicate = predicate
 
 
-class Out(RowNode):
-    def __call__(self, row):
-        key, value = self.args
-        key = Key(key)
-        return operator.not_(operator.contains(value, key(row)))
+class _MembershipNode(RowNode):
+    def __init__(self, key, value):
+        self.args = (key, value)
+        self.key = Key(key)
+        self.value = value
+        self.predicate = self.build(self.key.get, value)
 
 
-class Contains(RowNode):
-    def __call__(self, row):
-        key, value = self.args
-        key = Key(key)
-        return operator.contains(key(row), value)
+# arrays smaller than this are faster to scan than to hash
+SET_MIN_SIZE = 8
 
 
-class Excludes(RowNode):
-    def __call__(self, row):
-        key, value = self.args
-        key = Key(key)
-        return operator.not_(operator.contains(key(row), value))
+def _members(value):
+    # arrays are tuples, use a set for them when possible
+    if isinstance(value, tuple) and len(value) >= SET_MIN_SIZE:
+        try:
+            return frozenset(value)
+        except TypeError:
+            pass
+
+    return None
+
+
+def _in_predicate(get, value):
+    members = _members(value)
+    if members is None:
+        return lambda row: get(row) in value
+
+    def predicate(row):
+        item = get(row)
+        try:
+            return item in members
+        except TypeError:
+            # unhashable row values can still be equal to a member
+            return item in value
+
+    return predicate
+
+
+class In(_MembershipNode):
+    @property
+    def fast_path(self):
+        return "hash lookup" if _members(self.value) is not None else None
+
+    @staticmethod
+    def build(get, value):
+        return _in_predicate(get, value)
+
+
+class Out(_MembershipNode):
+    fast_path = In.fast_path
+
+    @staticmethod
+    def build(get, value):
+        predicate = _in_predicate(get, value)
+        return lambda row: not predicate(row)
+
+
+class Contains(_MembershipNode):
+    @staticmethod
+    def build(get, value):
+        return lambda row: value in get(row)
+
+
+class Excludes(_MembershipNode):
+    @staticmethod
+    def build(get, value):
+        return lambda row: value not in get(row)
+
+
+_EMPTY = object()
 
 
 class AggregateNode(DataNode):
+    # aggregators are accumulators: init() is the state for no values,
+    # step() adds a value to it, merge() combines the states of two parts of
+    # the data, like shards, and finalize() gives the result from a state
+
     def __init__(self, key):
+        self.args = (key,)
         self.key = Key(key)
 
     def __str__(self):
         return str(self.key)
 
+    def __call__(self, data):
+        return self.finalize(self.partial(data))
+
+    def partial(self, data):
+        step = self.step
+        state = self.init()
+        for value in map(self.key.get, data):
+            state = step(state, value)
+
+        return state
+
+    def init(self):
+        return _EMPTY
+
+    def merge(self, state, other):
+        if other is _EMPTY:
+            return state
+
+        return self.step(state, other)
+
+    def finalize(self, state):
+        if state is _EMPTY:
+            raise ValueError(f"{type(self).__name__.lower()}() of no values")
+
+        return state
+
 
 class Min(AggregateNode):
-    def __call__(self, data):
-        return min(self.key(row) for row in data)
+    def partial(self, data):
+        return min(map(self.key.get, data), default=_EMPTY)
+
+    def step(self, state, value):
+        return value if state is _EMPTY or value < state else state
 
 
 class Max(AggregateNode):
-    def __call__(self, data):
-        return max(self.key(row) for row in data)
+    def partial(self, data):
+        return max(map(self.key.get, data), default=_EMPTY)
+
+    def step(self, state, value):
+        return value if state is _EMPTY or value > state else state
+
+
+def _add_float(partials, x):
+    # Shewchuk's algorithm, as used by math.fsum: the partials are floats
+    # that don't overlap, and add up to exactly the sum of all values
+    i = 0
+    for y in partials:
+        if abs(x) < abs(y):
+            x, y = y, x
+        high = x + y
+        if math.isinf(high):
+            # too large to add as floats, so both are kept, still exact
+            partials[i] = y
+            i += 1
+            continue
+        low = y - (high - x)
+        if low:
+            partials[i] = low
+            i += 1
+        x = high
+
+    partials[i:] = [x]
+
+
+def _add_value(state, value):
+    # finite floats are added to the partials, anything else to the total
+    if type(value) is float and math.isfinite(value):
+        _add_float(state[-1], value)
+    else:
+        state[0] += value
+
+
+def _merge_floats(partials, other):
+    partials = list(partials)
+    for x in other:
+        _add_float(partials, x)
+
+    return partials
+
+
+def _fsum_partials(values):
+    # floats adding up to exactly the sum of the values, like the partials
+    # of _add_float, from the correctly rounded sums math.fsum gives for
+    # what's left after subtracting the previous ones, much faster. Raises
+    # OverflowError if they can't be added as floats
+    sums = []
+    while True:
+        rest = math.fsum(values + [-s for s in sums])
+        if not rest:
+            break
+        sums.append(rest)
+
+    # partials are in increasing order, and with any floats there's one
+    return sums[::-1] or [0.0]
+
+
+def _partial_sum(values):
+    # the total and partials step() would give, for all values at once
+    floats = []
+    total = 0
+    for value in values:
+        if type(value) is float and math.isfinite(value):
+            floats.append(value)
+        else:
+            total += value
+
+    if not floats:
+        return total, []
+
+    try:
+        return total, _fsum_partials(floats)
+    except OverflowError:
+        partials = []
+        for value in floats:
+            _add_float(partials, value)
+        return total, partials
+
+
+def _exact(total, partials):
+    # the exact sum, or the total if it's infinite or NaN
+    if isinstance(total, float) and not math.isfinite(total):
+        return total
+
+    return sum(map(Fraction, partials), Fraction(total))
 
 
 class Sum(AggregateNode):
-    def __call__(self, data):
-        return sum(self.key(row) for row in data)
+    # finite floats are added exactly, as partial sums, so the result is the
+    # same as math.fsum for all data or any parts of it, rounded only once
+
+    def partial(self, data):
+        return list(_partial_sum(map(self.key.get, data)))
+
+    def init(self):
+        return [0, []]
+
+    def step(self, state, value):
+        _add_value(state, value)
+        return state
+
+    def merge(self, state, other):
+        return [state[0] + other[0], _merge_floats(state[1], other[1])]
+
+    def finalize(self, state):
+        total, partials = state
+        if not partials:
+            return total
+
+        exact = _exact(total, partials)
+        try:
+            return float(exact)
+        except OverflowError:
+            return math.inf if exact > 0 else -math.inf
 
 
 class Mean(AggregateNode):
-    def __call__(self, data):
-        return statistics.mean([self.key(row) for row in data])
+    # a running sum and count, instead of keeping all values. Like Sum,
+    # finite floats are added exactly, so the result is the same as
+    # statistics.mean, without the rounding of a plain float sum
+
+    def partial(self, data):
+        values = list(map(self.key.get, data))
+        total, partials = _partial_sum(values)
+        return [total, len(values), partials]
+
+    def init(self):
+        return [0, 0, []]
+
+    def step(self, state, value):
+        _add_value(state, value)
+        state[1] += 1
+        return state
+
+    def merge(self, state, other):
+        return [state[0] + other[0], state[1] + other[1], _merge_floats(state[2], other[2])]
+
+    def finalize(self, state):
+        total, count, partials = state
+        if not count:
+            raise ValueError("mean() of no values")
+
+        if partials:
+            # the exact sum, divided and rounded only once
+            return float(_exact(total, partials) / count)
+
+        # like statistics.mean, the mean of integers is an integer if exact
+        if isinstance(total, int) and not total % count:
+            return total // count
+
+        return total / count
+
+
+class Variance(AggregateNode):
+    # the sample variance, with Welford's online algorithm, which is stable
+    # for large values, unlike the difference of sums of squares
+
+    def init(self):
+        return [0, 0, 0]
 
+    def step(self, state, value):
+        count, mean, m2 = state
+        count += 1
+        delta = value - mean
+        mean += delta / count
+        state[:] = count, mean, m2 + delta * (value - mean)
+        return state
 
-class Select(RowNode):
+    def merge(self, state, other):
+        # Chan's method for combining two sets
+        count_a, mean_a, m2_a = state
+        count_b, mean_b, m2_b = other
+        if not count_a or not count_b:
+            return list(other if not count_a else state)
+
+        count = count_a + count_b
+        delta = mean_b - mean_a
+        mean = mean_a + delta * count_b / count
+        return [count, mean, m2_a + m2_b + delta * delta * count_a * count_b / count]
+
+    def finalize(self, state):
+        # there's no sample variance of a single value
+        count, mean, m2 = state
+        return m2 / (count - 1) if count > 1 else None
+
+
+class StdDev(Variance):
+    def finalize(self, state):
+        variance = super().finalize(state)
+        if variance is None:
+            return None
+
+        if isinstance(variance, Decimal):
+            return variance.sqrt()
+
+        return math.sqrt(variance)
+
+
+def _select(values, k):
+    # the k-th smallest value and the one after it, partitioning around a
+    # pivot until it's found instead of sorting everything
+    while len(values) > 32:
+        pivot = sorted([values[0], values[len(values) // 2], values[-1]])[1]
+        lower = [value for value in values if value < pivot]
+        if k < len(lower):
+            if k + 1 == len(lower):
+                return max(lower), pivot
+            values = lower
+            continue
+
+        upper = [value for value in values if pivot < value]
+        equal = len(values) - len(lower) - len(upper)
+        if k < len(lower) + equal:
+            if k + 1 < len(lower) + equal:
+                return pivot, pivot
+            return pivot, min(upper) if upper else None
+
+        k -= len(lower) + equal
+        values = upper
+
+    values = sorted(values)
+    return values[k], values[k + 1] if k + 1 < len(values) else None
+
+
+def _interpolate(low, high, fraction):
+    if not fraction:
+        return low
+
+    delta = high - low
+    if isinstance(delta, Decimal):
+        fraction = Decimal(fraction)
+
+    return low + delta * fraction
+
+
+class Percentile(AggregateNode):
+    # exact, interpolating between the closest values, so all values of a
+    # group are kept, but not sorted
+
+    def __init__(self, key, percent):
+        if not isinstance(percent, (int, float)) or not 0 <= percent <= 100:
+            raise RQLQueryError("percentile() must be between 0 and 100")
+
+        self.args = (key, percent)
+        self.key = Key(key)
+        self.percent = percent
+
+    def partial(self, data):
+        return list(map(self.key.get, data))
+
+    def init(self):
+        return []
+
+    def step(self, state, value):
+        state.append(value)
+        return state
+
+    def merge(self, state, other):
+        return state + other
+
+    def finalize(self, state):
+        if not state:
+            raise ValueError(f"{type(self).__name__.lower()}() of no values")
+
+        position = (len(state) - 1) * self.percent / 100
+        index = int(position)
+        low, high = _select(state, index)
+        return _interpolate(low, high, position - index)
+
+
+class Median(Percentile):
+    def __init__(self, key):
+        super().__init__(key, 50)
+        self.args = (key,)
+
+
+class ApproxCountDistinct(AggregateNode):
+    # a HyperLogLog sketch, with at most 2 ** precision bytes for any number
+    # of values, ignoring None like count(distinct) in SQL
+    name = "approx_count_distinct"
+
+    def __init__(self, key, precision=14):
+        if not isinstance(precision, int) or not 4 <= precision <= 16:
+            raise RQLQueryError("approx_count_distinct() precision must be between 4 and 16")
+
+        self.args = (key, precision)
+        self.key = Key(key)
+        self.precision = precision
+
+    def init(self):
+        return HyperLogLog(self.precision)
+
+    def step(self, state, value):
+        if value is not None:
+            state.add(value)
+        return state
+
+    def merge(self, state, other):
+        return state.merge(other)
+
+    def finalize(self, state):
+        return state.count()
+
+
+class ApproxPercentile(AggregateNode):
+    # a KLL sketch, keeping about 3 * k values for any number of values,
+    # ignoring None
+    name = "approx_percentile"
+
+    def __init__(self, key, percent, k=200):
+        if not isinstance(percent, (int, float)) or not 0 <= percent <= 100:
+            raise RQLQueryError("approx_percentile() must be between 0 and 100")
+
+        if not isinstance(k, int) or k < 8:
+            raise RQLQueryError("approx_percentile() k must be at least 8")
+
+        self.args = (key, percent, k)
+        self.key = Key(key)
+        self.percent = percent
+        self.k = k
+
+    def init(self):
+        return KLL(self.k)
+
+    def step(self, state, value):
+        if value is not None:
+            state.add(value)
+        return state
+
+    def merge(self, state, other):
+        return state.merge(other)
+
+    def finalize(self, state):
+        if not state.count:
+            raise ValueError("approx_percentile() of no values")
+
+        return state.quantile(self.percent / 100)
+
+
+class Select(DataNode):
     def __init__(self, *args):
+        self.args = args
         self.keys = [Key(arg) for arg in args]
 
     def __call__(self, row):
@@ -183,46 +723,139 @@ class Select(RowNode):
         else:
             return [self.feed(row) for row in data]
 
+    def stream(self, data):
+        if isinstance(data, Mapping):
+            return self(data)
+
+        return map(self.feed, data)
+
 
 class Values(DataNode):
     def __init__(self, *args):
         if len(args) > 1:
             raise RQLQueryError("values() must have a single key argument")
+        self.args = args
         self.key = Key(args[0])
 
     def __call__(self, data):
         return [self.key(row) for row in data]
 
+    def stream(self, data):
+        return map(self.key, data)
+
+
+class _Rows:
+    # an accumulator keeping all rows of a group, for nodes that aren't
+    # accumulators themselves
+    key = Key()
+
+    def __init__(self, node):
+        self.node = node
+
+    def init(self):
+        return []
+
+    def step(self, state, row):
+        state.append(row)
+        return state
+
+    def merge(self, state, other):
+        return state + other
+
+    def finalize(self, state):
+        return self.node(state)
+
+
+def _group_getter(keys, composite):
+    if not composite:
+        return keys[0].get
+
+    getters = [key.get for key in keys]
+    if len(getters) == 2:
+        a, b = getters
+        return lambda row: (a(row), b(row))
+
+    return lambda row: tuple([get(row) for get in getters])
+
 
 class Aggregate(DataNode):
     def __init__(self, key, *aggrs):
-        self.key = Key(key)
+        self.args = (key, *aggrs)
+        # a tuple of keys groups by all of them, with a field for each
+        self.keys = [Key(k) for k in key] if isinstance(key, tuple) else [Key(key)]
+        self.composite = isinstance(key, tuple)
+        self.get = _group_getter(self.keys, self.composite)
         self.aggrs = aggrs
+        self.accumulators = [aggr if hasattr(aggr, "step") else _Rows(aggr) for aggr in aggrs]
 
     def __call__(self, data):
-        groups = defaultdict(list)
+        return self.finalize(self.partial(data))
+
+    def partial(self, data):
+        # a single pass over the data, keeping only the state of each
+        # aggregate for each group
+        get = self.get
+        inits = [acc.init for acc in self.accumulators]
+        steps = [(i, acc.step, acc.key.get) for i, acc in enumerate(self.accumulators)]
+
+        groups = {}
         for row in data:
-            groups[self.key(row)].append(row)
+            group = get(row)
+            try:
+                states = groups[group]
+            except KeyError:
+                states = groups[group] = [init() for init in inits]
+
+            for i, step, value in steps:
+                states[i] = step(states[i], value(row))
 
-        data = [
-            {str(self.key): value, **{str(aggr): aggr(rows) for aggr in self.aggrs}}
-            for (value, rows) in groups.items()
+        return groups
+
+    def merge(self, groups, other):
+        groups = dict(groups)
+        for group, states in other.items():
+            if group in groups:
+                groups[group] = [
+                    acc.merge(a, b) for acc, a, b in zip(self.accumulators, groups[group], states)
+                ]
+            else:
+                groups[group] = states
+
+        return groups
+
+    def finalize(self, groups):
+        keys = [str(key) for key in self.keys]
+        names = [str(aggr) for aggr in self.aggrs]
+        return [
+            {
+                **dict(zip(keys, group if self.composite else (group,))),
+                **{
+                    n: acc.finalize(state)
+                    for n, acc, state in zip(names, self.accumulators, states)
+                },
+            }
+            for group, states in groups.items()
         ]
-        return data
 
 
 class Unwind(DataNode):
     def __init__(self, *args):
         if len(args) > 1:
             raise RQLQueryError("unwind() must have a single key argument")
+        self.args = args
         self.key = Key(args[0])
 
     def __call__(self, data):
         data = [{**row, str(self.key): item} for row in data for item in self.key(row)]
         return data
 
+    def stream(self, data):
+        return ({**row, str(self.key): item} for row in data for item in self.key(row))
+
 
 class Limit(DataNode):
+    cost = "O(k)"
+
     def __call__(self, data):
         limit, offset = self.args
 
@@ -234,56 +867,311 @@ class Limit(DataNode):
 
         return data
 
+    def stream(self, data):
+        limit, offset = self.args
+        offset = offset or 0
+
+        if not limit or limit == float("inf"):
+            limit = None
+
+        if not (_streamable(data) and _islice_args(offset, limit)):
+            return super().stream(data)
+
+        return islice(data, offset, None if limit is None else offset + limit)
+
 
 class Index(DataNode):
+    cost = "O(1)"
+
     def __call__(self, data):
         return data[self.args[0]]
 
+    def stream(self, data):
+        index = self.args[0]
+        if not (isinstance(data, Iterator) and _islice_args(index)):
+            return super().stream(data)
+
+        for row in islice(data, index, None):
+            return row
+
+        raise IndexError("list index out of range")
+
 
 class Slice(DataNode):
+    cost = "O(k)"
+
     def __call__(self, data):
         return data[slice(*self.args)]
 
+    def stream(self, data):
+        if not (_streamable(data) and _islice_args(*self.args)) or len(self.args) > 3:
+            return super().stream(data)
+
+        return islice(data, *self.args)
+
+
+class _Edge(AggregateNode):
+    # without a key, the first or last row as a list, like limit(), and
+    # otherwise the value of the key in that row, which is how they aggregate
+
+    def __init__(self, *args):
+        self.args = args
+        self.key = Key(*args)
+
+    def __str__(self):
+        return str(self.key) or type(self).__name__.lower()
+
+    def finalize(self, state):
+        return None if state is _EMPTY else state
+
+
+class First(_Edge):
+    cost = "O(1)"
+
+    def __call__(self, data):
+        if not self.args:
+            return data[:1]
+
+        return self.finalize(self.partial(data[:1]))
+
+    def stream(self, data):
+        if not _streamable(data):
+            return super().stream(data)
+
+        if not self.args:
+            return islice(data, 1)
+
+        return self.finalize(self.partial(islice(data, 1)))
+
+    def step(self, state, value):
+        return value if state is _EMPTY else state
+
+    def merge(self, state, other):
+        return other if state is _EMPTY else state
+
+
+class Last(_Edge):
+    cost = "O(1)"
 
-class First(DataNode):
     def __call__(self, data):
-        return data[:1]
+        if not self.args:
+            return data[-1:]
+
+        return self.finalize(self.partial(data[-1:]))
+
+    def step(self, state, value):
+        return value
+
+    def merge(self, state, other):
+        return state if other is _EMPTY else other
 
 
 class Count(DataNode):
+    cost = "O(1)"
+
     def __call__(self, data):
         return len(data)
 
+    def stream(self, data):
+        if isinstance(data, Iterator):
+            return sum(1 for row in data)
+
+        return len(data)
+
     def __str__(self):
         return "count"
 
+    # count() is also an accumulator, for aggregate()
+    key = Key()
+
+    def init(self):
+        return 0
+
+    def step(self, state, row):
+        return state + 1
+
+    def merge(self, state, other):
+        return state + other
+
+    def finalize(self, state):
+        return state
+
+
+_DICT = object()
+_LIST = object()
+_SCALARS = frozenset([str, int, float, bool, type(None)])
+
+
+def _freeze(value):
+    # a hashable value that's equal to the frozen form of another value only
+    # if the values are equal. Raises TypeError if that's not possible.
+    if type(value) in _SCALARS:
+        return value
+
+    if isinstance(value, Mapping):
+        return (_DICT, frozenset((k, _freeze(v)) for k, v in value.items()))
+
+    if isinstance(value, list):
+        return (_LIST, tuple(map(_freeze, value)))
+
+    if isinstance(value, tuple):
+        return tuple(map(_freeze, value))
+
+    if isinstance(value, set):
+        return frozenset(value)
+
+    hash(value)
+    return value
+
 
 class Distinct(DataNode):
+    fast_path = "hash"
+
     def __call__(self, data):
         new_data = []
+        seen = set()
+        unhashable = []
 
         for row in data:
-            if row not in new_data:
-                new_data.append(row)
+            try:
+                frozen = _freeze(row)
+            except TypeError:
+                # fallback to comparing with every row found so far
+                if row not in new_data:
+                    new_data.append(row)
+                    unhashable.append(row)
+                continue
+
+            if frozen in seen or (unhashable and row in unhashable):
+                continue
+
+            seen.add(frozen)
+            new_data.append(row)
+
         return new_data
 
 
 class Sort(DataNode):
+    cost = "O(n log n)"
+
     def __init__(self, *args):
         self.args = [("+", v) if isinstance(v, str) else v for v in args]
+        self.keys = [key for prefix, key in self.args]
+        self.desc = [prefix == "-" for prefix, key in self.args]
 
     def __call__(self, data):
-        # sort least significant first
-        if self.args:
-            for prefix, key in reversed(self.args):
-                data.sort(key=operator.itemgetter(key), reverse=prefix == "-")
-        else:
-            data.sort()
+        # sort a new list, nodes never change their input
+        if not self.args:
+            return sorted(data)
+
+        # one stable sort per key, least significant first, is faster than a
+        # single sort with a composite key, since list.sort has fast paths
+        # for comparing values of the same builtin type, but not tuples
+        data = list(data)
+        for key, reverse in reversed(list(zip(self.keys, self.desc))):
+            data.sort(key=_sort_getter(key), reverse=reverse)
 
         return data
 
 
+class _Desc:
+    # reverses the order of a value inside a composite sort key
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        if not isinstance(other, _Desc):
+            return NotImplemented
+        return self.value == other.value
+
+    def __lt__(self, other):
+        if not isinstance(other, _Desc):
+            return NotImplemented
+        return other.value < self.value
+
+
+def _sort_getter(key):
+    if not (isinstance(key, str) and "." in key):
+        return operator.itemgetter(key)
+
+    nested = Key(key)
+
+    # a dotted key may also be a field created by select()
+    def get(row):
+        try:
+            return row[key]
+        except KeyError:
+            return nested(row)
+
+    return get
+
+
+def _sort_key(keys):
+    if not any(isinstance(key, str) and "." in key for key in keys):
+        return operator.itemgetter(*keys)
+
+    getters = [_sort_getter(key) for key in keys]
+    if len(getters) == 1:
+        return getters[0]
+
+    return lambda row: tuple(get(row) for get in getters)
+
+
+def _sort_columns(keys, desc, data):
+    # one column of values per key, with descending ones reversed, so
+    # zipping them with the row position and the row gives tuples that
+    # sort in the right order, keeping ties stable and never comparing rows
+    columns = []
+    for key, reverse in zip(keys, desc):
+        column = list(map(_sort_getter(key), data))
+        if reverse:
+            # negating numbers is much cheaper than wrapping them
+            try:
+                column = list(map(operator.neg, column))
+            except TypeError:
+                column = list(map(_Desc, column))
+        columns.append(column)
+
+    return columns
+
+
+class _TopK(DataNode):
+    # sort followed by limit or first, selecting only the rows needed with a
+    # bounded heap instead of sorting everything
+    name = "topk"
+    cost = "O(n log k)"
+    fast_path = "heap"
+
+    def __init__(self, sort, count, offset=0):
+        self.args = (sort, count, offset)
+        self.sort = sort
+        self.count = count
+        self.offset = offset
+
+    def __call__(self, data):
+        n = self.offset + self.count
+        keys, desc = self.sort.keys, self.sort.desc
+
+        if not keys:
+            rows = heapq.nsmallest(n, data)
+        elif all(desc) or not any(desc):
+            # nlargest keeps ties in their original order, like a stable
+            # reverse sort
+            select = heapq.nlargest if desc[0] else heapq.nsmallest
+            rows = select(n, data, key=_sort_key(keys))
+        else:
+            data = list(data)
+            columns = _sort_columns(keys, desc, data)
+            rows = [row[-1] for row in heapq.nsmallest(n, zip(*columns, count(), data))]
+
+        return rows[self.offset :]
+
+
 class One(DataNode):
+    cost = "O(1)"
+
     def __call__(self, data):
         if len(data) > 1:
             raise RQLQueryError("Multiple results found for 'one'")
@@ -293,77 +1181,537 @@ class One(DataNode):
 
         return data
 
+    def stream(self, data):
+        # two rows are enough to know there's more than one
+        if isinstance(data, Iterator):
+            data = list(islice(data, 2))
 
-class Query:
-    def __init__(self, data, default_limit=None, max_limit=None):
-        self.data = data
+        return self(data)
+
+
+def _streamable(data):
+    # slicing anything else, like a single row or a string, is not the same
+    # as slicing an iterator over it
+    return isinstance(data, (Iterator, list))
+
+
+def _islice_args(*args):
+    # islice doesn't support negative values like slicing does
+    return all(arg is None or (isinstance(arg, int) and arg >= 0) for arg in args)
+
+
+def _filter_keys(node):
+    # all keys a filter reads, or None if unknown
+    if isinstance(node, _Filter):
+        return [node.key, node.value] if isinstance(node.value, Key) else [node.key]
+
+    if isinstance(node, _MembershipNode):
+        return [node.key]
+
+    if isinstance(node, (And, Or)):
+        keys = []
+        for arg in node.args:
+            if arg is None:
+                continue
+
+            arg_keys = _filter_keys(arg)
+            if arg_keys is None:
+                return None
+            keys.extend(arg_keys)
+
+        return keys
+
+    return None
+
+
+def _can_move_before(node, prev):
+    # filtering before a stable sort gives the same rows in the same order
+    if isinstance(prev, Sort):
+        return True
+
+    # select keeps flat keys as they are, so a filter reading only those
+    # gets the same values before it
+    if isinstance(prev, Select):
+        keys = _filter_keys(node)
+        selected = {str(key) for key in prev.keys if len(key.args) == 1}
+        return keys is not None and all(
+            len(key.args) == 1 and key.args[0] in selected for key in keys
+        )
+
+    return False
+
+
+def _is_safe(node):
+    # equality and membership on a flat key never raise, so running them
+    # before other filters can't make the query fail
+    if not isinstance(node, (EqualTo, NotEqualTo, In, Out)):
+        return False
+
+    return all(len(key.args) == 1 for key in _filter_keys(node))
+
+
+def _push_filters(pipeline):
+    plan = []
+    for node in pipeline:
+        i = len(plan)
+        if isinstance(node, RowNode):
+            while i and _can_move_before(node, plan[i - 1]):
+                i -= 1
+
+        plan.insert(i, node)
+
+    return plan
+
+
+def _fuse_filters(pipeline):
+    # adjacent filters run in a single pass, with the safe ones first
+    plan = []
+    for node in pipeline:
+        if isinstance(node, RowNode) and plan and isinstance(plan[-1], list):
+            plan[-1].append(node)
+        else:
+            plan.append([node] if isinstance(node, RowNode) else node)
+
+    for i, node in enumerate(plan):
+        if isinstance(node, list):
+            if len(node) == 1:
+                plan[i] = node[0]
+            else:
+                node.sort(key=lambda f: not _is_safe(f))
+                plan[i] = And(*node)
+
+    return plan
+
+
+def _top_k(pipeline):
+    plan = []
+    for node in pipeline:
+        if plan and isinstance(plan[-1], Sort):
+            if isinstance(node, First) and not node.args:
+                plan[-1] = _TopK(plan[-1], 1)
+                continue
+
+            if isinstance(node, Limit):
+                limit, offset = node.args
+                if limit and _islice_args(limit, offset):
+                    plan[-1] = _TopK(plan[-1], limit, offset or 0)
+                    continue
+
+        plan.append(node)
+
+    return plan
+
+
+class _IndexLookup(Node):
+    name = "index_lookup"
+    cost = "O(k)"
+    fast_path = "index"
+
+    def __init__(self, lookups, sort=None, sort_index=None, limit=None, filters=None):
+        # lookups are pairs of an index and the filters it answers, and if
+        # there's a sort, the rows are returned in the order of its index
+        indexed = [node for index, nodes in lookups for node in nodes]
+        self.args = tuple(indexed) + tuple(node for node in (sort, limit) if node)
+        self.lookups = lookups
+        self.sort = sort
+        self.sort_index = sort_index
+        self.reverse = sort.desc[0] if sort else None
+        # a limit right after the sort only takes a slice of the positions
+        self.limit = None
+        if limit is not None:
+            count, offset = limit.args
+            self.limit = (offset or 0, (offset or 0) + count)
+
+        # all the filters, in the order a scan checks them, for the rows the
+        # indexes couldn't place and when running on other data than the
+        # indexes were built over
+        filters = indexed if filters is None else filters
+        self.fallback = And(*filters) if filters else None
+
+    def feed(self, data):
+        indexes = [index for index, nodes in self.lookups] + [self.sort_index]
+        if any(
+            index is not None and (index.data is not data or index.size != len(data))
+            for index in indexes
+        ):
+            rows = self.fallback.feed(data) if self.fallback else data
+            rows = self.sort.feed(rows) if self.sort else rows
+            return rows[slice(*self.limit)] if self.limit else rows
+
+        sort_index, reverse = self.sort_index, self.reverse
+
+        if len(self.lookups) == 1 and self.lookups[0][0] is sort_index:
+            # a range of the sorted index is already in order, and it can
+            # only sort if it placed all rows
+            index, nodes = self.lookups[0]
+            positions = index.lookup(nodes, reverse)
+        elif not self.lookups:
+            positions = sort_index.lookup((), reverse)
+        else:
+            found = None
+            others = set()
+            for index, nodes in self.lookups:
+                positions = index.lookup(nodes)
+                found = set(positions) if found is None else found.intersection(positions)
+                others.update(index.others)
+
+            # the rows an index couldn't place may fail a filter, so they're
+            # checked with all of them, failing or matching just like a scan
+            fallback = self.fallback
+            found.update(i for i in sorted(others) if fallback(data[i]))
+            positions = sorted(found)
+
+            if sort_index is not None:
+                positions = sorted(positions, key=sort_index.rank(reverse).__getitem__)
+
+        if self.limit:
+            positions = positions[slice(*self.limit)]
+
+        return [data[i] for i in positions]
 
-        self._default_limit = default_limit
-        self._max_limit = max_limit
+
+def _index_for(node, indexes):
+    index = indexes.get(str(node.key)) if hasattr(node, "key") else None
+    if index is not None and index.supports(node):
+        return index
+
+    return None
+
+
+def _use_indexes(pipeline, indexes):
+    # answer the filters at the start of the pipeline from the indexes, and
+    # leave the others to be checked only for the rows found
+    if not indexes or not pipeline:
+        return pipeline
+
+    plan = list(pipeline)
+    lookups = {}
+    rest = []
+    filters = []
+
+    if isinstance(plan[0], RowNode):
+        first = plan.pop(0)
+        filters = first.args if isinstance(first, And) else [first]
+        filters = [node for node in filters if node is not None]
+        for node in filters:
+            index = _index_for(node, indexes)
+            if index is not None:
+                lookups.setdefault(index, []).append(node)
+            else:
+                rest.append(node)
+
+    # a sort on a single indexed key just takes the rows in index order, and
+    # since it's stable, the remaining filters can run after it
+    sort = sort_index = None
+    if plan and isinstance(plan[0], Sort) and len(plan[0].keys) == 1:
+        key = plan[0].keys[0]
+        index = indexes.get(str(Key(key))) if isinstance(key, str) else None
+        if index is not None and index.can_sort():
+            sort = plan.pop(0)
+            sort_index = index
+
+    if not lookups and sort is None:
+        return pipeline
+
+    limit = None
+    if sort is not None and not rest and plan and isinstance(plan[0], Limit):
+        count, offset = plan[0].args
+        if count and _islice_args(count, offset):
+            limit = plan.pop(0)
+
+    plan.insert(0, _IndexLookup(list(lookups.items()), sort, sort_index, limit, filters))
+
+    if rest:
+        plan.insert(1, rest[0] if len(rest) == 1 else And(*rest))
+
+    return plan
+
+
+def _plan(pipeline, codegen=False, indexes=None):
+    # rewrite the pipeline into an equivalent one that's faster to execute
+    plan = _top_k(_use_indexes(_fuse_filters(_push_filters(pipeline)), indexes))
+
+    if codegen:
+        from .codegen import _GeneratedFilter
+
+        plan = [_GeneratedFilter(node) if isinstance(node, RowNode) else node for node in plan]
+
+    return plan
+
+
+def _node_error(node, exc):
+    return RQLQueryError(f"{exc.__class__.__name__} executing node {node}: {exc}")
+
+
+def _guard(node, rows):
+    # errors in a streaming node are only raised when its rows are consumed
+    # by the next one, so they have to be wrapped here
+    try:
+        yield from rows
+    except RQLQueryError:
+        raise
+    except Exception as exc:
+        raise _node_error(node, exc) from exc
+
+
+def _node_event(node, rows_in, rows_out, elapsed):
+    return {
+        "node": _node_name(node),
+        "rows_in": rows_in,
+        "rows_out": rows_out,
+        "elapsed_ns": elapsed,
+    }
+
+
+class _TimedRows:
+    # the rows of a streaming node, counting them and the time spent reading
+    # them, which includes any streaming nodes before it, and reporting the
+    # node once they're all read or closed
+
+    def __init__(self, node, rows, rows_in, elapsed, upstream=None):
+        self.node = node
+        self.rows = rows
+        self.rows_in = rows_in
+        self.rows_out = 0
+        self.elapsed = elapsed
+        self.upstream = upstream
+        self.done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter_ns()
+        try:
+            row = next(self.rows)
+        except StopIteration:
+            self.elapsed += time.perf_counter_ns() - start
+            self.close()
+            raise
+
+        self.elapsed += time.perf_counter_ns() - start
+        self.rows_out += 1
+        return row
+
+    def close(self):
+        # nodes before this one won't be read anymore either, and they're
+        # reported first, in the order they run
+        if self.upstream is not None:
+            self.upstream.close()
+
+        if not self.done:
+            self.done = True
+            notify(NODE_HOOKS, _node_event(self.node, self.rows_in, self.rows_out, self.elapsed))
+
+
+def _count_rows(data):
+    if isinstance(data, list):
+        return len(data)
+    if isinstance(data, Mapping):
+        return 1
+    return None
+
+
+class CompiledQuery:
+    def __init__(
+        self,
+        expr="",
+        default_limit=None,
+        max_limit=None,
+        ignore_top_eq=None,
+        parser=None,
+        isolate=True,
+        stream=False,
+        codegen=False,
+    ):
+        self.parser = parser or Parser()
+        self.default_limit = default_limit
+        self.max_limit = max_limit
+        self.isolate = isolate
+        self.stream = stream
+        self.codegen = codegen
         self._limit_clause = None
+        self._cached_plan = None
+        self._cached_indexes = None
 
         self.rql_parsed = None
         self.rql_expr = ""
 
+        # the parsed expressions of this query and those it was built from
+        self._parsed = ()
+        self._cache_key = None
+
         self.pipeline = []
 
+        if expr:
+            self._compile(expr, ignore_top_eq)
+
     def query(self, expr, ignore_top_eq=None):
         if not expr:
             return self
 
         new = copy(self)
+        new.pipeline = list(self.pipeline)
+        new._compile(expr, ignore_top_eq)
+
+        return new
+
+    def run(self, data, indexes=None, isolate=None):
+        if isolate is not None and isolate != self.isolate:
+            # subclasses may copy rows before the end too, so a copy of the
+            # query runs with the other setting
+            compiled = copy(self)
+            compiled.isolate = isolate
+            return compiled.run(data, indexes)
+
+        # nodes never change their input, so the pipeline can run on the
+        # original data and only the result has to be copied
+        if NODE_HOOKS:
+            return self._run_hooked(data, indexes)
+
+        for node in self._get_plan(indexes):
+            data = self._run_node(node, data)
+
+        return self._result(data)
+
+    def _run_hooked(self, data, indexes):
+        streams = []
+        try:
+            for node in self._get_plan(indexes):
+                rows_in = self._count_rows(data)
+                upstream = data if isinstance(data, _TimedRows) else None
+                start = time.perf_counter_ns()
+                data = self._run_node(node, data)
+                elapsed = time.perf_counter_ns() - start
+
+                if isinstance(data, Iterator):
+                    # streaming nodes do their work as their rows are read,
+                    # so they're timed as that happens
+                    data = _TimedRows(node, data, rows_in, elapsed, upstream)
+                    streams.append(data)
+                else:
+                    rows_out = self._count_rows(data)
+                    notify(NODE_HOOKS, _node_event(node, rows_in, rows_out, elapsed))
+
+            return self._result(data)
+        finally:
+            # nodes that stopped reading before the end, like those before a
+            # limit, are reported when the query is done
+            for rows in streams:
+                rows.close()
+
+    def _result(self, data):
+        if isinstance(data, Iterator):
+            data = list(data)
+
+        if self.isolate:
+            data = deepcopy(data)
+
+        return data
+
+    def explain(self, data=None, analyze=False, indexes=None):
+        if analyze and data is None:
+            raise ValueError("explain needs data to analyze")
+
+        plan = []
+        for node in self._get_plan(indexes):
+            info = node.explain()
+            if analyze:
+                data, info["rows_in"], info["rows_out"], elapsed = self._run_timed(node, data)
+                info["time_ms"] = elapsed / 1e6
+
+            plan.append(info)
+
+        return plan
+
+    def _count_rows(self, data):
+        return _count_rows(data)
 
-        new.rql_expr = expr = unquote(expr)
-        new.rql_parsed = Parser().parse(expr)
+    def _run_timed(self, node, data):
+        rows_in = self._count_rows(data)
+        start = time.perf_counter_ns()
+        data = self._run_node(node, data)
+        if isinstance(data, Iterator):
+            # streaming nodes only do their work when consumed, so they have
+            # to be materialized to be timed
+            data = list(data)
+
+        elapsed = time.perf_counter_ns() - start
+        return data, rows_in, self._count_rows(data), elapsed
+
+    def _run_node(self, node, data):
+        try:
+            data = node.stream(data) if self.stream else node.feed(data)
+        except RQLQueryError:
+            raise
+        except Exception as exc:
+            raise _node_error(node, exc) from exc
+
+        if isinstance(data, Iterator):
+            data = _guard(node, data)
+
+        return data
+
+    def _get_plan(self, indexes=None):
+        # the plan depends on which indexes are available, so it's rebuilt
+        # when they change
+        indexes = dict(indexes or {})
+        if self._cached_plan is None or self._cached_indexes != indexes:
+            pipeline = list(self.pipeline)
+
+            # if there's a default limit and no limit clause was added,
+            # add one and feed the data through it
+            if self.default_limit and self._limit_clause is None:
+                pipeline.append(Limit(self.default_limit, 0))
+
+            self._cached_plan = _plan(pipeline, codegen=self.codegen, indexes=indexes)
+            self._cached_indexes = indexes
+
+        return self._cached_plan
+
+    def cache_key(self):
+        # a hashable key for the results of this query on any given data
+        if self._cache_key is None:
+            self._cache_key = (
+                tuple(ast_hash(parsed) for parsed in self._parsed),
+                self.default_limit,
+                self.max_limit,
+            )
+
+        return self._cache_key
+
+    def _compile(self, expr, ignore_top_eq):
+        self._cached_plan = None
+        self._cache_key = None
+        self.rql_expr = expr = unquote(expr)
+        self.rql_parsed = self.parser.parse(expr)
 
         # if there's a query, build the pipeline
-        if new.rql_parsed:
+        if self.rql_parsed:
             # if top-level node is not an 'and', make it so
-            if new.rql_parsed["name"] != "and":
-                new.rql_parsed = {"name": "and", "args": [new.rql_parsed]}
+            if self.rql_parsed["name"] != "and":
+                self.rql_parsed = {"name": "and", "args": [self.rql_parsed]}
 
             # if we were asked to ignore any top level eq nodes,
             # remove them
             if ignore_top_eq:
-                new.rql_parsed["args"] = [
+                self.rql_parsed["args"] = [
                     arg
-                    for arg in new.rql_parsed["args"]
+                    for arg in self.rql_parsed["args"]
                     if arg["name"] != "eq" or arg["args"][0] not in ignore_top_eq
                 ]
 
-            try:
-                new.pipeline.extend(new._apply(new.rql_parsed).args)
-            except RQLQueryError:
-                raise
-            except Exception as exc:
-                raise RQLQueryError(
-                    f"{exc.__class__.__name__} preparing pipeline: {exc.args}"
-                ) from exc
+            self._parsed += (_copy_ast(self.rql_parsed),)
 
-        return new
-
-    def all(self):
-        # deepcopy data so we can transform it at will
-        data = deepcopy(self.data)
-
-        # execute the pipeline
-        for node in self.pipeline:
             try:
-                data = node.feed(data)
+                self.pipeline.extend(self._apply(self.rql_parsed).args)
             except RQLQueryError:
                 raise
             except Exception as exc:
                 raise RQLQueryError(
-                    f"{exc.__class__.__name__} executing node {node}: {exc}"
+                    f"{exc.__class__.__name__} preparing pipeline: {exc.args}"
                 ) from exc
 
-        # if there's a default limit and no limit clause was added,
-        # add one and feed the data through it
-        if self._default_limit and self._limit_clause is None:
-            data = Limit(self._default_limit, 0).feed(data)
-
-        return data
-
     def _apply(self, token):
         if not isinstance(token, Mapping):
             return token
@@ -376,7 +1724,7 @@ class Query:
 
         # if node is Limit, apply limit constraints
         if node_class == Limit:
-            limit = min(args[0] or float("inf"), self._max_limit or float("inf"))
+            limit = min(args[0] or float("inf"), self.max_limit or float("inf"))
             try:
                 offset = args[1]
             except IndexError:
@@ -386,3 +1734,95 @@ class Query:
             self._limit_clause = True
 
         return node_class(*args, **kwargs)
+
+
+_MISSING = object()
+
+
+class Query:
+    def __init__(
+        self,
+        data,
+        default_limit=None,
+        max_limit=None,
+        parser=None,
+        isolate=True,
+        stream=False,
+        codegen=False,
+        indexes=None,
+        sorted_indexes=None,
+        cache=None,
+        version=None,
+    ):
+        if cache is not None and version is None:
+            raise ValueError("A result cache requires a data version")
+
+        self.data = data
+        self.indexes = {}
+        self.cache = cache
+        self.version = version
+        self.compiled = CompiledQuery(
+            default_limit=default_limit,
+            max_limit=max_limit,
+            parser=parser,
+            isolate=isolate,
+            stream=stream,
+            codegen=codegen,
+        )
+
+        for key in indexes or ():
+            self.create_index(key)
+
+        for key in sorted_indexes or ():
+            self.create_index(key, sorted=True)
+
+    @property
+    def rql_parsed(self):
+        return self.compiled.rql_parsed
+
+    @property
+    def rql_expr(self):
+        return self.compiled.rql_expr
+
+    @property
+    def pipeline(self):
+        return self.compiled.pipeline
+
+    def query(self, expr, ignore_top_eq=None):
+        if not expr:
+            return self
+
+        new = copy(self)
+        new.compiled = self.compiled.query(expr, ignore_top_eq)
+        new.indexes = dict(self.indexes)
+
+        return new
+
+    def create_index(self, key, sorted=False):
+        from .index import HashIndex
+        from .index import SortedIndex
+
+        index = (SortedIndex if sorted else HashIndex)(self.data, key)
+        self.indexes[str(index.key)] = index
+        return index
+
+    def all(self):
+        if self.cache is None:
+            return self.compiled.run(self.data, self.indexes)
+
+        key = (self.version, self.compiled.cache_key())
+        result = self.cache.get(key, _MISSING)
+        if result is _MISSING:
+            # the result is copied below anyway, so it's cached as it is
+            result = self.compiled.run(self.data, self.indexes, isolate=False)
+            self.cache.set(key, result)
+
+        # the cached result is returned to every caller, so it can't be
+        # changed by any of them
+        if self.compiled.isolate:
+            return deepcopy(result)
+
+        return copy(result) if isinstance(result, list) else result
+
+    def explain(self, analyze=False):
+        return self.compiled.explain(self.data, analyze, self.indexes)
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+import math
+from decimal import Decimal
+from hashlib import blake2b
+
+# Fixed size summaries of a stream of values, for approximate aggregates.
+# Both can be merged, so the sketches of parts of the data, like shards or
+# groups, give the same estimate as a sketch of the whole.
+
+
+def _encode(value):
+    if isinstance(value, str):
+        return b"s" + value.encode("utf-8", "surrogatepass")
+
+    # equal numbers must be encoded the same way, as they're the same value
+    # for distinct()
+    if isinstance(value, (int, float, Decimal)) and value == value and abs(value) != math.inf:
+        if value == int(value):
+            return b"n" + str(int(value)).encode()
+
+    return b"r" + repr(value).encode("utf-8", "surrogatepass")
+
+
+def _hash(value):
+    # a 64 bit hash, the same in any process, unlike hash() for strings
+    return int.from_bytes(blake2b(_encode(value), digest_size=8).digest(), "big")
+
+
+_POWERS = [2.0**-i for i in range(66)]
+
+
+class HyperLogLog:
+    # counts distinct values with a standard error of about 1.04 / sqrt(2 **
+    # precision), using up to 2 ** precision bytes. Registers start sparse,
+    # as a dict of the ones that aren't zero, so a sketch of a few values,
+    # like one of many small groups, stays small, and become dense once
+    # they'd take about half the memory of all of them
+
+    def __init__(self, precision=14):
+        if not isinstance(precision, int) or not 4 <= precision <= 16:
+            raise ValueError("precision must be an integer from 4 to 16")
+
+        self.precision = precision
+        # an entry of the dict takes about as much memory as 64 registers
+        self._limit = (1 << precision) // 128
+        self._sparse = {} if self._limit else None
+        self._dense = None if self._limit else bytearray(1 << precision)
+
+    @property
+    def registers(self):
+        if self._dense is not None:
+            return self._dense
+
+        registers = bytearray(1 << self.precision)
+        for index, rank in self._sparse.items():
+            registers[index] = rank
+        return registers
+
+    def add(self, value):
+        h = _hash(value)
+        bits = 64 - self.precision
+        index = h >> bits
+        # the position of the first set bit in the rest of the hash
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if self._dense is not None:
+            if rank > self._dense[index]:
+                self._dense[index] = rank
+        elif rank > self._sparse.get(index, 0):
+            self._sparse[index] = rank
+            self._densify()
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Can't merge sketches with different precision")
+
+        merged = HyperLogLog(self.precision)
+        if self._dense is None and other._dense is None:
+            merged._sparse = dict(self._sparse)
+            for index, rank in other._sparse.items():
+                if rank > merged._sparse.get(index, 0):
+                    merged._sparse[index] = rank
+            merged._densify()
+        else:
+            merged._sparse = None
+            merged._dense = bytearray(map(max, self.registers, other.registers))
+
+        return merged
+
+    def count(self):
+        m = 1 << self.precision
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        if self._dense is None:
+            ranks = self._sparse.values()
+            zeros = m - len(self._sparse)
+        else:
+            ranks = self._dense
+            zeros = self._dense.count(0)
+
+        # empty registers add 2 ** -0 each, and fsum gives the same total for
+        # either form, in any order
+        estimate = alpha * m * m / math.fsum([zeros] + [_POWERS[r] for r in ranks if r])
+
+        # the raw estimate is biased for small counts, where linear counting
+        # of the empty registers is better
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+
+        return round(estimate)
+
+    def _densify(self):
+        if self._dense is None and len(self._sparse) > self._limit:
+            self._dense = self.registers
+            self._sparse = None
+
+
+class KLL:
+    # a quantile sketch keeping about 3 * k values, with a rank error of
+    # about 1.7 / k, as levels of values where each one at level h stands
+    # for 2 ** h values of the input. When there are too many, a level is
+    # sorted and every other value moves to the next one. Which half moves
+    # alternates instead of being random, so the results are reproducible
+
+    def __init__(self, k=200):
+        if not isinstance(k, int) or k < 8:
+            raise ValueError("k must be an integer of at least 8")
+
+        self.k = k
+        self.count = 0
+        self.levels = [[]]
+        self._size = 0
+        self._max_size = self._capacities()
+        self._flip = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, value):
+        self.levels[0].append(value)
+        self.count += 1
+        self._size += 1
+        if self._size >= self._max_size:
+            self._compact()
+
+    def merge(self, other):
+        if other.k != self.k:
+            raise ValueError("Can't merge sketches with different k")
+
+        merged = KLL(self.k)
+        merged.count = self.count + other.count
+        merged._flip = self._flip
+        size = max(len(self.levels), len(other.levels))
+        merged.levels = [
+            (self.levels[h] if h < len(self.levels) else [])
+            + (other.levels[h] if h < len(other.levels) else [])
+            for h in range(size)
+        ]
+        merged._size = self._size + other._size
+        merged._max_size = merged._capacities()
+        while merged._size >= merged._max_size:
+            merged._compact()
+
+        return merged
+
+    def quantile(self, q):
+        if not self.count:
+            raise ValueError("quantile of no values")
+
+        items = sorted((value, 1 << h) for h, level in enumerate(self.levels) for value in level)
+        target = q * sum(weight for value, weight in items)
+        total = 0
+        for value, weight in items:
+            total += weight
+            if total >= target:
+                return value
+
+        return items[-1][0]
+
+    def _capacity(self, h):
+        # lower levels are smaller, down to 2/3 of the one above
+        return max(2, int(self.k * (2 / 3) ** (len(self.levels) - h - 1)))
+
+    def _capacities(self):
+        return sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def _compact(self):
+        for h, level in enumerate(self.levels):
+            if len(level) >= self._capacity(h):
+                break
+
+        if h + 1 == len(self.levels):
+            self.levels.append([])
+            self._max_size = self._capacities()
+
+        # with an odd number of values, one stays at this level
+        rest = [level.pop()] if len(level) % 2 else []
+        level.sort()
+        promoted = level[self._flip :: 2]
+        self._flip ^= 1
+
+        self.levels[h + 1].extend(promoted)
+        self.levels[h] = rest
+        self._size -= len(level) - len(promoted)
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def load_data():
+    # each call gives new rows from testdata.json, so test modules can add
+    # their own fields to them
+    def load():
+        with open(os.path.join(os.path.dirname(__file__), "testdata.json")) as f:
+            data_ = json.load(f)
+
+        for row in data_:
+            # convert coordinates to a nested dict, for nested attribute operations
+            row["position"] = {
+                "latitude": row.pop("latitude"),
+                "longitude": row.pop("longitude"),
+            }
+
+        return data_
+
+    return load
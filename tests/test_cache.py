@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from pyrql import Query
+from pyrql import ResultCache
+from pyrql import RQLQueryError
+from pyrql import query
+
+
+class Timer:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def data():
+    return [{"a": i % 3, "b": i} for i in range(30)]
+
+
+class TestResultCache:
+    def test_hits_and_misses(self):
+        cache = ResultCache(maxsize=10)
+        assert cache.get("a") is None
+
+        cache.set("a", [1, 2])
+        assert cache.get("a") == [1, 2]
+        assert cache.info() == (1, 1, 0, 10, 1, 2, None)
+
+    def test_lru_eviction(self):
+        cache = ResultCache(maxsize=2)
+        cache.set("a", [1])
+        cache.set("b", [2])
+        cache.get("a")
+        cache.set("c", [3])
+
+        assert cache.get("b") is None
+        assert cache.get("a") == [1]
+        assert cache.info().evictions == 1
+
+    def test_max_rows(self):
+        cache = ResultCache(max_rows=5)
+        cache.set("a", [1, 2])
+        cache.set("b", [1, 2])
+        cache.set("c", [1, 2])
+
+        assert cache.get("a") is None
+        assert cache.info().rows == 4
+        assert cache.info().currsize == 2
+
+    def test_too_many_rows_not_cached(self):
+        cache = ResultCache(max_rows=5)
+        cache.set("a", [1])
+        cache.set("b", list(range(6)))
+
+        assert cache.get("b") is None
+        assert cache.get("a") == [1]
+
+    def test_scalar_counts_as_one_row(self):
+        cache = ResultCache()
+        cache.set("a", 42)
+        cache.set("b", {"a": 1, "b": 2})
+        assert cache.info().rows == 2
+
+    def test_replace(self):
+        cache = ResultCache()
+        cache.set("a", [1, 2, 3])
+        cache.set("a", [1])
+        assert cache.get("a") == [1]
+        assert cache.info().rows == 1
+
+    def test_ttl(self):
+        timer = Timer()
+        cache = ResultCache(ttl=10, timer=timer)
+        cache.set("a", [1])
+
+        timer.now = 9
+        assert cache.get("a") == [1]
+
+        timer.now = 10
+        assert cache.get("a") is None
+        assert cache.info().currsize == 0
+        assert cache.info().rows == 0
+
+    def test_clear(self):
+        cache = ResultCache()
+        cache.set("a", [1])
+        cache.get("a")
+        cache.clear()
+        assert cache.info() == (0, 0, 0, 128, 0, 0, None)
+
+    @pytest.mark.parametrize(
+        "kwargs", [{"maxsize": 0}, {"maxsize": None}, {"ttl": 0}, {"max_rows": 0}]
+    )
+    def test_invalid(self, kwargs):
+        with pytest.raises(ValueError):
+            ResultCache(**kwargs)
+
+
+class TestQueryCache:
+    def test_cached(self, data):
+        cache = ResultCache()
+        q = Query(data, cache=cache, version=1)
+
+        r1 = q.query("eq(a,1)&sort(-b)").all()
+        r2 = q.query("eq(a,1)&sort(-b)").all()
+
+        assert r1 == r2 == Query(data).query("eq(a,1)&sort(-b)").all()
+        assert cache.info().hits == 1
+        assert cache.info().misses == 1
+
+    def test_not_reexecuted(self, data):
+        q = Query(data, cache=ResultCache(), version=1).query("eq(a,1)")
+        expected = q.all()
+
+        # the pipeline isn't run again, so changing the data without
+        # changing the version returns the cached result
+        data.clear()
+        assert q.all() == expected
+
+    def test_version(self, data):
+        cache = ResultCache()
+        Query(data, cache=cache, version="v1").query("eq(a,1)").all()
+        data.append({"a": 1, "b": 30})
+        result = Query(data, cache=cache, version="v2").query("eq(a,1)").all()
+
+        assert len(result) == 11
+        assert cache.info().misses == 2
+
+    @pytest.mark.parametrize(
+        "expr1, expr2",
+        [
+            ("eq(a,1)", "eq(a,2)"),
+            ("eq(a,1)", "eq(a,1.5)"),
+            ("eq(a,1)", "eq(a,true)"),
+            ("eq(a,1)", "eq(a,string:1)"),
+            ("sort(+b)", "sort(-b)"),
+            ("eq(a,1)&limit(2)", "eq(a,1)&limit(3)"),
+        ],
+    )
+    def test_different_queries(self, data, expr1, expr2):
+        cache = ResultCache()
+        q = Query(data, cache=cache, version=1)
+        q.query(expr1).all()
+        q.query(expr2).all()
+        assert cache.info().misses == 2
+
+    @pytest.mark.parametrize("expr", ["a=1&sort(-b)", "eq(a,1)&sort(-b)", "and(eq(a,1),sort(-b))"])
+    def test_same_query(self, data, expr):
+        cache = ResultCache()
+        q = Query(data, cache=cache, version=1)
+        q.query("a=1&sort(-b)").all()
+        q.query(expr).all()
+        assert cache.info().hits == 1
+
+    def test_normalized_queries(self, data):
+        cache = ResultCache()
+        q = Query(data, cache=cache, version=1)
+        r1 = q.query("or(eq(a,1),eq(a,2))&lt(b,10)").all()
+        r2 = q.query("and(lt(b,10),in(a,(2,1)))").all()
+        assert r1 == r2
+        assert cache.info().hits == 1
+
+    def test_chained_queries(self, data):
+        cache = ResultCache()
+        q = Query(data, cache=cache, version=1)
+        r1 = q.query("eq(a,1)").query("limit(2)").all()
+        r2 = q.query("eq(a,2)").query("limit(2)").all()
+        assert r1 != r2
+        assert cache.info().misses == 2
+
+    def test_limits_in_key(self, data):
+        cache = ResultCache()
+        Query(data, cache=cache, version=1, default_limit=5).query("eq(a,1)").all()
+        result = Query(data, cache=cache, version=1, default_limit=2).query("eq(a,1)").all()
+        assert len(result) == 2
+
+    def test_isolated(self, data):
+        q = Query(data, cache=ResultCache(), version=1).query("eq(a,1)")
+        q.all()[0]["b"] = "changed"
+        assert q.all()[0]["b"] == 1
+
+    def test_copied_once(self, data, monkeypatch):
+        copies = []
+        monkeypatch.setattr(query, "deepcopy", lambda value: copies.append(value) or value)
+        q = Query(data, cache=ResultCache(), version=1).query("eq(a,1)")
+        q.all()
+        assert len(copies) == 1
+
+        q.all()
+        assert len(copies) == 2
+
+    def test_not_isolated(self, data):
+        q = Query(data, cache=ResultCache(), version=1, isolate=False).query("eq(a,1)")
+        result = q.all()
+        result.clear()
+        assert q.all()[0] is data[1]
+
+    def test_errors_not_cached(self):
+        cache = ResultCache()
+        q = Query([{"a": "x"}], cache=cache, version=1).query("lt(a,1)")
+        for _ in range(2):
+            with pytest.raises(RQLQueryError):
+                q.all()
+
+        assert cache.info().currsize == 0
+
+    def test_requires_version(self, data):
+        with pytest.raises(ValueError):
+            Query(data, cache=ResultCache())
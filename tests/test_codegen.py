@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from pyrql import Query
+from pyrql import RQLQueryError
+from pyrql import query
+from pyrql.codegen import _GeneratedFilter
+from pyrql.codegen import compile_predicate
+
+
+@pytest.fixture(scope="session")
+def data(load_data):
+    return load_data()
+
+
+class TestCodegen:
+    @pytest.mark.parametrize(
+        "expr",
+        [
+            "eq(gender,male)",
+            "ne(gender,male)",
+            "lt(index,10)",
+            "le(index,10)",
+            "gt(index,990)",
+            "ge(index,990)",
+            "eq(index,key(age))",
+            "eq(missing,null)",
+            "lt(position.latitude,0)",
+            "in(state,(FL,TX))",
+            "out(state,(FL,TX))",
+            "in(index,(1,2,3,4,5,6,7,8,9,10))",
+            "out(index,(1,2,3,4,5,6,7,8,9,10))",
+            "contains(tags,dolor)",
+            "excludes(tags,dolor)",
+            "or(eq(gender,male),lt(index,10))",
+            "or(and(eq(gender,male),lt(index,10)),and(eq(state,FL),gt(index,900)))",
+            "or(eq(isActive,true),and(in(eyeColor,(blue,green)),excludes(tags,ut)))",
+            "eq(gender,male)&or(lt(index,10),gt(index,990))&select(index)",
+        ],
+    )
+    def test_same_result(self, data, expr):
+        exp = Query(data).query(expr).all()
+        assert Query(data, codegen=True).query(expr).all() == exp
+
+    @pytest.mark.parametrize("stream", [True, False])
+    def test_errors(self, data, stream):
+        with pytest.raises(RQLQueryError) as exc:
+            Query(data, codegen=True, stream=stream).query("lt(index,tags)").all()
+
+        assert exc.value.args[0].startswith("TypeError executing node <pyrql.query.LessThan")
+
+    def test_plan(self):
+        compiled = query.CompiledQuery("eq(a,1)&limit(5)&or(eq(b,1),eq(c,2))", codegen=True)
+        plan = compiled._get_plan()
+
+        assert [type(node) for node in plan] == [_GeneratedFilter, query.Limit, _GeneratedFilter]
+        assert compiled._get_plan() is plan
+
+    def test_not_a_query_function(self):
+        with pytest.raises(RQLQueryError):
+            Query([{"a": 1}]).query("generatedfilter(eq(a,1))").all()
+
+    def test_constants_are_not_in_source(self):
+        node = query.And(
+            query.EqualTo("a'), __import__('os')('x", "');"),
+            query.In("b", ("\n", 1)),
+        )
+        predicate = compile_predicate(node)
+
+        assert "__import__" not in predicate.source
+        assert "\n" not in predicate.source.split("return ")[1].strip()
+        assert predicate({"a'), __import__('os')('x": "');", "b": "\n"})
+        assert not predicate({"b": "\n"})
+
+    def test_flat_expression(self):
+        node = query.And(
+            query.EqualTo("a", 1), query.Or(query.LessThan("b.c", 2), query.Excludes("d", 3))
+        )
+        predicate = compile_predicate(node)
+
+        assert predicate.source.splitlines()[2].strip() == (
+            "return ((row.get(_c0) == _c1) and "
+            "((row.get(_c2).get(_c3) < _c4) or (_c5 not in row.get(_c6))))"
+        )
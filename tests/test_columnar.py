@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+import math
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from pyrql import Query  # noqa: E402
+from pyrql import RQLQueryError  # noqa: E402
+from pyrql.columnar import ColumnarQuery  # noqa: E402
+from pyrql.columnar import Columns  # noqa: E402
+
+
+def make_rows(n=2000):
+    random.seed(0)
+    return [
+        {
+            "id": i,
+            "group": random.randint(0, 9),
+            "state": random.choice(["CA", "NY", "TX", "WA"]),
+            "value": round(random.uniform(-100, 100), 3),
+            "count": random.randint(-50, 50),
+            "active": random.random() < 0.5,
+            "tags": random.sample("xyz", 2),
+            "nested": {"a": random.randint(0, 3)},
+        }
+        for i in range(n)
+    ]
+
+
+EXPRESSIONS = [
+    "eq(group,3)",
+    "ne(state,CA)",
+    "lt(value,0)",
+    "le(count,0)&ge(count,-10)",
+    "gt(state,NY)",
+    "eq(active,true)",
+    "eq(count,key(group))",
+    "lt(count,key(value))",
+    "in(state,(CA,TX))",
+    "out(group,(1,2,3))",
+    "or(eq(group,1),and(lt(value,0),eq(state,WA)))",
+    "and(eq(group,1),or())",
+    "sort(+value)",
+    "sort(-state,+count,-id)",
+    "sort(-active,+group)",
+    "sort(-group)&limit(10)",
+    "sort(state,value)&limit(5,20)",
+    "sort(+count)&first()",
+    "limit(10,5)",
+    "limit(10)&sort(-value)",
+    "slice(5,50,3)",
+    "select(id,state)&limit(10)",
+    "select(state,group)&sort(-group)&limit(10)",
+    "values(value)",
+    "eq(group,2)&values(state)",
+    "count()",
+    "lt(value,0)&count()",
+    "sum(count)",
+    "sum(value)",
+    "sum(active)",
+    "mean(count)",
+    "mean(value)",
+    "min(value)",
+    "max(count)",
+    "aggregate(group,count(),sum(count),mean(count),min(value),max(value),sum(value))",
+    "aggregate(state,mean(value))&sort(state)",
+    "aggregate((state,active),count(),sum(count))",
+    "aggregate(active,min(active),max(id))",
+    "lt(value,0)&aggregate(group,count())&sort(-count)&limit(3)",
+    # not vectorized, on the row engine after the point they appear
+    "contains(tags,x)",
+    "eq(nested.a,1)&count()",
+    "eq(group,1)&eq(state,1)",
+    "sort(nested.a,id)&limit(10)",
+    "aggregate(group,median(value),stddev(count))",
+    "aggregate(state,max(state))",
+    "eq(group,1)&distinct()&count()",
+    "min(state)",
+    "eq(group,1)&unwind(tags)&count()",
+    "select(id,nested)&limit(3)",
+]
+
+
+class TestColumnarQuery:
+    @pytest.fixture(scope="class")
+    def rows(self):
+        return make_rows()
+
+    @pytest.fixture(scope="class")
+    def columnar(self, rows):
+        return ColumnarQuery(rows)
+
+    @pytest.mark.parametrize("expr", EXPRESSIONS)
+    def test_same_as_rows(self, rows, columnar, expr):
+        expected = Query(rows).query(expr).all()
+        result = columnar.query(expr).all()
+
+        if isinstance(expected, float):
+            expected = pytest.approx(expected)
+
+        assert result == expected
+
+    @pytest.mark.parametrize("expr", EXPRESSIONS)
+    def test_same_types_as_rows(self, rows, columnar, expr):
+        # no numpy types in the results
+        def types(value):
+            if isinstance(value, list):
+                return [types(v) for v in value]
+            if isinstance(value, dict):
+                return {k: types(v) for k, v in value.items()}
+            return type(value)
+
+        assert types(columnar.query(expr).all()) == types(Query(rows).query(expr).all())
+
+    @pytest.mark.parametrize(
+        "expr",
+        [
+            "and(gt(value,0),in(state,(CA,NY)))&count()",
+            "sort(-state,+value)&limit(10)&values(id)",
+            "select(group,count)&aggregate(group,sum(count),mean(count))",
+            "ne(active,true)&max(value)",
+        ],
+    )
+    def test_vectorized(self, columnar, monkeypatch, expr):
+        # nothing is converted to rows
+        def rows(self, copy=False):
+            raise AssertionError("converted to rows")
+
+        expected = columnar.query(expr).all()
+        monkeypatch.setattr(Columns, "rows", rows)
+        assert columnar.query(expr).all() == expected
+
+    def test_from_arrays(self):
+        data = {"a": np.array([3, 1, 2, 1]), "b": np.array(["x", "y", "z", "w"])}
+        query = ColumnarQuery(data)
+
+        assert query.query("sort(a,b)").all() == [
+            {"a": 1, "b": "w"},
+            {"a": 1, "b": "y"},
+            {"a": 2, "b": "z"},
+            {"a": 3, "b": "x"},
+        ]
+        assert query.query("gt(a,1)&values(b)").all() == ["x", "z"]
+        assert query.query("aggregate(a,count())").all() == [
+            {"a": 3, "count": 1},
+            {"a": 1, "count": 2},
+            {"a": 2, "count": 1},
+        ]
+
+    def test_from_lists(self):
+        query = ColumnarQuery({"a": [1, 2, 3], "b": [1.5, None, 2.5]})
+        assert query.query("ge(a,2)").all() == [{"a": 2, "b": None}, {"a": 3, "b": 2.5}]
+        assert query.query("eq(b,null)").all() == [{"a": 2, "b": None}]
+
+    def test_stable_sort(self, rows, columnar):
+        res = columnar.query("sort(-group)&values(id)").all()
+        expected = [row["id"] for row in sorted(rows, key=lambda row: -row["group"])]
+        assert res == expected
+
+    def test_empty(self):
+        query = ColumnarQuery([])
+        assert query.query("eq(a,1)").all() == []
+        assert query.query("count()").all() == 0
+        assert query.query("sum(a)").all() == 0
+        assert query.query("aggregate(a,count())").all() == []
+
+        with pytest.raises(RQLQueryError):
+            query.query("max(a)").all()
+
+    def test_filtered_to_empty(self, columnar):
+        assert columnar.query("gt(group,100)&aggregate(group,sum(value))").all() == []
+        assert columnar.query("gt(group,100)&sum(count)").all() == 0
+
+    def test_large_integers(self):
+        rows = [{"a": 2**62}, {"a": 2**62}, {"a": 1}]
+        assert ColumnarQuery(rows).query("sum(a)").all() == 2**63 + 1
+
+        rows = [{"a": 2**70}, {"a": 1}]
+        assert ColumnarQuery(rows).query("gt(a,1)&sum(a)").all() == 2**70
+
+    @pytest.mark.parametrize(
+        "values",
+        [[1e16, 1.0, -1e16], [0.1] * 10, [1e308, 1e308], [1e308, 1e308, -1e308], [1.0, math.nan]],
+    )
+    def test_exact_float_sums(self, values):
+        rows = [{"g": 0, "a": value} for value in values]
+        for expr in ["sum(a)", "mean(a)", "aggregate(g,sum(a),mean(a))"]:
+            expected = Query(rows).query(expr).all()
+            assert str(ColumnarQuery(rows).query(expr).all()) == str(expected)
+
+    @pytest.mark.parametrize(
+        "expr",
+        [
+            "eq(a,9007199254740992.0)",
+            "le(a,9007199254740992.0)",
+            "in(a,(1,9007199254740992.0))",
+            "eq(a,key(b))",
+            "lt(b,key(a))",
+        ],
+    )
+    def test_large_integers_with_floats(self, expr):
+        # numpy would compare them as float64
+        rows = [{"a": 2**53 + 1, "b": 2.0**53}, {"a": 1, "b": 1.0}]
+        expected = Query(rows).query(expr).all()
+        assert ColumnarQuery(rows).query(expr).all() == expected
+
+    @pytest.mark.parametrize("expr", ["sort(+a)", "sort(-a)", "sort(+b,+a)&limit(2)"])
+    def test_sort_nan(self, expr):
+        nan = float("nan")
+        rows = [{"a": nan, "b": 1}, {"a": 1.0, "b": 1}, {"a": 0.5, "b": 0}, {"a": nan, "b": 0}]
+        expected = Query(rows).query(expr).all()
+        result = ColumnarQuery(rows).query(expr).all()
+        assert [row["b"] for row in result] == [row["b"] for row in expected]
+        assert [str(row["a"]) for row in result] == [str(row["a"]) for row in expected]
+
+    def test_mixed_types_not_converted(self):
+        rows = [{"a": 1}, {"a": "1"}, {"a": 1.5}]
+        query = ColumnarQuery(rows)
+        assert query.query("eq(a,1)").all() == [{"a": 1}]
+        assert query.query("eq(a,1)").all() == Query(rows).query("eq(a,1)").all()
+
+    def test_nan_groups(self):
+        rows = [{"a": float("nan"), "b": 1}, {"a": float("nan"), "b": 2}, {"a": 1.0, "b": 3}]
+        res = ColumnarQuery(rows).query("aggregate(a,sum(b))").all()
+        assert [row["b"] for row in res] == [1, 2, 3]
+
+    def test_isolate(self):
+        rows = [{"a": 1, "b": {"c": 1}}]
+        query = ColumnarQuery(rows)
+        res = query.query("eq(a,1)").all()
+        res[0]["b"]["c"] = 2
+
+        assert rows[0]["b"] == {"c": 1}
+        assert query.query("eq(a,1)").all() == [{"a": 1, "b": {"c": 1}}]
+
+    def test_not_isolated(self):
+        rows = [{"a": 1, "b": {"c": 1}}]
+        res = ColumnarQuery(rows, isolate=False).query("eq(a,1)").all()
+        assert res[0]["b"] is rows[0]["b"]
+
+    def test_limits(self, rows):
+        query = ColumnarQuery(rows, default_limit=5, max_limit=10)
+        assert (
+            query.query("sort(-value)").all() == Query(rows).query("sort(-value)&limit(5)").all()
+        )
+        assert len(query.query("limit(100)").all()) == 10
+
+    def test_errors(self, columnar):
+        with pytest.raises(RQLQueryError):
+            columnar.query("lt(state,1)").all()
+
+        with pytest.raises(RQLQueryError):
+            columnar.query("sort(missing)").all()
+
+    def test_explain_analyze(self, rows, columnar):
+        plan = columnar.query("eq(group,1)&sort(-value)&limit(5)").explain(analyze=True)
+        expected = sum(row["group"] == 1 for row in rows)
+        assert [(node["rows_in"], node["rows_out"]) for node in plan] == [
+            (len(rows), expected),
+            (expected, 5),
+        ]
+
+    def test_no_indexes(self, columnar):
+        with pytest.raises(TypeError):
+            columnar.create_index("id")
+
+        with pytest.raises(TypeError):
+            ColumnarQuery([{"a": 1}], indexes=["a"])
+
+
+class TestColumns:
+    def test_from_rows(self):
+        table = Columns([{"a": 1, "b": "x"}, {"a": 2, "b": "y"}])
+        assert len(table) == 2
+        assert table.arrays["a"].dtype.kind == "i"
+        assert table.arrays["b"].dtype.kind == "U"
+        assert table.rows() == [{"a": 1, "b": "x"}, {"a": 2, "b": "y"}]
+
+    def test_objects(self):
+        table = Columns([{"a": [1, 2]}, {"a": [3, 4]}])
+        assert table.arrays["a"].dtype == object
+        assert table.rows() == [{"a": [1, 2]}, {"a": [3, 4]}]
+
+    def test_rows_without_keys(self):
+        table = Columns([{}, {}])
+        assert len(table) == 2
+        assert table.take(slice(1, None)).rows() == [{}]
+
+    def test_different_keys(self):
+        with pytest.raises(ValueError):
+            Columns([{"a": 1}, {"b": 1}])
+
+    def test_different_lengths(self):
+        with pytest.raises(ValueError):
+            Columns({"a": [1, 2], "b": [1]})
+
+    def test_not_one_dimensional(self):
+        with pytest.raises(ValueError):
+            Columns({"a": np.zeros((2, 2))})
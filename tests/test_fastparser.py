@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+import types
+
+import pytest
+import test_examples
+import test_parser
+import test_reported
+import test_tokens
+
+from pyrql import Parser
+from pyrql import RQLSyntaxError
+from pyrql.fastparser import _RecursiveDescent
+
+
+class _Rule:
+    # adapter exposing a rule of the fast parser with the same interface
+    # the token tests use for the pyparsing elements
+    def __init__(self, name, *args):
+        self.name = name
+        self.args = args
+
+    def parseString(self, expr):
+        parser = _RecursiveDescent(expr)
+        r = getattr(parser, self.name)(*self.args, 0)
+        if r is None:
+            raise RQLSyntaxError(expr, *parser.error)
+        return [r[0]]
+
+
+FAST_RULES = types.SimpleNamespace(
+    PCT_ENCODED=_Rule("string"),
+    NCHAR=_Rule("string"),
+    NAME=_Rule("name"),
+    VALUE=_Rule("value"),
+    TYPED_VALUE=_Rule("typed_value"),
+    ARRAY=_Rule("array"),
+    CALL_OPERATOR=_Rule("call_operator"),
+    COMPARISON=_Rule("comparison"),
+    OPERATOR=_Rule("operator"),
+    AND=_Rule("operator_list", "&", "and"),
+    OR=_Rule("operator_list", "|", "or"),
+)
+
+
+@pytest.fixture(autouse=True)
+def fast_engine(monkeypatch):
+    parse = Parser(engine="fast").parse
+
+    for module in (test_examples, test_parser, test_reported):
+        monkeypatch.setattr(module, "parse", parse)
+
+    monkeypatch.setattr(test_tokens, "pm", FAST_RULES)
+
+
+class TestFastParser(test_parser.TestParser):
+    pass
+
+
+class TestFastTokens(test_tokens.TestTokens):
+    pass
+
+
+class TestFastExamples(test_examples.TestExamples):
+    pass
+
+
+class TestFastJSExamples(test_examples.TestJSExamples):
+    pass
+
+
+class TestFastReportedErrors(test_reported.TestReportedErrors):
+    pass
+
+
+def _result(parser, expr):
+    try:
+        return parser.parse(expr)
+    except RQLSyntaxError as exc:
+        return exc.__class__, exc.args
+    except Exception as exc:
+        return exc.__class__, str(exc)
+
+
+def _typed(value):
+    # compare values and types, since 1 == 1.0 == True
+    if isinstance(value, dict):
+        return {k: _typed(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value), [_typed(v) for v in value]
+    return type(value), value
+
+
+class TestEngineEquivalence:
+    @pytest.mark.parametrize(
+        "expr",
+        [
+            "eq(a, b)",
+            "eq(a,b )",
+            "eq(a,5 )",
+            "a =1",
+            "a=1 &b=2",
+            "a=1& b=2",
+            "a=1\t",
+            "eq(a,\t5)",
+            "a=b=c",
+            "a=ne =1",
+            "eq(a,1e)",
+            "eq(a,1e6)",
+            "eq(a,-.5e3)",
+            "eq(a,+5)",
+            "eq(a,5.)",
+            "eq(a,27f1db1c)",
+            "eq(a,%41b)",
+            "eq(a,%C3%A9)",
+            "eq(a,é中кириллица)",
+            "eq(a,½)",
+            "eq(a,trueish)",
+            "eq(a,number:x)",
+            "eq(a,string:)",
+            "eq(a,boolean:false)",
+            "eq(a,date:2020)",
+            "eq(a,datetime:2020-01-01T10:00:00Z)",
+            "eq(a,datetime: 2020-01-01 10:00)",
+            "in(a,( 1, 2 ))",
+            "in(a,(1,(2,3),()))",
+            "sort(a,+b)",
+            "sort(+a,b)",
+            "sort(-(a,b))",
+            "sort()",
+            "(a=1|(b=2|c=3))&d=4",
+            "a=1,b=2&c=3",
+            "(a=1&b=2)",
+            "a(1,)",
+            "a(,)",
+            "eq(a,%4)",
+            "eq(a,true)x",
+            "eq(a,number:1x)",
+            "eq(a,uuid:xyz)",
+            "eq(a,decimal:x)",
+            "eq(a,date:2020-13-01)",
+            "eq(a,datetimex:1)",
+            "a=",
+            "",
+            " ",
+        ],
+    )
+    def test_same_result(self, expr):
+        expected = _result(Parser(), expr)
+        result = _result(Parser(engine="fast"), expr)
+
+        assert _typed(result) == _typed(expected)
+
+    def test_invalid_engine(self):
+        with pytest.raises(ValueError):
+            Parser(engine="lero")
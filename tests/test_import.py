@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["pyparsing", "dateutil", "statistics", "numpy", "pyrql.grammar"]
+
+
+def importtime(code):
+    # run code in a fresh interpreter and return the cumulative import time
+    # in microseconds for each top level module imported
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+
+    return times
+
+
+class TestImport:
+    @pytest.fixture(scope="class")
+    def times(self):
+        return importtime("import pyrql")
+
+    def test_pyrql_imported(self, times):
+        assert "pyrql" in times
+
+    @pytest.mark.parametrize("module", HEAVY_MODULES)
+    def test_heavy_modules_not_imported(self, times, module):
+        assert module not in times
+
+    @pytest.mark.parametrize("module", ["pyparsing", "pyrql.grammar"])
+    def test_grammar_imported_on_first_parse(self, module):
+        times = importtime("import pyrql; pyrql.parse('a=1')")
+        assert module in times
+
+    def test_fast_engine_does_not_import_grammar(self):
+        times = importtime("import pyrql; pyrql.Parser(engine='fast').parse('a=1')")
+        assert "pyrql.grammar" not in times
+        assert "pyparsing" not in times
+
+    def test_grammar_elements_available_from_parser(self):
+        from pyrql import parser
+
+        assert parser.QUERY is not None
+
+        with pytest.raises(AttributeError):
+            parser.lero
+
+    def test_import_faster_than_grammar(self, times):
+        # a loose bound, building the grammar alone is several times
+        # slower than importing the whole package
+        grammar = importtime("import pyrql.grammar")
+        assert times["pyrql"] < grammar["pyrql.grammar"]
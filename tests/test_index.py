@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from pyrql import Query
+from pyrql import RQLQueryError
+from pyrql import query
+from pyrql.index import HashIndex
+from pyrql.index import SortedIndex
+
+
+@pytest.fixture(scope="session")
+def data(load_data):
+    data_ = load_data()
+    for row in data_:
+        row["indexmod11"] = row["index"] % 11
+        # a sortable field with many ties
+        row["age"] = 20 + row["index"] * 7 % 50
+
+    return data_
+
+
+@pytest.fixture(scope="session")
+def indexed(data):
+    return Query(
+        data,
+        indexes=["gender", "state", "indexmod11", "isActive"],
+        sorted_indexes=["index", "age", "position.latitude"],
+    )
+
+
+class TestHashIndex:
+    def test_positions(self):
+        rows = [{"a": 1}, {"a": 2}, {"a": 1}, {}]
+        index = HashIndex(rows, "a")
+        assert index.positions == {1: [0, 2], 2: [1], None: [3]}
+        assert index.others == []
+
+    def test_unhashable_values(self):
+        rows = [{"a": [1]}, {"a": 1}, {"a": {"b": 1}}]
+        index = HashIndex(rows, "a")
+        assert index.positions == {1: [1]}
+        assert index.others == [0, 2]
+
+    def test_nested_key(self):
+        rows = [{"a": {"b": 1}}, {"a": {"b": 2}}, {"a": None}]
+        index = HashIndex(rows, "a.b")
+        assert index.positions == {1: [0], 2: [1]}
+        assert index.others == [2]
+
+    def test_requires_sequence(self):
+        with pytest.raises(TypeError):
+            HashIndex(iter([{"a": 1}]), "a")
+
+    @pytest.mark.parametrize(
+        "expr, supported",
+        [
+            ("eq(a,1)", True),
+            ("eq(a,(1,2))", True),
+            ("eq(a,key(b))", False),
+            ("in(a,(1,2))", True),
+            ("ne(a,1)", False),
+            ("lt(a,1)", False),
+            ("out(a,(1,2))", False),
+            ("contains(a,1)", False),
+        ],
+    )
+    def test_supports(self, expr, supported):
+        node = Query([]).query(expr).pipeline[0]
+        assert HashIndex([], "a").supports(node) is supported
+
+
+class TestSortedIndex:
+    def test_order(self):
+        rows = [{"a": 3}, {"a": 1}, {"a": 2}, {"a": 1}]
+        index = SortedIndex(rows, "a")
+        assert index.values == [1, 1, 2, 3]
+        assert index.order == [1, 3, 2, 0]
+        assert index.desc_order() == [0, 2, 1, 3]
+        assert index.rank() == [3, 0, 2, 1]
+        assert index.rank(reverse=True) == [0, 2, 1, 3]
+
+    def test_none_excluded(self):
+        rows = [{"a": 1}, {"a": None}, {}, {"a": 0}]
+        index = SortedIndex(rows, "a")
+        assert index.values == [0, 1]
+        assert index.others == [1, 2]
+        assert not index.can_sort()
+
+    def test_not_comparable(self):
+        with pytest.raises(TypeError):
+            SortedIndex([{"a": 1}, {"a": "x"}], "a")
+
+    @pytest.mark.parametrize(
+        "expr, expected",
+        [
+            ("lt(a,3)", [0, 1, 3, 4]),
+            ("le(a,3)", [0, 1, 2, 3, 4]),
+            ("gt(a,1)", [0, 2, 3]),
+            ("ge(a,1)", [0, 1, 2, 3, 4]),
+            ("eq(a,1)", [1, 4]),
+            ("ge(a,1)&lt(a,3)", [0, 1, 3, 4]),
+            ("gt(a,2)&lt(a,3)", []),
+            ("gt(a,3)&lt(a,1)", []),
+        ],
+    )
+    def test_lookup(self, expr, expected):
+        rows = [{"a": 2}, {"a": 1}, {"a": 3}, {"a": 2}, {"a": 1}]
+        nodes = Query([]).query(expr).pipeline
+        assert SortedIndex(rows, "a").lookup(nodes) == expected
+
+    def test_lookup_sorted(self):
+        rows = [{"a": 2}, {"a": 1}, {"a": 3}, {"a": 2}, {"a": 1}]
+        nodes = Query([]).query("ge(a,2)").pipeline
+        index = SortedIndex(rows, "a")
+        assert index.lookup(nodes, reverse=False) == [0, 3, 2]
+        assert index.lookup(nodes, reverse=True) == [2, 0, 3]
+
+    @pytest.mark.parametrize(
+        "expr, supported",
+        [
+            ("lt(a,1)", True),
+            ("ge(a,1.5)", True),
+            ("eq(a,1)", True),
+            ("lt(a,x)", False),
+            ("lt(a,null)", False),
+            ("lt(a,key(b))", False),
+            ("ne(a,1)", False),
+            ("in(a,(1,2))", False),
+        ],
+    )
+    def test_supports(self, expr, supported):
+        node = Query([]).query(expr).pipeline[0]
+        assert SortedIndex([{"a": 1}], "a").supports(node) is supported
+
+    def test_none_rows_raise_like_scan(self):
+        q = Query([{"a": 1}, {"a": None}], sorted_indexes=["a"])
+        assert q.query("eq(a,1)").all() == [{"a": 1}]
+        with pytest.raises(RQLQueryError):
+            q.query("lt(a,5)").all()
+
+
+class TestIndexedQuery:
+    @pytest.mark.parametrize(
+        "expr",
+        [
+            "eq(gender,male)",
+            "eq(state,FL)",
+            "eq(state,XX)",
+            "in(state,(FL,TX,CA,NY))",
+            "in(indexmod11,(1,3,5,1))",
+            "eq(isActive,true)",
+            "eq(gender,female)&eq(state,TX)",
+            "eq(gender,female)&in(state,(TX,FL))&lt(index,500)",
+            "lt(index,500)&eq(indexmod11,3)&contains(tags,dolor)",
+            "sort(-index)&eq(gender,male)&limit(5)",
+            "eq(state,FL)&select(index,state)",
+            "or(eq(state,FL),eq(state,TX))",
+            "eq(position.latitude,key(position.longitude))",
+            "lt(index,100)",
+            "ge(age,30)&lt(age,40)",
+            "gt(age,30)&le(age,40)&eq(gender,male)",
+            "eq(age,30)",
+            "gt(age,100)",
+            "lt(position.latitude,0)&gt(position.latitude,-45)",
+            "ge(age,30)&lt(age,20)",
+            "sort(age)",
+            "sort(-age)",
+            "sort(+age)&limit(10,5)",
+            "sort(-age)&first()",
+            "eq(gender,male)&sort(-age)",
+            "in(state,(FL,TX,CA))&lt(index,800)&sort(age)&limit(10)",
+            "ge(age,30)&lt(age,40)&sort(-age)",
+            "ge(age,30)&lt(age,40)&sort(index)",
+            "ge(age,30)&eq(gender,male)&sort(-age)&limit(5)",
+            "contains(tags,dolor)&sort(-age)",
+            "sort(-position.latitude)&select(index)",
+            "select(state)&eq(state,FL)",
+            "eq(gender,male)&count()",
+        ],
+    )
+    def test_same_result(self, data, indexed, expr):
+        assert indexed.query(expr).all() == Query(data).query(expr).all()
+
+    @pytest.mark.parametrize(
+        "expr, nodes",
+        [
+            ("eq(gender,male)", ["index_lookup"]),
+            ("eq(gender,male)&lt(balance,10)", ["index_lookup", "lt"]),
+            ("eq(gender,male)&eq(state,FL)&lt(balance,10)", ["index_lookup", "lt"]),
+            ("sort(name)&in(state,(FL,TX))", ["index_lookup", "sort"]),
+            ("eq(name,x)", ["eq"]),
+            ("lt(index,10)", ["index_lookup"]),
+            ("lt(balance,10)", ["lt"]),
+            ("ge(age,30)&lt(age,40)&eq(state,FL)", ["index_lookup"]),
+            ("sort(-age)", ["index_lookup"]),
+            ("sort(-age)&limit(5)", ["index_lookup"]),
+            ("sort(-age)&eq(state,FL)&limit(5)", ["index_lookup"]),
+            ("sort(-age)&contains(tags,x)&limit(5)", ["index_lookup", "contains", "limit"]),
+            ("contains(tags,x)&sort(age)", ["index_lookup", "contains"]),
+            ("sort(age,index)", ["sort"]),
+            ("sort(state)", ["sort"]),
+            ("or(eq(state,FL),eq(state,TX))", ["or"]),
+            ("select(index)&eq(state,FL)", ["select", "eq"]),
+        ],
+    )
+    def test_plan(self, indexed, expr, nodes):
+        assert [node["node"] for node in indexed.query(expr).explain()] == nodes
+
+    def test_keeps_order(self, data, indexed):
+        result = indexed.query("in(state,(TX,FL,CA))").all()
+        assert [row["index"] for row in result] == sorted(row["index"] for row in result)
+
+    def test_sort_ties_stable(self, data, indexed):
+        for expr in ["sort(-age)", "gt(age,30)&sort(-age)", "eq(gender,male)&sort(-age)"]:
+            result = indexed.query(expr).all()
+            assert [row["index"] for row in result] == [
+                row["index"] for row in Query(data).query(expr).all()
+            ]
+
+    def test_create_sorted_index(self, data):
+        q = Query(data)
+        index = q.create_index("age", sorted=True)
+        assert isinstance(index, SortedIndex)
+        assert q.query("lt(age,30)").explain()[0]["node"] == "index_lookup"
+
+    def test_create_index(self, data):
+        q = Query(data)
+        assert q.query("eq(state,FL)").explain()[0]["node"] == "eq"
+
+        index = q.create_index("state")
+        assert isinstance(index, HashIndex)
+        assert q.indexes == {"state": index}
+        assert q.query("eq(state,FL)").explain()[0]["node"] == "index_lookup"
+
+    def test_create_index_on_derived_query(self, data):
+        q = Query(data)
+        age = q.create_index("age")
+        derived = q.query("eq(state,FL)")
+        state = derived.create_index("state")
+
+        assert q.indexes == {"age": age}
+        assert derived.indexes == {"age": age, "state": state}
+        assert q.query("eq(state,FL)").explain()[0]["node"] == "eq"
+
+    def test_compiled_query_reused(self, data, indexed):
+        compiled = indexed.query("eq(state,FL)").compiled
+        assert compiled.run(data, indexed.indexes) == compiled.run(data)
+
+    def test_other_data(self, data, indexed):
+        # the indexes only apply to the data they were built over
+        compiled = indexed.query("eq(state,FL)").compiled
+        rows = [{"state": "FL"}, {"state": "TX"}]
+        assert compiled.run(rows, indexed.indexes) == rows[:1]
+
+    def test_unhashable_rows(self):
+        rows = [{"a": [1]}, {"a": 1}, {"a": 2}]
+        q = Query(rows, indexes=["a"])
+        assert q.query("eq(a,1)").all() == [{"a": 1}]
+        assert q.query("in(a,(1,2))").all() == rows[1:]
+
+    def test_missing_nested_key_raises(self):
+        q = Query([{"a": None}], indexes=["a.b"])
+        with pytest.raises(RQLQueryError):
+            q.query("eq(a.b,1)").all()
+
+    def test_stream(self, data, indexed):
+        q = Query(data, stream=True, indexes=["state"])
+        assert (
+            q.query("eq(state,FL)&limit(2)").all() == indexed.query("eq(state,FL)&limit(2)").all()
+        )
+
+    def test_codegen(self, data):
+        q = Query(data, codegen=True, indexes=["state"])
+        plan = query._plan(q.query("eq(state,FL)&lt(index,10)").pipeline, True, q.indexes)
+        assert [type(node).__name__ for node in plan] == ["_IndexLookup", "_GeneratedFilter"]
+        assert q.query("eq(state,FL)&lt(index,500)").all() == (
+            Query(data).query("eq(state,FL)&lt(index,500)").all()
+        )
+
+    @pytest.mark.parametrize(
+        "rows, expr",
+        [
+            ([{"b": 1}, {"n": {"x": 2}, "b": 2}], "eq(b,2)&eq(n.x,2)"),
+            ([{"n": {"x": 2}, "b": 2}, {"b": 1}], "eq(b,2)&in(n.x,(1,2))"),
+            ([{"n": [1], "b": 1}, {"n": {"x": 2}, "b": 2}], "eq(b,2)&eq(n.x,2)"),
+        ],
+    )
+    def test_unplaced_rows_checked_in_order(self, rows, expr):
+        # a scan never reaches the indexed filter for rows the first one
+        # leaves out, so neither does the lookup
+        expected = Query(rows).query(expr).all()
+        assert Query(rows, indexes=["n.x"]).query(expr).all() == expected
+
+    @pytest.mark.parametrize(
+        "expr",
+        [
+            "eq(b,2)&gt(a,3)",
+            "eq(b,2)&le(a,5)&ge(a,1)",
+            "eq(b,2)&gt(a,3)&sort(a)",
+            "eq(b,2)&eq(a,5)",
+        ],
+    )
+    def test_none_rows_with_other_filters(self, expr):
+        # rows without a value for the sorted index are only compared if
+        # the filters before it match, as in a scan
+        rows = [{"a": None, "b": 1}, {"a": 5, "b": 2}, {"b": 1}, {"a": 2, "b": 2}]
+        expected = Query(rows).query(expr).all()
+        assert Query(rows, sorted_indexes=["a"]).query(expr).all() == expected
+
+    def test_range_and_hash_index(self):
+        rows = [{"a": None, "b": 1}, {"a": 5, "b": 2}, {"a": 7, "b": [2]}, {"a": 4, "b": 2}]
+        q = Query(rows, indexes=["b"], sorted_indexes=["a"])
+        assert q.query("eq(b,2)&gt(a,3)").all() == [rows[1], rows[3]]
+
+    def test_sort_by_number(self, indexed):
+        with pytest.raises(RQLQueryError):
+            indexed.query("sort(+1)").all()
+
+    def test_rows_added(self):
+        rows = [{"a": 1}, {"a": 2}]
+        q = Query(rows, indexes=["a"], sorted_indexes=["b"])
+        rows.append({"a": 1})
+        assert q.query("eq(a,1)").all() == [{"a": 1}, {"a": 1}]
+
+    def test_rows_removed(self):
+        rows = [{"a": 1}, {"a": 2}, {"a": 1}]
+        q = Query(rows, indexes=["a"])
+        rows.pop(0)
+        assert q.query("eq(a,1)").all() == [{"a": 1}]
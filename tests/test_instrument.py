@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import pyrql
+from pyrql import Query
+from pyrql import RQLQueryError
+from pyrql import query
+from pyrql.instrument import NODE_HOOKS
+from pyrql.instrument import PARSE_HOOKS
+
+DATA = [{"a": i % 3, "b": i} for i in range(30)]
+
+
+class TestInstrument:
+    def test_on_node(self):
+        events = []
+        with pyrql.instrument(on_node=events.append):
+            Query(DATA).query("eq(a,1)&sort(-b)&limit(3)&values(b)").all()
+
+        assert [(e["node"], e["rows_in"], e["rows_out"]) for e in events] == [
+            ("eq", 30, 10),
+            ("topk", 10, 3),
+            ("values", 3, 3),
+        ]
+        assert all(isinstance(e["elapsed_ns"], int) and e["elapsed_ns"] >= 0 for e in events)
+
+    def test_result_unchanged(self):
+        expr = "eq(a,1)&sort(-b)&limit(3)&values(b)"
+        expected = Query(DATA).query(expr).all()
+        with pyrql.instrument(on_node=lambda event: None):
+            assert Query(DATA).query(expr).all() == expected
+
+    def test_stream(self):
+        events = []
+        with pyrql.instrument(on_node=events.append):
+            result = Query(iter(DATA), stream=True).query("eq(a,1)&limit(2)").all()
+
+        assert result == DATA[1:5:3]
+        assert [(e["node"], e["rows_in"], e["rows_out"]) for e in events] == [
+            ("eq", None, 2),
+            ("limit", None, 2),
+        ]
+
+    def test_stream_stops_early(self):
+        # the rows are still read lazily, so the limit stops reading them
+        read = []
+
+        def rows():
+            for row in DATA:
+                read.append(row)
+                yield row
+
+        events = []
+        with pyrql.instrument(on_node=events.append):
+            result = Query(rows(), stream=True).query("eq(a,1)&limit(2)").all()
+
+        assert result == DATA[1:5:3]
+        assert read == DATA[:5]
+        assert events[0]["elapsed_ns"] <= events[1]["elapsed_ns"]
+
+    def test_stream_with_blocking_node(self):
+        events = []
+        with pyrql.instrument(on_node=events.append):
+            Query(DATA, stream=True).query("eq(a,1)&sort(-b)&limit(5)&values(b)").all()
+
+        assert [(e["node"], e["rows_in"], e["rows_out"]) for e in events] == [
+            ("eq", 30, 10),
+            ("topk", None, 5),
+            ("values", 5, 5),
+        ]
+
+    @pytest.mark.parametrize("codegen", [False, True])
+    def test_nodes_not_explained(self, monkeypatch, codegen):
+        # explain() converts all arguments, so it's too slow to run each time
+        def explain(self):
+            raise AssertionError("explain() called")
+
+        monkeypatch.setattr(query.Node, "explain", explain)
+        events = []
+        with pyrql.instrument(on_node=events.append):
+            Query(DATA, codegen=codegen).query("in(b,(1,2,3,4))&sort(-b)&limit(2)").all()
+
+        assert [e["node"] for e in events] == ["in", "topk"]
+
+    def test_scalar_result(self):
+        events = []
+        with pyrql.instrument(on_node=events.append):
+            Query(DATA).query("count()").all()
+
+        assert events[0]["rows_in"] == 30
+        assert events[0]["rows_out"] is None
+
+    @pytest.mark.parametrize("engine", ["pyparsing", "fast"])
+    def test_on_parse(self, engine):
+        events = []
+        parser = pyrql.Parser(engine=engine)
+        with pyrql.instrument(on_parse=events.append):
+            parser.parse("eq(a,1)")
+
+        assert len(events) == 1
+        assert events[0]["expr"] == "eq(a,1)"
+        assert events[0]["engine"] == engine
+        assert events[0]["elapsed_ns"] > 0
+
+    def test_on_parse_cached(self):
+        events = []
+        parser = pyrql.Parser(cache_size=10)
+        with pyrql.instrument(on_parse=events.append):
+            parser.parse("eq(a,1)")
+            parser.parse("eq(a,1)")
+
+        assert len(events) == 2
+
+    def test_removed_on_exit(self):
+        events = []
+        with pyrql.instrument(on_node=events.append, on_parse=events.append):
+            assert len(NODE_HOOKS) == len(PARSE_HOOKS) == 1
+
+        assert NODE_HOOKS == PARSE_HOOKS == []
+        Query(DATA).query("eq(a,1)").all()
+        assert events == []
+
+    def test_removed_on_error(self):
+        with pytest.raises(RQLQueryError):
+            with pyrql.instrument(on_node=lambda event: None):
+                Query([{"a": 1}, {"a": "x"}]).query("lt(a,5)").all()
+
+        assert NODE_HOOKS == []
+
+    def test_nested(self):
+        outer = []
+        inner = []
+        with pyrql.instrument(on_node=outer.append):
+            with pyrql.instrument(on_node=inner.append):
+                Query(DATA).query("eq(a,1)").all()
+            Query(DATA).query("eq(a,1)").all()
+
+        assert len(outer) == 2
+        assert len(inner) == 1
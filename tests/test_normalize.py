@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import pyrql
+from pyrql import Query
+from pyrql import ast_hash
+from pyrql import normalize
+from pyrql import parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DATA = [{"a": i % 5, "b": "xyz"[i % 3], "c": i % 4} for i in range(60)]
+
+
+class TestNormalize:
+    @pytest.mark.parametrize(
+        "expr1, expr2",
+        [
+            ("a=1&b=2", "and(eq(b,2),eq(a,1))"),
+            ("a=eq=1", "eq(a,1)"),
+            ("and(eq(a,1))", "eq(a,1)"),
+            ("or(eq(a,1))", "eq(a,1)"),
+            ("and(and(eq(a,1),eq(b,2)),eq(c,3))", "and(eq(c,3),eq(b,2),eq(a,1))"),
+            ("or(eq(a,1),or(eq(b,2),eq(c,3)))", "or(eq(c,3),eq(b,2),eq(a,1))"),
+            ("or(eq(a,1),eq(a,2))", "in(a,(2,1))"),
+            ("or(eq(a,1),in(a,(2,3)))", "in(a,(3,2,1))"),
+            ("in(a,(1,2,2,1))", "in(a,(2,1))"),
+            ("in(a,(1))", "eq(a,1)"),
+            ("out(a,(1,1))", "ne(a,1)"),
+            ("and(or(eq(a,1),eq(a,2)),lt(c,2))", "and(lt(c,2),in(a,(1,2)))"),
+        ],
+    )
+    def test_equivalent(self, expr1, expr2):
+        assert normalize(parse(expr1)) == normalize(parse(expr2))
+        assert ast_hash(parse(expr1)) == ast_hash(parse(expr2))
+
+    @pytest.mark.parametrize(
+        "expr1, expr2",
+        [
+            ("eq(a,1)", "eq(a,2)"),
+            ("eq(a,1)", "eq(a,1.0)"),
+            ("eq(a,1)", "eq(a,true)"),
+            ("eq(a,1)", "eq(a,string:1)"),
+            ("eq(a,1)", "ne(a,1)"),
+            ("and(eq(a,1),eq(b,2))", "or(eq(a,1),eq(b,2))"),
+            ("sort(+a)&limit(1)", "limit(1)&sort(+a)"),
+            ("eq(a,1)&limit(1)", "limit(1)&eq(a,1)"),
+            ("eq(a,1)&sort(+a)&lt(b,1)", "lt(b,1)&sort(+a)&eq(a,1)"),
+            ("sort(+a,-b)", "sort(-b,+a)"),
+            ("in(a,1)", "eq(a,1)"),
+            ("eq(a,key(b))", "eq(b,key(a))"),
+        ],
+    )
+    def test_different(self, expr1, expr2):
+        # compared by hash, since 1, 1.0 and true are equal in a dict
+        assert ast_hash(parse(expr1)) != ast_hash(parse(expr2))
+
+    def test_only_consecutive_filters_sorted(self):
+        ast = normalize(parse("eq(b,1)&eq(a,1)&sort(+a)&eq(d,1)&eq(c,1)&limit(5)"))
+        assert [arg["name"] for arg in ast["args"]] == ["eq", "eq", "sort", "eq", "eq", "limit"]
+        assert [arg["args"][0] for arg in ast["args"] if arg["name"] == "eq"] == [
+            "a",
+            "b",
+            "c",
+            "d",
+        ]
+
+    def test_does_not_change_input(self):
+        ast = parse("and(eq(b,2),eq(a,1),in(c,(2,1)))")
+        expected = parse("and(eq(b,2),eq(a,1),in(c,(2,1)))")
+        normalize(ast)
+        assert ast == expected
+
+    def test_idempotent(self):
+        ast = normalize(parse("or(eq(a,1),and(eq(b,1),lt(c,2)),eq(a,2))&sort(-a)"))
+        assert normalize(ast) == ast
+
+    @pytest.mark.parametrize(
+        "expr",
+        [
+            "or(eq(a,1),eq(a,2),eq(b,x))",
+            "and(or(eq(a,1),in(a,(3,4))),out(c,(1,1)))",
+            "in(a,(1))&or(eq(b,x),eq(b,y))&limit(10)",
+            "and(and(ge(a,1),lt(a,4)),ne(b,z))&eq(c,1)",
+        ],
+    )
+    def test_same_result(self, expr):
+        normalized = pyrql.unparse(normalize(parse(expr)))
+        assert Query(DATA).query(normalized).all() == Query(DATA).query(expr).all()
+
+    def test_hash_stable_across_processes(self):
+        expr = "and(eq(a,1),in(b,(x,y)),lt(c,2.5))&sort(-a)"
+        code = f"import pyrql; print(pyrql.ast_hash(pyrql.parse({expr!r})))"
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+            env={"PYTHONHASHSEED": "1234"},
+        ).stdout.strip()
+
+        assert output == ast_hash(parse(expr))
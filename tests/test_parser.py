@@ -6,6 +6,8 @@ from uuid import UUID
 
 import pytest
 
+import pyrql
+from pyrql import Parser
 from pyrql import RQLSyntaxError
 from pyrql import parse
 from pyrql import unparse
@@ -266,3 +268,103 @@ class TestParser:
         rep = {"name": "eq", "args": ["email", "user@example.com"]}
 
         assert pd == rep
+
+
+class TestParserCache:
+    def test_cache_disabled_by_default(self):
+        parser = Parser()
+        assert parser.cache_info() is None
+        assert parser.parse("a=1") == {"name": "eq", "args": ["a", 1]}
+
+    def test_hits_and_misses(self):
+        parser = Parser(cache_size=10)
+
+        p1 = parser.parse("and(eq(a,1),in(b,(1,2)))")
+        p2 = parser.parse("and(eq(a,1),in(b,(1,2)))")
+
+        assert p1 == p2
+        assert p1 is not p2
+        assert parser.cache_info() == (1, 1, 0, 10, 1)
+
+    def test_eviction(self):
+        parser = Parser(cache_size=2)
+
+        parser.parse("a=1")
+        parser.parse("b=1")
+        parser.parse("a=1")
+        parser.parse("c=1")
+
+        info = parser.cache_info()
+        assert info.evictions == 1
+        assert info.currsize == 2
+
+        # b was the least recently used
+        parser.parse("b=1")
+        assert parser.cache_info().misses == 4
+
+    def test_returns_copies(self):
+        parser = Parser(cache_size=10)
+
+        p1 = parser.parse("a=1&b=2")
+        p1["args"].pop()
+        p1["args"][0]["args"][1] = 2
+
+        assert parser.parse("a=1&b=2") == {
+            "name": "and",
+            "args": [{"name": "eq", "args": ["a", 1]}, {"name": "eq", "args": ["b", 2]}],
+        }
+
+    def test_syntax_errors_are_not_cached(self):
+        parser = Parser(cache_size=10)
+
+        for _ in range(2):
+            with pytest.raises(RQLSyntaxError):
+                parser.parse("a=1&")
+
+        assert parser.cache_info().currsize == 0
+
+    def test_cache_clear(self):
+        parser = Parser(cache_size=10)
+        parser.parse("a=1")
+        parser.cache_clear()
+        assert parser.cache_info() == (0, 0, 0, 10, 0)
+
+
+class TestPackrat:
+    @pytest.fixture(autouse=True)
+    def packrat(self):
+        pyrql.enable_packrat(cache_size=64)
+        yield
+        pyrql.disable_packrat()
+
+    @pytest.mark.parametrize(
+        "expr",
+        [
+            "a=1&b=2",
+            "(a=1|(b=2|c=3))&d=4",
+            "and(or(eq(a,1),eq(b,2)),lt(c,date:2020-01-01))",
+            "sort(+a,-b)&limit(10)",
+            "in(a,(1,2,3))&out(b,(x,y))",
+        ],
+    )
+    def test_same_result(self, expr):
+        result = parse(expr)
+        pyrql.disable_packrat()
+        assert result == parse(expr)
+
+    @pytest.mark.parametrize(
+        "expr",
+        [
+            "(" * 8 + "a=1&b=2" + ")" * 8,
+            "(" * 12 + "a=1",
+        ],
+    )
+    def test_nested_errors(self, expr):
+        with pytest.raises(RQLSyntaxError) as exc:
+            parse(expr)
+
+        pyrql.disable_packrat()
+        with pytest.raises(RQLSyntaxError) as expected:
+            parse(expr)
+
+        assert exc.value.args == expected.value.args
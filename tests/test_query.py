@@ -2,21 +2,25 @@
 
 import datetime
 import json
+import math
 import operator
-import os
+import random
+import re
+import statistics
+from copy import deepcopy
 from decimal import Decimal
 
 import pytest
 
+import pyrql
 from pyrql import Query
 from pyrql import RQLQueryError
+from pyrql import query
 
 
 @pytest.fixture(scope="session")
-def data():
-    with open(os.path.join(os.path.dirname(__file__), "testdata.json")) as f:
-        data_ = json.load(f)
-
+def data(load_data):
+    data_ = load_data()
     for row in data_:
         # add decimal field for aggregation testing
         row["balance"] = Decimal(row["balance"][1:].replace(",", ""))
@@ -26,12 +30,6 @@ def data():
         )
         row["birthdate"] = datetime.datetime.strptime(row["birthdate"], "%Y-%m-%d").date()
 
-        # convert coordinates to a nested dict, for nested attribute operations
-        row["position"] = {
-            "latitude": row.pop("latitude"),
-            "longitude": row.pop("longitude"),
-        }
-
         row["indexmod11"] = row["index"] % 11
 
     return data_
@@ -129,6 +127,31 @@ class TestQuery:
 
         assert rep == sorted(data, key=lambda x: (x["balance"], x["registered"], x["birthdate"]))
 
+    def test_mixed_sort(self, data):
+        rep = Query(data).query("sort(+gender,-state,+index)").all()
+
+        exp = sorted(data, key=operator.itemgetter("index"))
+        exp.sort(key=operator.itemgetter("state"), reverse=True)
+        exp.sort(key=operator.itemgetter("gender"))
+        assert rep == exp
+
+    def test_nested_sort(self, data):
+        rep = Query(data).query("sort(-position.latitude,+index)").all()
+
+        assert rep == sorted(data, key=lambda x: (-x["position"]["latitude"], x["index"]))
+
+    def test_nested_sort_and_limit(self, data):
+        rep = Query(data).query("sort(+gender,-position.latitude)&limit(5)").all()
+
+        exp = sorted(data, key=lambda x: (x["gender"], -x["position"]["latitude"]))
+        assert rep == exp[:5]
+
+    def test_select_nested_and_sort(self, data):
+        rep = Query(data).query("select(index,position.latitude)&sort(position.latitude)").all()
+
+        exp = sorted(data, key=lambda x: x["position"]["latitude"])
+        assert [row["index"] for row in rep] == [row["index"] for row in exp]
+
     @pytest.mark.parametrize("limit", [10, 20, 30])
     def test_simple_limit(self, data, limit):
         rep = Query(data).query("limit({})".format(limit)).all()
@@ -158,10 +181,83 @@ class TestQuery:
         exp = [row for row in data if row["index"] not in (11, 12, 13, 14, 15)]
         assert rep == exp
 
+    def test_missing_key_is_null(self, data):
+        rows = [{"a": 1}, {"b": 2}, {"a": None}]
+        assert Query(rows).query("eq(a,null)").all() == rows[1:]
+        assert Query(rows).query("in(a,(null,1))").all() == rows
+        assert Query(rows).query("out(a,(1,3))").all() == rows[1:]
+
+    @pytest.mark.parametrize("op", ["in", "out"])
+    def test_in_large_array(self, data, op):
+        values = tuple(range(0, 1000, 3))
+        rep = Query(data).query(f"{op}(index,({','.join(map(str, values))}))").all()
+        exp = [row for row in data if (row["index"] in values) == (op == "in")]
+        assert rep == exp
+
+    @pytest.mark.parametrize("op", ["in", "out"])
+    def test_in_large_array_same_as_scan(self, op):
+        rows = [{"a": v} for v in [1, 1.0, True, "1", None, [1], (1, 2), {"b": 1}, 2.5, 10]]
+        values = (1, "x", (1, 2), None, 3, 4, 5, 6, 7, 8, 9)
+        node = pyrql.compile(f"{op}(a,(1,x,(1,2),null,3,4,5,6,7,8,9))").pipeline[0]
+        assert node.args[1] == values
+
+        exp = [row for row in rows if (row["a"] in values) == (op == "in")]
+        assert node.feed(rows) == exp
+
+    def test_in_unhashable_array(self):
+        rows = [{"a": [1]}, {"a": 2}, {"a": (1, 2)}]
+        node = query.In("a", ([1], 2, 3, 4, 5, 6, 7, 8, 9))
+        assert node.feed(rows) == rows[:2]
+
+    def test_in_nested(self, data):
+        rep = Query(data).query("in(position.latitude,(1,2))").all()
+        assert rep == []
+
+        values = tuple(row["position"]["latitude"] for row in data[:5])
+        rep = Query(data).query(f"in(position.latitude,{values})".replace(" ", "")).all()
+        assert rep == data[:5]
+
+    def test_nested_and_or(self, data):
+        rep = (
+            Query(data)
+            .query("or(and(eq(gender,male),lt(index,10)),eq(index,key(indexmod11)))")
+            .all()
+        )
+        exp = [
+            row
+            for row in data
+            if (row["gender"] == "male" and row["index"] < 10) or row["index"] == row["indexmod11"]
+        ]
+        assert rep == exp
+
     def test_distinct(self, data):
         rep = Query(data + data).query("distinct()").all()
         assert rep == data
 
+    @pytest.mark.parametrize(
+        "values",
+        [
+            [1, 1.0, True, 2, "2", None, None, 0, False],
+            [{"a": 1}, {"a": 1.0}, {"a": [1]}, {"a": (1,)}, {"a": {1}}, {"a": frozenset([1])}],
+            [[1, 2], (1, 2), [1, 2], (1, [2]), (1, [2]), [{"a": [1]}], [{"a": [1]}]],
+            [{"a": {"b": 1}, "c": 2}, {"c": 2, "a": {"b": 1}}, {"a": {"b": 2}, "c": 2}],
+            [{"a": bytearray(b"x")}, {"a": bytearray(b"x")}, {"a": 1}, {"a": bytearray(b"y")}],
+        ],
+    )
+    def test_distinct_same_as_scan(self, values):
+        exp = []
+        for value in values:
+            if value not in exp:
+                exp.append(value)
+
+        rep = Query(values).query("distinct()").all()
+        assert rep == exp
+        assert [type(value) for value in rep] == [type(value) for value in exp]
+
+    def test_distinct_keeps_first_seen_order(self, data):
+        rep = Query(data[::-1] + data).query("distinct()").all()
+        assert rep == data[::-1]
+
     def test_first(self, data):
         rep = Query(data).query("first()").all()
         assert rep == [data[0]]
@@ -412,3 +508,663 @@ class TestQuery:
         res = Query(data).query("index(10)&select(friends,_id)").all()
         exp = {"friends": data[10]["friends"], "_id": data[10]["_id"]}
         assert res == exp
+
+
+class TestCompiledQuery:
+    def test_run_matches_query(self, data):
+        compiled = pyrql.compile("gt(balance,2000)&sort(-balance)&select(index,balance)")
+        rep = compiled.run(data)
+        exp = Query(data).query("gt(balance,2000)&sort(-balance)&select(index,balance)").all()
+        assert rep == exp
+
+    def test_run_multiple_datasets(self, data):
+        compiled = pyrql.compile("eq(isActive,true)&count()")
+        for rows in (data, data[:100], []):
+            assert compiled.run(rows) == len([row for row in rows if row["isActive"]])
+
+    def test_run_does_not_modify_data(self, data):
+        rows = data[:50]
+        compiled = pyrql.compile("sort(-index)")
+        compiled.run(rows)
+        assert [row["index"] for row in rows] == list(range(50))
+
+    def test_limits(self, data):
+        compiled = pyrql.compile("limit(20)", max_limit=10)
+        assert compiled.run(data) == data[:10]
+
+        compiled = pyrql.compile("", default_limit=5)
+        assert compiled.run(data) == data[:5]
+
+    def test_ignore_top_eq(self, data):
+        compiled = pyrql.compile("index=1&eq(gender,male)", ignore_top_eq=["index"])
+        assert compiled.run(data) == [row for row in data if row["gender"] == "male"]
+
+    def test_chained_query_does_not_change_original(self, data):
+        compiled = pyrql.compile("eq(gender,male)")
+        chained = compiled.query("count()")
+        assert len(compiled.pipeline) == 1
+        assert chained.run(data) == len([row for row in data if row["gender"] == "male"])
+
+    def test_invalid_query(self):
+        with pytest.raises(RQLQueryError) as exc:
+            pyrql.compile("lero()")
+
+        assert exc.value.args == ("Invalid query function: lero",)
+
+
+class TestIsolation:
+    @pytest.mark.parametrize(
+        "expr",
+        [
+            "sort(-index)",
+            "sort(+gender,-index)&select(index)",
+            "unwind(tags)&limit(5)",
+            "aggregate(gender,count())",
+            "distinct()",
+            "gt(index,10)&first()",
+        ],
+    )
+    @pytest.mark.parametrize("isolate", [True, False])
+    def test_data_not_modified(self, data, expr, isolate):
+        rows = deepcopy(data[:50])
+        expected = deepcopy(rows)
+
+        Query(rows, isolate=isolate).query(expr).all()
+        assert rows == expected
+
+    def test_sort_values_not_modified(self):
+        values = [3, 1, 2]
+        assert Query(values, isolate=False).query("sort()").all() == [1, 2, 3]
+        assert values == [3, 1, 2]
+
+    def test_isolate_returns_copies(self, data):
+        result = Query(data).query("eq(index,3)").all()
+        assert result == [data[3]]
+        assert result[0] is not data[3]
+
+        result[0]["index"] = -1
+        assert data[3]["index"] == 3
+
+    def test_no_isolate_returns_references(self, data):
+        result = Query(data, isolate=False).query("gt(index,10)&sort(-index)&limit(2)").all()
+        assert result == [data[-1], data[-2]]
+        assert result[0] is data[-1]
+        assert result[1] is data[-2]
+
+    def test_no_isolate_same_results(self, data):
+        expr = "gt(balance,2000)&sort(-balance)&select(index,balance,tags)&limit(10)"
+        assert Query(data, isolate=False).query(expr).all() == Query(data).query(expr).all()
+
+
+class TestStream:
+    @pytest.mark.parametrize(
+        "expr",
+        [
+            "",
+            "eq(gender,male)",
+            "eq(gender,male)&limit(10)",
+            "eq(gender,male)&limit(10,5)",
+            "limit(10,-5)",
+            "gt(index,10)&first()",
+            "gt(index,10)&sort(-index)&first()",
+            "gt(index,10)&index(3)",
+            "index(-1)",
+            "index(1000)",
+            "slice(5)",
+            "slice(5,10)",
+            "slice(0,20,3)",
+            "slice(-5,None)",
+            "eq(index,3)&one()",
+            "gt(index,3)&one()",
+            "gt(index,1000)&one()",
+            "eq(gender,male)&count()",
+            "unwind(tags)&limit(5)&values(tags)",
+            "select(index,gender)&limit(3)",
+            "index(2)&select(index,gender)",
+            "index(2)&key(gender)",
+            "limit(5)&key(gender)",
+            "values(gender)&distinct()",
+            "aggregate(gender,count(),max(balance))",
+            "sum(balance)",
+            "mean(balance)",
+            "eq(gender,male)&lt(index,tags)",
+        ],
+    )
+    def test_same_result(self, data, expr):
+        def result(stream):
+            try:
+                return Query(data, default_limit=50, stream=stream).query(expr).all()
+            except RQLQueryError as exc:
+                # ignore the node address in the message
+                return re.sub(" at 0x[0-9a-f]+", "", exc.args[0])
+
+        assert result(True) == result(False)
+
+    @pytest.mark.parametrize(
+        "expr, pulled",
+        [
+            ("gt(index,4)&limit(2)", 7),
+            ("limit(5,10)", 15),
+            ("first()", 1),
+            ("index(7)", 8),
+            ("gt(index,2)&one()", 5),
+            ("slice(2,4)", 4),
+            ("select(index)&limit(3)", 3),
+            ("sort(index)&limit(1)", 100),
+            ("count()", 100),
+        ],
+    )
+    def test_early_termination(self, data, expr, pulled):
+        rows = []
+
+        def source():
+            for row in data[:100]:
+                rows.append(row)
+                yield row
+
+        try:
+            Query(source(), stream=True).query(expr).all()
+        except RQLQueryError:
+            pass
+
+        assert len(rows) == pulled
+
+    def test_error_raised_by_filter_node(self, data):
+        with pytest.raises(RQLQueryError) as exc:
+            Query(data, stream=True).query("lt(index,tags)&select(index)").all()
+
+        assert exc.value.args[0].startswith("TypeError executing node <pyrql.query.LessThan")
+
+
+class TestTopK:
+    @pytest.mark.parametrize(
+        "sort",
+        [
+            "sort(+balance)",
+            "sort(-balance)",
+            "sort(+gender)",
+            "sort(-gender)",
+            "sort(+gender,-state)",
+            "sort(-gender,+state)",
+            "sort(-gender,-state)",
+            "sort(+eyeColor,-gender,+state)",
+            "sort(+gender,-balance)",
+            "sort(-isActive,+state,-index)",
+        ],
+    )
+    @pytest.mark.parametrize("limit", ["limit(1)", "limit(10)", "limit(7,30)", "first()"])
+    def test_same_as_sort(self, data, sort, limit):
+        expected = Query(data).query(sort).all()
+        expected = Query(expected).query(limit).all()
+
+        assert Query(data).query(f"{sort}&{limit}").all() == expected
+
+    def test_values(self, data):
+        values = [row["state"] for row in data]
+        assert Query(values).query("sort()&limit(5)").all() == sorted(values)[:5]
+
+    def test_default_limit(self, data):
+        expected = Query(data).query("sort(-state)").all()[:5]
+        assert Query(data, default_limit=5).query("sort(-state)").all() == expected
+
+    def test_limit_larger_than_data(self, data):
+        expected = Query(data).query("sort(-state)").all()
+        assert Query(data).query("sort(-state)&limit(1000)").all() == expected
+
+    @pytest.mark.parametrize(
+        "expr, planned",
+        [
+            ("sort(state)&limit(5)", [query._TopK]),
+            ("sort(state)&first()", [query._TopK]),
+            (
+                "gt(index,30)&sort(state)&limit(5)&count()",
+                [query.GreaterThan, query._TopK, query.Count],
+            ),
+            ("sort(state)&limit(5,-1)", [query.Sort, query.Limit]),
+            ("sort(state)&count()", [query.Sort, query.Count]),
+            ("limit(5)&sort(state)", [query.Limit, query.Sort]),
+        ],
+    )
+    def test_plan(self, expr, planned):
+        plan = query._plan(pyrql.compile(expr).pipeline)
+        assert [type(node) for node in plan] == planned
+
+
+class TestPlanner:
+    @pytest.mark.parametrize(
+        "expr, planned",
+        [
+            ("sort(-index)&eq(gender,male)", [query.EqualTo, query.Sort]),
+            ("eq(gender,male)&lt(index,10)", [query.And]),
+            ("select(index,gender)&eq(gender,male)", [query.EqualTo, query.Select]),
+            (
+                "select(index,gender)&sort(index)&eq(gender,male)",
+                [query.EqualTo, query.Select, query.Sort],
+            ),
+            ("select(index)&eq(gender,male)", [query.Select, query.EqualTo]),
+            ("select(position.latitude)&lt(position.latitude,0)", [query.Select, query.LessThan]),
+            (
+                "select(index,gender)&or(eq(gender,male),lt(index,key(age)))",
+                [query.Select, query.Or],
+            ),
+            ("sort(index)&limit(10)&eq(gender,male)", [query._TopK, query.EqualTo]),
+            ("sort(index)&eq(gender,male)&limit(10)", [query.EqualTo, query._TopK]),
+            ("sort(index)&first(index)", [query.Sort, query.First]),
+            ("sort(index)&last()", [query.Sort, query.Last]),
+            ("eq(gender,male)&count()&eq(a,1)", [query.EqualTo, query.Count, query.EqualTo]),
+        ],
+    )
+    def test_plan(self, expr, planned):
+        plan = query._plan(pyrql.compile(expr).pipeline)
+        assert [type(node) for node in plan] == planned
+
+    def test_safe_filters_first(self):
+        plan = query._plan(pyrql.compile("lt(index,10)&in(a,(1,2))&eq(a.b,1)&ne(c,1)").pipeline)
+        assert [type(node) for node in plan[0].args] == [
+            query.In,
+            query.NotEqualTo,
+            query.LessThan,
+            query.EqualTo,
+        ]
+
+    @pytest.mark.parametrize(
+        "expr",
+        [
+            "sort(-balance)&eq(gender,male)",
+            "sort(state)&eq(gender,male)&lt(index,500)&limit(20)",
+            "select(index,gender,state)&sort(-state)&eq(gender,male)&limit(5,5)",
+            "lt(index,500)&eq(gender,male)&out(state,(FL,TX))&contains(tags,dolor)",
+            "eq(isActive,true)&sort(-index)&gt(index,100)&first()",
+            "unwind(tags)&eq(tags,dolor)&sort(index)&values(index)",
+        ],
+    )
+    def test_same_result(self, data, expr):
+        exp = deepcopy(data)
+        for node in pyrql.compile(expr).pipeline:
+            exp = node.feed(exp)
+
+        assert Query(data).query(expr).all() == exp
+
+    def test_safe_filter_prevents_error(self):
+        rows = [{"a": 1, "b": 2}, {"a": 2, "b": "x"}]
+        assert Query(rows).query("lt(b,5)&eq(a,1)").all() == rows[:1]
+
+
+class TestExplain:
+    def test_plan(self, data):
+        plan = Query(data).query("sort(-index)&eq(gender,male)&limit(5)").explain()
+        assert [node["node"] for node in plan] == ["eq", "topk"]
+        assert plan[0]["args"] == ["gender", "male"]
+        assert plan[1]["cost"] == "O(n log k)"
+        assert plan[1]["fast_path"] == "heap"
+
+    def test_json_serializable(self, data):
+        q = Query(data).query(
+            "and(in(state,(FL,TX,CA,NY,WA,OR,NV,AZ)),gt(balance,1000))&aggregate(state,sum(balance))"
+        )
+        assert json.loads(json.dumps(q.explain(analyze=True)))
+
+    @pytest.mark.parametrize(
+        "expr, fast_path",
+        [
+            ("in(state,(FL,TX))", None),
+            ("in(state,(FL,TX,CA,NY,WA,OR,NV,AZ))", "hash lookup"),
+            ("distinct()", "hash"),
+            ("sort(index)", None),
+        ],
+    )
+    def test_fast_path(self, data, expr, fast_path):
+        assert Query(data).query(expr).explain()[0]["fast_path"] == fast_path
+
+    def test_codegen(self, data):
+        plan = Query(data, codegen=True).query("eq(gender,male)").explain()
+        assert plan[0]["node"] == "eq"
+        assert plan[0]["fast_path"] == "codegen"
+
+    def test_default_limit(self, data):
+        plan = Query(data, default_limit=10).query("eq(gender,male)").explain()
+        assert [node["node"] for node in plan] == ["eq", "limit"]
+
+    @pytest.mark.parametrize("stream", [False, True])
+    def test_analyze(self, data, stream):
+        q = Query(data, stream=stream).query("eq(gender,male)&limit(10)&count()")
+        plan = q.explain(analyze=True)
+        males = len([row for row in data if row["gender"] == "male"])
+
+        assert [(node["rows_in"], node["rows_out"]) for node in plan] == [
+            (len(data), males),
+            (males, 10),
+            (10, None),
+        ]
+        assert all(node["time_ms"] >= 0 for node in plan)
+
+    def test_analyze_without_data(self):
+        with pytest.raises(ValueError):
+            pyrql.compile("eq(a,1)").explain(analyze=True)
+
+    def test_analyze_error(self):
+        with pytest.raises(RQLQueryError):
+            Query([{"a": 1}, {"a": "x"}]).query("lt(a,5)").explain(analyze=True)
+
+
+class TestAggregate:
+    @pytest.fixture(scope="class")
+    def groups(self, data):
+        groups = {}
+        for row in data:
+            groups.setdefault(row["state"], []).append(row)
+
+        return groups
+
+    def test_many_aggregates(self, data, groups):
+        res = (
+            Query(data)
+            .query("aggregate(state,count(),min(balance),max(index),mean(balance),sum(index))")
+            .all()
+        )
+
+        assert res == [
+            {
+                "state": state,
+                "count": len(rows),
+                "balance": sum(row["balance"] for row in rows) / len(rows),
+                "index": sum(row["index"] for row in rows),
+            }
+            for state, rows in groups.items()
+        ]
+
+    @pytest.mark.parametrize("aggr", ["min", "max", "sum", "mean"])
+    def test_each_aggregate(self, data, groups, aggr):
+        func = {"min": min, "max": max, "sum": sum, "mean": statistics.mean}[aggr]
+        res = Query(data).query(f"aggregate(state,{aggr}(balance))").all()
+        assert res == [
+            {"state": state, "balance": func([row["balance"] for row in rows])}
+            for state, rows in groups.items()
+        ]
+
+    @pytest.mark.parametrize(
+        "values, expected",
+        [
+            ([1, 2, 3], 2),
+            ([1, 2], 1.5),
+            ([1.5, 2.5], 2.0),
+            ([Decimal("1.1"), Decimal("2.2")], Decimal("1.65")),
+        ],
+    )
+    def test_mean_types(self, values, expected):
+        res = Query([{"a": value} for value in values]).query("mean(a)").all()
+        assert res == expected
+        assert type(res) is type(expected)
+
+    @pytest.mark.parametrize(
+        "values",
+        [
+            [1e16, 1, -1e16],
+            [0.1] * 10,
+            [1e100, 1.0, -1e100, 3],
+            [0.1, 0.2, 0.3, 1, 2],
+            [random.Random(i).uniform(-1e6, 1e6) for i in range(1000)],
+        ],
+    )
+    def test_mean_exact(self, values):
+        rows = [{"g": i % 2, "a": value} for i, value in enumerate(values)]
+        assert Query(rows).query("mean(a)").all() == statistics.mean(values)
+
+        res = Query(rows).query("aggregate(g,mean(a))").all()
+        assert res == [
+            {"g": g, "a": statistics.mean(values[g::2])} for g in range(min(2, len(values)))
+        ]
+
+        node = query.Mean("a")
+        state = node.merge(node.partial(rows[::2]), node.partial(rows[1::2]))
+        assert node.finalize(state) == statistics.mean(values)
+
+    @pytest.mark.parametrize(
+        "values",
+        [
+            [1e16, 1.0, -1e16],
+            [0.1] * 10,
+            [1e100, 1.0, -1e100, 3],
+            [0.1, 0.2, 0.3, 1, 2],
+            [random.Random(i).uniform(-1e6, 1e6) for i in range(1000)],
+        ],
+    )
+    def test_sum_exact(self, values):
+        rows = [{"g": i % 2, "a": value} for i, value in enumerate(values)]
+        assert Query(rows).query("sum(a)").all() == math.fsum(values)
+
+        res = Query(rows).query("aggregate(g,sum(a))").all()
+        assert res == [{"g": g, "a": math.fsum(values[g::2])} for g in range(2)]
+
+        node = query.Sum("a")
+        state = node.merge(node.partial(rows[::2]), node.partial(rows[1::2]))
+        assert node.finalize(state) == math.fsum(values)
+
+    @pytest.mark.parametrize(
+        "values, total, mean",
+        [
+            ([1e308, 1e308], math.inf, 1e308),
+            ([-1e308, -1e308], -math.inf, -1e308),
+            ([1e308, 1e308, -1e308], 1e308, 1e308 / 3),
+            ([1e308, math.inf], math.inf, math.inf),
+        ],
+    )
+    def test_sum_overflow(self, values, total, mean):
+        rows = [{"a": value} for value in values]
+        assert Query(rows).query("sum(a)").all() == total
+        assert Query(rows).query("mean(a)").all() == mean
+
+    @pytest.mark.parametrize("aggr", ["min", "max", "mean"])
+    def test_no_values(self, aggr):
+        with pytest.raises(RQLQueryError):
+            Query([]).query(f"{aggr}(a)").all()
+
+    def test_sum_no_values(self):
+        assert Query([]).query("sum(a)").all() == 0
+
+    @pytest.mark.parametrize(
+        "node",
+        [query.Min("a"), query.Max("a"), query.Sum("a"), query.Mean("a"), query.Count()],
+    )
+    def test_merge(self, node):
+        rows = [{"a": value} for value in [5, 3, 8, 1, 9, 2, 7]]
+        shards = [rows[:3], rows[3:], []]
+
+        state = node.init()
+        for shard in shards:
+            partial = node.init()
+            for row in shard:
+                partial = node.step(partial, node.key.get(row))
+            state = node.merge(state, partial)
+
+        assert node.finalize(state) == node(rows)
+
+    def test_step(self):
+        node = query.Mean("a")
+        state = node.init()
+        for value in [1, 2, 3, 4]:
+            state = node.step(state, value)
+
+        assert node.finalize(state) == 2.5
+
+    def test_merge_groups(self, data):
+        aggregate = query.Aggregate("state", query.Count(), query.Mean("balance"))
+        shards = [data[:300], data[300:700], data[700:]]
+
+        groups = {}
+        for shard in shards:
+            groups = aggregate.merge(groups, aggregate.partial(shard))
+
+        assert sorted(aggregate.finalize(groups), key=str) == sorted(aggregate(data), key=str)
+
+    def test_not_accumulator(self, data, groups):
+        # other nodes get all rows of each group
+        aggregate = query.Aggregate("state", query.Values("index"))
+        assert isinstance(aggregate.accumulators[0], query._Rows)
+
+        res = aggregate(data)
+        name = str(aggregate.aggrs[0])
+        assert res == [
+            {"state": state, name: [row["index"] for row in rows]}
+            for state, rows in groups.items()
+        ]
+
+    @pytest.mark.parametrize(
+        "keys",
+        [("state", "gender"), ("gender", "isActive", "eyeColor"), ("position.latitude",)],
+    )
+    def test_composite_key(self, data, keys):
+        expr = f"aggregate(({','.join(keys)}),count(),sum(index))"
+        res = Query(data).query(expr).all()
+
+        groups = {}
+        for row in data:
+            group = tuple(query.Key(key)(row) for key in keys)
+            groups.setdefault(group, []).append(row)
+
+        assert res == [
+            {
+                **dict(zip(keys, group)),
+                "count": len(rows),
+                "index": sum(row["index"] for row in rows),
+            }
+            for group, rows in groups.items()
+        ]
+
+    def test_composite_key_merge(self, data):
+        aggregate = query.Aggregate(("state", "gender"), query.Count())
+        groups = aggregate.merge(aggregate.partial(data[:500]), aggregate.partial(data[500:]))
+        assert sorted(aggregate.finalize(groups), key=str) == sorted(aggregate(data), key=str)
+
+    def test_composite_key_with_filter_and_sort(self, data):
+        res = (
+            Query(data)
+            .query("eq(isActive,true)&aggregate((gender,eyeColor),count())&sort(-count)&limit(2)")
+            .all()
+        )
+        assert [sorted(row) for row in res] == [["count", "eyeColor", "gender"]] * 2
+        assert res[0]["count"] >= res[1]["count"]
+
+    @pytest.mark.parametrize(
+        "expr, func",
+        [
+            ("median(balance)", lambda values: statistics.median(values)),
+            ("median(index)", lambda values: statistics.median(values)),
+            ("variance(index)", lambda values: statistics.variance(values)),
+            ("stddev(index)", lambda values: statistics.stdev(values)),
+            ("variance(position.latitude)", lambda values: statistics.variance(values)),
+            ("first(balance)", lambda values: values[0]),
+            ("last(balance)", lambda values: values[-1]),
+        ],
+    )
+    def test_new_aggregates(self, data, groups, expr, func):
+        key = expr[expr.index("(") + 1 : -1]
+        res = Query(data).query(expr).all()
+        assert res == pytest.approx(func([query.Key(key)(row) for row in data]))
+
+        # there's no sample variance for groups of a single row
+        too_few = expr.startswith(("variance", "stddev"))
+        res = Query(data).query(f"aggregate(state,{expr})").all()
+        assert res == [
+            {
+                "state": state,
+                key: (
+                    None
+                    if too_few and len(rows) < 2
+                    else pytest.approx(func([query.Key(key)(row) for row in rows]))
+                ),
+            }
+            for state, rows in groups.items()
+        ]
+
+    @pytest.mark.parametrize("percent", [0, 10, 25, 50, 75, 90, 99, 100])
+    def test_percentile(self, data, percent):
+        values = [row["index"] for row in data]
+        res = Query(data).query(f"percentile(index,{percent})").all()
+        if percent in (0, 100):
+            assert res == (min(values) if percent == 0 else max(values))
+        else:
+            cuts = statistics.quantiles(values, n=100, method="inclusive")
+            assert res == pytest.approx(cuts[percent - 1])
+
+    def test_percentile_decimal(self, data):
+        values = [row["balance"] for row in data]
+        res = Query(data).query("percentile(balance,25)").all()
+        assert isinstance(res, Decimal)
+        assert res == statistics.quantiles(values, n=4, method="inclusive")[0]
+
+    def test_percentile_dates(self, data):
+        res = Query(data[:999]).query("median(birthdate)").all()
+        assert res == sorted(row["birthdate"] for row in data[:999])[499]
+
+    @pytest.mark.parametrize("expr", ["percentile(index,101)", "percentile(index,-1)"])
+    def test_percentile_invalid(self, expr):
+        with pytest.raises(RQLQueryError):
+            Query([]).query(expr).all()
+
+    @pytest.mark.parametrize("expr", ["median(a)", "percentile(a,50)"])
+    def test_percentile_no_values(self, expr):
+        with pytest.raises(RQLQueryError):
+            Query([]).query(expr).all()
+
+    @pytest.mark.parametrize("values", [[], [1]])
+    def test_variance_too_few_values(self, values):
+        rows = [{"a": value} for value in values]
+        assert Query(rows).query("variance(a)").all() is None
+        assert Query(rows).query("stddev(a)").all() is None
+
+    def test_variance_decimal(self, data):
+        values = [row["balance"] for row in data]
+        assert Query(data).query("variance(balance)").all() == pytest.approx(
+            statistics.variance(values)
+        )
+        assert isinstance(Query(data).query("stddev(balance)").all(), Decimal)
+
+    def test_variance_large_values(self):
+        # a naive sum of squares loses all precision here
+        values = [1e9 + 4, 1e9 + 7, 1e9 + 13, 1e9 + 16]
+        res = Query([{"a": value} for value in values]).query("variance(a)").all()
+        assert res == 30
+
+    def test_first_last_without_key(self, data):
+        assert Query(data).query("first()").all() == [data[0]]
+        assert Query(data).query("last()").all() == [data[-1]]
+        assert Query([]).query("last()").all() == []
+
+    def test_first_last_no_values(self):
+        assert Query([]).query("first(a)").all() is None
+        assert Query([]).query("last(a)").all() is None
+
+    def test_first_last_rows_in_aggregate(self, data, groups):
+        res = Query(data).query("aggregate(state,first(),last())").all()
+        assert res == [
+            {"state": state, "first": rows[0], "last": rows[-1]} for state, rows in groups.items()
+        ]
+
+    def test_last_after_sort(self, data):
+        res = Query(data).query("sort(index)&last()").all()
+        assert res == [max(data, key=operator.itemgetter("index"))]
+
+    @pytest.mark.parametrize(
+        "node",
+        [
+            query.Variance("a"),
+            query.StdDev("a"),
+            query.Median("a"),
+            query.Percentile("a", 90),
+            query.First("a"),
+            query.Last("a"),
+        ],
+    )
+    def test_merge_new_aggregates(self, node):
+        rows = [{"a": value} for value in [5, 3, 8, 1, 9, 2, 7, 4]]
+        shards = [rows[:3], [], rows[3:6], rows[6:]]
+
+        state = node.init()
+        for shard in shards:
+            partial = node.init()
+            for row in shard:
+                partial = node.step(partial, node.key.get(row))
+            state = node.merge(state, partial)
+
+        assert node.finalize(state) == pytest.approx(node(rows))
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import subprocess
+import sys
+import tracemalloc
+from decimal import Decimal
+
+import pytest
+
+from pyrql import Query
+from pyrql import query
+from pyrql.exceptions import RQLQueryError
+from pyrql.sketches import KLL
+from pyrql.sketches import HyperLogLog
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rank(values, value):
+    # the fraction of values below value
+    return sum(v < value for v in values) / len(values)
+
+
+class TestHyperLogLog:
+    @pytest.mark.parametrize("n", [0, 1, 10, 100, 1000, 10000, 100000])
+    def test_count(self, n):
+        sketch = HyperLogLog()
+        for i in range(n):
+            sketch.add(f"user{i}")
+
+        assert abs(sketch.count() - n) <= max(2, n * 0.03)
+
+    @pytest.mark.parametrize("precision", [4, 8, 12, 16])
+    def test_precision(self, precision):
+        sketch = HyperLogLog(precision)
+        for i in range(20000):
+            sketch.add(i)
+
+        assert len(sketch.registers) == 2**precision
+        # a loose bound, about five standard errors
+        assert abs(sketch.count() - 20000) <= 20000 * 5.2 / 2 ** (precision / 2)
+
+    def test_duplicates(self):
+        sketch = HyperLogLog()
+        for i in range(10000):
+            sketch.add(i % 100)
+
+        assert sketch.count() == 100
+
+    def test_equal_numbers(self):
+        a = HyperLogLog()
+        b = HyperLogLog()
+        for i in range(1000):
+            a.add(i)
+            b.add([float(i), Decimal(i)][i % 2])
+
+        assert a.registers == b.registers
+
+    def test_merge(self):
+        whole = HyperLogLog(10)
+        parts = [HyperLogLog(10) for _ in range(4)]
+        for i in range(50000):
+            whole.add(i)
+            parts[i % 4].add(i)
+
+        merged = parts[0]
+        for part in parts[1:]:
+            merged = merged.merge(part)
+
+        assert merged.registers == whole.registers
+        assert merged.count() == whole.count()
+
+    @pytest.mark.parametrize("n", [0, 1, 100, 127, 128, 129, 200, 5000])
+    def test_sparse(self, n):
+        sparse = HyperLogLog()
+        dense = HyperLogLog()
+        dense._sparse, dense._dense = None, bytearray(2**14)
+        for i in range(n):
+            sparse.add(i)
+            dense.add(i)
+
+        assert sparse.registers == dense.registers
+        assert sparse.count() == dense.count()
+
+    def test_merge_sparse_and_dense(self):
+        small = [HyperLogLog() for _ in range(3)]
+        for i in range(3000):
+            small[0].add(i)
+        for i in range(50):
+            small[1].add(i * 7)
+            small[2].add(-i)
+
+        whole = HyperLogLog()
+        for sketch in small:
+            whole = whole.merge(sketch)
+        # in either order
+        assert whole.registers == small[2].merge(small[1]).merge(small[0]).registers
+        assert abs(whole.count() - 3049) < 3049 * 0.03
+
+    def test_small_groups_memory(self):
+        rows = [{"g": i, "x": i} for i in range(2000)]
+        query = Query(rows).query("aggregate(g,approx_count_distinct(x,16))")
+        tracemalloc.start()
+        try:
+            res = query.all()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        assert all(row["x"] == 1 for row in res)
+        # dense registers would be 64 KB for each group, 128 MB in all
+        assert peak < 10 * 2**20
+
+    def test_merge_different_precision(self):
+        with pytest.raises(ValueError):
+            HyperLogLog(10).merge(HyperLogLog(12))
+
+    @pytest.mark.parametrize("precision", [3, 17, 14.0])
+    def test_invalid_precision(self, precision):
+        with pytest.raises(ValueError):
+            HyperLogLog(precision)
+
+    def test_hash_stable_across_processes(self):
+        code = (
+            "from pyrql.sketches import HyperLogLog\n"
+            "s = HyperLogLog(6)\n"
+            "for v in ['a', 'b', 1, 2.5, None, (1, 'x')]: s.add(v)\n"
+            "print(s.registers.hex())"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+            env={"PYTHONHASHSEED": "1234"},
+        ).stdout.strip()
+
+        sketch = HyperLogLog(6)
+        for value in ["a", "b", 1, 2.5, None, (1, "x")]:
+            sketch.add(value)
+
+        assert output == sketch.registers.hex()
+
+
+class TestKLL:
+    @pytest.fixture(scope="class")
+    def values(self):
+        random.seed(0)
+        return [random.gauss(0, 1) for _ in range(100000)]
+
+    @pytest.mark.parametrize("q", [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99])
+    def test_quantile(self, values, q):
+        sketch = KLL()
+        for value in values:
+            sketch.add(value)
+
+        assert abs(rank(values, sketch.quantile(q)) - q) < 0.01
+
+    def test_constant_memory(self, values):
+        sketch = KLL(100)
+        for value in values:
+            sketch.add(value)
+
+        assert len(sketch) == len(values)
+        assert sum(map(len, sketch.levels)) < 300
+
+    def test_exact_when_small(self):
+        sketch = KLL()
+        for value in range(100, 0, -1):
+            sketch.add(value)
+
+        assert sketch.quantile(0) == 1
+        assert sketch.quantile(0.5) == 50
+        assert sketch.quantile(1) == 100
+
+    def test_min_and_max_kept(self, values):
+        sketch = KLL()
+        for value in values:
+            sketch.add(value)
+
+        assert min(values) <= sketch.quantile(0) < sketch.quantile(1) <= max(values)
+
+    def test_merge(self, values):
+        parts = [KLL() for _ in range(8)]
+        for i, value in enumerate(values):
+            parts[i % 8].add(value)
+
+        merged = parts[0]
+        for part in parts[1:]:
+            merged = merged.merge(part)
+
+        assert len(merged) == len(values)
+        assert sum(map(len, merged.levels)) < 600
+        for q in [0.01, 0.5, 0.99]:
+            assert abs(rank(values, merged.quantile(q)) - q) < 0.015
+
+    def test_deterministic(self, values):
+        a = KLL()
+        b = KLL()
+        for value in values[:10000]:
+            a.add(value)
+            b.add(value)
+
+        assert a.levels == b.levels
+
+    def test_merge_different_k(self):
+        with pytest.raises(ValueError):
+            KLL(100).merge(KLL(200))
+
+    def test_empty(self):
+        with pytest.raises(ValueError):
+            KLL().quantile(0.5)
+
+    @pytest.mark.parametrize("k", [4, 100.0])
+    def test_invalid_k(self, k):
+        with pytest.raises(ValueError):
+            KLL(k)
+
+
+class TestApproxAggregates:
+    @pytest.fixture(scope="class")
+    def rows(self):
+        random.seed(0)
+        return [
+            {
+                "group": i % 3,
+                "user": f"user{random.randint(0, 20000)}",
+                "value": random.expovariate(1),
+            }
+            for i in range(60000)
+        ]
+
+    def test_approx_count_distinct(self, rows):
+        res = Query(rows).query("approx_count_distinct(user)").all()
+        exact = len({row["user"] for row in rows})
+        assert abs(res - exact) < exact * 0.03
+
+    def test_approx_count_distinct_precision(self, rows):
+        node = query.ApproxCountDistinct("user", 8)
+        assert node.init().precision == 8
+        assert Query(rows).query("approx_count_distinct(user,8)").all() == node(rows)
+
+    def test_approx_count_distinct_ignores_none(self):
+        rows = [{"a": 1}, {"a": None}, {"a": 2}, {"b": 3}]
+        assert Query(rows).query("approx_count_distinct(a)").all() == 2
+
+    def test_approx_count_distinct_empty(self):
+        assert Query([]).query("approx_count_distinct(a)").all() == 0
+
+    @pytest.mark.parametrize("percent", [1, 50, 95, 99.9])
+    def test_approx_percentile(self, rows, percent):
+        res = Query(rows).query(f"approx_percentile(value,{percent})").all()
+        values = [row["value"] for row in rows]
+        assert abs(rank(values, res) - percent / 100) < 0.01
+
+    def test_approx_percentile_accuracy(self, rows):
+        values = [row["value"] for row in rows]
+        coarse = Query(rows).query("approx_percentile(value,50,16)").all()
+        assert abs(rank(values, coarse) - 0.5) < 0.1
+
+    def test_approx_percentile_ignores_none(self):
+        rows = [{"a": 1}, {"a": None}, {"a": 3}, {"b": 3}, {"a": 2}]
+        assert Query(rows).query("approx_percentile(a,50)").all() == 2
+
+    def test_approx_percentile_empty(self):
+        with pytest.raises(RQLQueryError):
+            Query([]).query("approx_percentile(a,50)").all()
+
+    @pytest.mark.parametrize(
+        "expr",
+        [
+            "approx_count_distinct(a,3)",
+            "approx_count_distinct(a,17)",
+            "approx_count_distinct(a,x)",
+            "approx_percentile(a,101)",
+            "approx_percentile(a,-1)",
+            "approx_percentile(a,50,4)",
+            "approx_percentile(a,50,x)",
+        ],
+    )
+    def test_invalid_args(self, expr):
+        with pytest.raises(RQLQueryError):
+            Query([{"a": 1}]).query(expr).all()
+
+    def test_aggregate(self, rows):
+        res = (
+            Query(rows)
+            .query("aggregate(group,approx_count_distinct(user),approx_percentile(value,90))")
+            .all()
+        )
+
+        assert [row["group"] for row in res] == [0, 1, 2]
+        for row in res:
+            users = {r["user"] for r in rows if r["group"] == row["group"]}
+            values = [r["value"] for r in rows if r["group"] == row["group"]]
+            assert abs(row["user"] - len(users)) < len(users) * 0.03
+            assert abs(rank(values, row["value"]) - 0.9) < 0.015
+
+    def test_merge_shards(self, rows):
+        node = query.Aggregate(
+            "group", query.ApproxCountDistinct("user"), query.ApproxPercentile("value", 50)
+        )
+        groups = {}
+        for i in range(0, len(rows), 7000):
+            groups = node.merge(groups, node.partial(rows[i : i + 7000]))
+
+        res = node.finalize(groups)
+        whole = node(rows)
+
+        # the registers of a merged HyperLogLog are the same as for all data
+        assert [row["user"] for row in res] == [row["user"] for row in whole]
+        for row in res:
+            values = [r["value"] for r in rows if r["group"] == row["group"]]
+            assert abs(rank(values, row["value"]) - 0.5) < 0.015